@@ -0,0 +1,362 @@
+# File: archive.py
+# This file is used to define the archive that old tweets are moved into.  Every tweet that is saved is a separate
+# entity, and the user details are repeated on every one of them, so the number of entities (and the storage they
+# use) grows without limit.  Once tweets are old enough they are folded into a single compressed entity for each
+# rule and day (or a few, for a busy day).  Inside the archive the tweets are stored a column at a time, and the
+# columns that repeat (the user details, the language) are dictionary encoded, so each distinct value is stored
+# once and the rows just hold an index.  The ArchiveReader reads archived and live tweets for a rule together, so
+# the code that reads the history of a rule doesn't need to care where the tweets are kept.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import zlib
+import logging
+import datetime
+
+# import the appengine libraries
+from google.appengine.ext import db
+
+# import the django simplejson lib
+from django.utils import simplejson
+
+# import other gaetools libraries
+import twawlermodel
+
+# initialise some default values (there can't be any tweets from before twitter started)
+EARLIEST_DATE = datetime.date(2006, 3, 1)
+ARCHIVE_FORMAT_VERSION = 1
+UNASSIGNED_RULE = ''
+MAX_BATCH_PUT = 500
+MAX_BATCH_DELETE = 500
+MAX_PART_FETCH = 1000
+
+def _dayStart(day):
+    """
+    This function is used to return the datetime at the start of a day
+    """
+
+    return datetime.datetime(day.year, day.month, day.day)
+
+def queryLiveTweets(ruleName, startDate, endDate):
+    """
+    This function is used to create a query for the tweets found by a rule (that haven't been archived yet) that
+    were created from the start day to the end day (inclusive), in the order they were created.  The query needs
+    an index on the rules and created_at properties of the Tweet model.
+    """
+
+    # the rules are recorded against the tweets in lower case
+    query = twawlermodel.Tweet.all()
+    query.filter('rules =', ruleName.lower())
+    query.filter('created_at >=', _dayStart(startDate))
+    query.filter('created_at <', _dayStart(endDate + datetime.timedelta(days = 1)))
+    query.order('created_at')
+
+    return query
+
+class ColumnDictionary:
+    """
+    The ColumnDictionary is used to dictionary encode a column, each distinct value is given an index the first
+    time it is seen
+    """
+
+    def __init__(self):
+        """
+        Initialise the dictionary
+        """
+
+        self.values = []
+        self._indexes = {}
+
+    def add(self, value):
+        """
+        This method is used to return the index of the value, adding the value to the dictionary if required
+        """
+
+        fnresult = self._indexes.get(value)
+        if fnresult is None:
+            fnresult = len(self.values)
+            self.values.append(value)
+            self._indexes[value] = fnresult
+
+        return fnresult
+
+def encodeTweets(tweets, day):
+    """
+    This function is used to write a list of tweets (Tweet models) created on the specified day into the
+    compressed columnar format used by the archive.  The tweets are stored in id order.
+    """
+
+    # initialise variables
+    start = _dayStart(day)
+    users = ColumnDictionary()
+    toUsers = ColumnDictionary()
+    languages = ColumnDictionary()
+    columns = {'version': ARCHIVE_FORMAT_VERSION, 'ids': [], 'created': [], 'user': [], 'toUser': [], 'lang': [], 'text': []}
+    previousId = 0
+
+    for tweet in sorted(tweets, key = lambda tweet: tweet.tweet_id):
+        # the ids are stored as the difference from the previous id, and the times as seconds into the day
+        columns['ids'].append(tweet.tweet_id - previousId)
+        previousId = tweet.tweet_id
+
+        created = tweet.created_at - start
+        columns['created'].append(created.days * 86400 + created.seconds)
+
+        # the users are stored by key, so the user entities don't need to be read
+        fromUser = twawlermodel.Tweet.from_user.get_value_for_datastore(tweet)
+        toUser = twawlermodel.Tweet.to_user.get_value_for_datastore(tweet)
+
+        columns['user'].append(users.add((str(fromUser), tweet.from_user_name, tweet.profile_image_url)))
+        columns['toUser'].append(toUsers.add(toUser and str(toUser)))
+        columns['lang'].append(languages.add(tweet.iso_language_code))
+        columns['text'].append(tweet.text)
+
+    # add the dictionaries
+    columns['users'] = users.values
+    columns['toUsers'] = toUsers.values
+    columns['langs'] = languages.values
+
+    return zlib.compress(simplejson.dumps(columns, separators = (',', ':')))
+
+def decodeTweets(data, day):
+    """
+    This function is used to read the tweets written by encodeTweets, a list of ArchivedTweet objects is
+    returned in id order
+    """
+
+    # initialise variables
+    fnresult = []
+    start = _dayStart(day)
+    columns = simplejson.loads(zlib.decompress(data))
+    tweetId = 0
+
+    # decode the dictionaries
+    users = [(db.Key(key), name, imageUrl) for (key, name, imageUrl) in columns['users']]
+    toUsers = [key and db.Key(key) for key in columns['toUsers']]
+    languages = columns['langs']
+
+    for (index, delta) in enumerate(columns['ids']):
+        tweetId += delta
+        (fromUser, fromUserName, imageUrl) = users[columns['user'][index]]
+
+        fnresult.append(ArchivedTweet(tweet_id = tweetId,
+                                      created_at = start + datetime.timedelta(seconds = columns['created'][index]),
+                                      from_user = fromUser,
+                                      from_user_name = fromUserName,
+                                      profile_image_url = imageUrl,
+                                      to_user = toUsers[columns['toUser'][index]],
+                                      text = columns['text'][index],
+                                      iso_language_code = languages[columns['lang'][index]]))
+
+    return fnresult
+
+class ArchivedTweet:
+    """
+    The ArchivedTweet class is a lightweight, read only version of a tweet read from the archive.  It has the same
+    attributes as the Tweet model, except that from_user and to_user are the keys of the users rather than the
+    users themselves.
+    """
+
+    def __init__(self, tweet_id, created_at, from_user, from_user_name, profile_image_url, to_user, text, iso_language_code):
+        """
+        Initialise the archived tweet
+        """
+
+        self.tweet_id = tweet_id
+        self.created_at = created_at
+        self.from_user = from_user
+        self.from_user_name = from_user_name
+        self.profile_image_url = profile_image_url
+        self.to_user = to_user
+        self.text = text
+        self.iso_language_code = iso_language_code
+
+    def __str__(self):
+        return "[" + str(self.tweet_id) + "] " + self.from_user_name + ": " + self.text
+
+class TweetArchive(db.Model):
+    """
+    This model is used to store a part of the archive for a rule and day.  Parts are stored against a key name
+    made up of the rule, the day and the range of the tweet ids in the part, so all of the parts for a rule and
+    day sit together in key order and archiving the same tweets again replaces the part rather than adding to it.
+    """
+
+    ruleName = db.StringProperty()
+    date = db.DateProperty(required = True)
+    count = db.IntegerProperty(required = True, default = 0)
+    firstTweetId = db.IntegerProperty(required = True)
+    lastTweetId = db.IntegerProperty(required = True)
+    data = db.BlobProperty(required = True)
+
+    def keyPrefixFor(ruleName, date):
+        """
+        This static method is used to generate the start of the key names of the parts for a rule and day (rule
+        names are always lower case, as they are when they are recorded against the tweets)
+        """
+
+        return u"%s|%s|" % (ruleName.lower(), date.strftime("%Y%m%d"))
+
+    def create(ruleName, date, tweets):
+        """
+        This static method is used to create (but not save) an archive part holding the specified tweets
+        """
+
+        tweetIds = [tweet.tweet_id for tweet in tweets]
+
+        return TweetArchive(key_name = u"%s%020d-%020d" % (TweetArchive.keyPrefixFor(ruleName, date), min(tweetIds), max(tweetIds)),
+                            ruleName = ruleName,
+                            date = date,
+                            count = len(tweets),
+                            firstTweetId = min(tweetIds),
+                            lastTweetId = max(tweetIds),
+                            data = db.Blob(encodeTweets(tweets, date)))
+
+    def archiveTweets(tweets):
+        """
+        This static method is used to move a batch of tweets into the archive.  A part is written for each rule
+        and day in the batch (a tweet found by more than one rule is archived for each of them) and then the
+        tweets are deleted.  The parts are written before anything is deleted, so if we fail part way through
+        the tweets will simply be archived again next time.
+
+        @tweets the Tweet models to archive
+        """
+
+        # read the tweets again just before they are archived, so the parts are written with every rule that has
+        # been recorded against them (a rule that finds a saved tweet adds itself to the tweet's rules)
+        tweets = [tweet for tweet in db.get([tweet.key() for tweet in tweets]) if tweet is not None]
+
+        # group the tweets by rule and day
+        groups = {}
+        for tweet in tweets:
+            for ruleName in tweet.rules or [UNASSIGNED_RULE]:
+                groups.setdefault((ruleName, tweet.created_at.date()), []).append(tweet)
+
+        # write the archive parts
+        parts = [TweetArchive.create(ruleName, date, groupTweets) for ((ruleName, date), groupTweets) in groups.items()]
+        for offset in range(0, len(parts), MAX_BATCH_PUT):
+            db.put(parts[offset:offset + MAX_BATCH_PUT])
+
+        # now delete the tweets
+        keys = [tweet.key() for tweet in tweets]
+        for offset in range(0, len(keys), MAX_BATCH_DELETE):
+            db.delete(keys[offset:offset + MAX_BATCH_DELETE])
+
+        logging.info("archived %s tweets into %s archive parts", len(tweets), len(parts))
+
+        return len(parts)
+
+    def queryParts(ruleName, startDate, endDate, keysOnly = False):
+        """
+        This static method is used to create a query for the archive parts for a rule from the start day to the
+        end day (inclusive), the parts are returned in day order
+        """
+
+        query = TweetArchive.all(keys_only = keysOnly)
+        query.filter('__key__ >=', db.Key.from_path('TweetArchive', TweetArchive.keyPrefixFor(ruleName, startDate)))
+        query.filter('__key__ <', db.Key.from_path('TweetArchive', TweetArchive.keyPrefixFor(ruleName, endDate + datetime.timedelta(days = 1))))
+        query.order('__key__')
+
+        return query
+
+    def findParts(ruleName, date):
+        """
+        This static method is used to read all of the archive parts for a rule and day
+        """
+
+        return TweetArchive.queryParts(ruleName, date, date).fetch(MAX_PART_FETCH)
+
+    def findTweets(date, tweetIds):
+        """
+        This static method is used to read the archived tweets with the specified ids that were created on a day,
+        whichever rules they were archived for.  Only the parts whose range of ids covers one of the tweets we 
+        are looking for are decoded.  A dict mapping the tweet ids to the ArchivedTweet objects that were found
+        is returned.
+        """
+
+        # initialise variables
+        fnresult = {}
+        wanted = set(tweetIds)
+
+        query = TweetArchive.all()
+        query.filter('date =', date)
+
+        for part in query:
+            # once we have found all of the tweets, then there is no need to go any further
+            if not wanted:
+                break
+
+            if (part.lastTweetId < min(wanted)) or (part.firstTweetId > max(wanted)):
+                continue
+
+            for tweet in decodeTweets(part.data, date):
+                if tweet.tweet_id in wanted:
+                    fnresult[tweet.tweet_id] = tweet
+                    wanted.discard(tweet.tweet_id)
+
+        return fnresult
+
+    keyPrefixFor = staticmethod(keyPrefixFor)
+    create = staticmethod(create)
+    archiveTweets = staticmethod(archiveTweets)
+    queryParts = staticmethod(queryParts)
+    findParts = staticmethod(findParts)
+    findTweets = staticmethod(findTweets)
+
+class ArchiveReader:
+    """
+    The ArchiveReader is used to iterate through the tweets found by a rule over a number of days, whether the
+    tweets have been archived or not.  The days are read in order, and the tweets for each day are read as they
+    are needed so the reader can be used to stream through a long history.  Reading the live tweets needs an
+    index on the rules and created_at properties of the Tweet model (see queryLiveTweets).
+    """
+
+    def __init__(self, ruleName, startDate, endDate):
+        """
+        Initialise the reader
+
+        @ruleName the name of the rule to read the tweets for
+        @startDate the first day to read
+        @endDate the last day to read
+        """
+
+        # initialise members
+        self.ruleName = ruleName.lower()
+        self.startDate = startDate
+        self.endDate = endDate
+
+    def readDay(self, date):
+        """
+        This method is used to iterate through the tweets for a single day, the archived tweets are returned
+        first followed by the tweets that haven't been archived yet
+        """
+
+        # initialise variables (a tweet can end up in more than one part if a batch was archived twice)
+        seenIds = set()
+
+        for part in TweetArchive.findParts(self.ruleName, date):
+            for tweet in decodeTweets(part.data, date):
+                if tweet.tweet_id not in seenIds:
+                    seenIds.add(tweet.tweet_id)
+                    yield tweet
+
+        # the tweets that were saved before rules were recorded against them have only been archived
+        if self.ruleName == UNASSIGNED_RULE:
+            return
+
+        for tweet in queryLiveTweets(self.ruleName, date, date):
+            if tweet.tweet_id not in seenIds:
+                yield tweet
+
+    def __iter__(self):
+        """
+        This method is used to iterate through the tweets for all of the days
+        """
+
+        date = self.startDate
+        while date <= self.endDate:
+            for tweet in self.readDay(date):
+                yield tweet
+
+            date += datetime.timedelta(days = 1)
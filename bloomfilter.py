@@ -0,0 +1,219 @@
+# File: bloomfilter.py
+# This file is used to define a bloom filter, and a time windowed filter (kept in memcache) that uses bloom filters
+# to remember which tweets have already been seen.  When rules overlap the same tweet is found by more than one
+# rule, and the filter lets us skip tweets we have already saved without having to ask the datastore about every
+# tweet on the page.  A bloom filter can give false positives (but never false negatives) so anything the filter
+# thinks it has seen still needs to be confirmed against the datastore.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import math
+import time
+import zlib
+import array
+import struct
+import hashlib
+import logging
+
+# import the appengine libraries
+from google.appengine.api import memcache
+
+# import other gaetools libraries
+import cachehelper
+
+# initialise some default values
+DEFAULT_CAPACITY = 50000
+DEFAULT_ERROR_RATE = 0.01
+DEFAULT_WINDOW_LENGTH = 21600
+DEFAULT_REFRESH_INTERVAL = 60
+
+# define the layout of the header written in front of the bits of a serialized filter
+HEADER_FORMAT = '<II'
+
+class BloomFilter(object):
+    """
+    The BloomFilter class is a simple bloom filter, stored as an array of bytes.  The positions of the bits for a
+    value are generated from a single md5 digest of the value (using double hashing) so adding or checking a value
+    is cheap no matter how many hash functions the filter needs.
+    """
+
+    def __init__(self, capacity = DEFAULT_CAPACITY, errorRate = DEFAULT_ERROR_RATE):
+        """
+        Initialise the filter, the filter is sized so that the false positive rate will be no more than the error
+        rate until the capacity has been reached.
+
+        @capacity the number of values the filter is expected to hold
+        @errorRate the acceptable false positive rate
+        """
+
+        # work out the size of the filter
+        self.bitCount = int(math.ceil(-capacity * math.log(errorRate) / (math.log(2) ** 2)))
+        self.hashCount = max(1, int(round(self.bitCount * math.log(2) / capacity)))
+
+        # initialise the bits
+        self.bits = array.array('B', [0]) * ((self.bitCount + 7) // 8)
+
+    def _positions(self, value):
+        """
+        This method is used to get the positions of the bits for the specified value
+        """
+
+        (hash1, hash2) = struct.unpack('<QQ', hashlib.md5(str(value)).digest())
+
+        return [(hash1 + index * hash2) % self.bitCount for index in range(self.hashCount)]
+
+    def add(self, value):
+        """
+        This method is used to add a value to the filter
+        """
+
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        """
+        This method is used to check whether the filter might contain the specified value
+        """
+
+        for position in self._positions(value):
+            if not (self.bits[position >> 3] & (1 << (position & 7))):
+                return False
+
+        return True
+
+    def serialize(self):
+        """
+        This method is used to write the filter to a (compressed) string
+        """
+
+        return zlib.compress(struct.pack(HEADER_FORMAT, self.bitCount, self.hashCount) + self.bits.tostring())
+
+    @staticmethod
+    def deserialize(data):
+        """
+        This static method is used to read a filter that was written using serialize
+        """
+
+        data = zlib.decompress(data)
+        headerSize = struct.calcsize(HEADER_FORMAT)
+
+        # create an empty filter and then fill in the details
+        fnresult = BloomFilter.__new__(BloomFilter)
+        (fnresult.bitCount, fnresult.hashCount) = struct.unpack(HEADER_FORMAT, data[:headerSize])
+        fnresult.bits = array.array('B')
+        fnresult.bits.fromstring(data[headerSize:])
+
+        return fnresult
+
+class SeenTweetFilter:
+    """
+    The SeenTweetFilter is used to remember the ids of the tweets that have been saved recently.  A new bloom filter
+    is started for each window of time, and the current and previous windows are checked, so a tweet is remembered
+    for at least one full window.  The filters are kept in memcache so they are shared by every instance.  If a
+    filter is lost (or updates from two instances collide) we just forget some tweets, which means they will be
+    written again rather than being skipped.
+    """
+
+    def __init__(self, name = "tweets", windowLength = DEFAULT_WINDOW_LENGTH, capacity = DEFAULT_CAPACITY, errorRate = DEFAULT_ERROR_RATE, refreshInterval = DEFAULT_REFRESH_INTERVAL):
+        """
+        Initialise the filter
+
+        @name the name of the filter, filters with the same name share the same state
+        @windowLength the number of seconds covered by each bloom filter
+        @capacity the number of values each bloom filter is expected to hold
+        @errorRate the acceptable false positive rate of each bloom filter
+        @refreshInterval the number of seconds before the filters will be read from memcache again
+        """
+
+        # initialise members
+        self.windowLength = windowLength
+        self.capacity = capacity
+        self.errorRate = errorRate
+        self.refreshInterval = refreshInterval
+        self.keyPrefix = cachehelper.createCacheKey("seenfilter", name, "")
+
+        # initialise the filters (these are loaded as required)
+        self._window = None
+        self._current = None
+        self._previous = None
+        self._loadedAt = 0
+        self._pending = []
+
+    def _readFilter(self, data):
+        """
+        This method is used to read a filter from memcache, returning None if the data could not be read
+        """
+
+        if data is None:
+            return None
+
+        try:
+            return BloomFilter.deserialize(data)
+        except (zlib.error, struct.error), err:
+            logging.warning("Unable to read the seen tweet filter: %s", err)
+            return None
+
+    def load(self):
+        """
+        This method is used to read the filters for the current and previous windows from memcache.  The filters
+        are only read if the window has moved on, or they haven't been read for a while.
+        """
+
+        now = time.time()
+        window = int(now) // self.windowLength
+
+        # if the filters are up to date, then there is nothing to do
+        if (window == self._window) and (now - self._loadedAt < self.refreshInterval):
+            return
+
+        # read the filters
+        data = memcache.get_multi([str(window), str(window - 1)], key_prefix = self.keyPrefix)
+        self._current = self._readFilter(data.get(str(window))) or BloomFilter(self.capacity, self.errorRate)
+        self._previous = self._readFilter(data.get(str(window - 1)))
+        self._window = window
+        self._loadedAt = now
+        self._pending = []
+
+    def mightContain(self, value):
+        """
+        This method is used to check whether a value might have been seen, load must have been called first
+        """
+
+        return (value in self._current) or ((self._previous is not None) and (value in self._previous))
+
+    def addMany(self, values):
+        """
+        This method is used to add a number of values to the filter, the values won't be shared with the other
+        instances until save is called
+        """
+
+        for value in values:
+            self._current.add(value)
+
+        self._pending.extend(values)
+
+    def save(self):
+        """
+        This method is used to write the filter for the current window to memcache.  The filter is read again
+        first and the values added since it was loaded are added to it, so we don't lose the values added by
+        other instances in the meantime.
+        """
+
+        # if nothing has been added, then there is nothing to save
+        if not self._pending:
+            return
+
+        # merge our values into the latest version of the filter
+        latest = self._readFilter(memcache.get(self.keyPrefix + str(self._window)))
+        if latest is not None:
+            for value in self._pending:
+                latest.add(value)
+
+            self._current = latest
+            self._loadedAt = time.time()
+
+        # the filter needs to stay around until it is no longer the previous window
+        memcache.set(self.keyPrefix + str(self._window), self._current.serialize(), time = self.windowLength * 2)
+        self._pending = []
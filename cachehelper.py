@@ -17,3 +17,112 @@ def createCacheKey(keyPrefix, *keyNames):
             fnresult += "_" + keyName
         
     return fnresult
+
+# define the default number of entries held by an in-process cache
+DEFAULT_LRU_SIZE = 1000
+
+class LRUCache:
+    """
+    The LRUCache is a simple bounded cache that lives in the memory of the current instance.  It is useful
+    for sitting in front of memcache for values that are requested over and over again, as the values survive 
+    between requests for as long as the instance does.  Once the cache is full the least recently used entry 
+    is discarded to make room for the new one.
+    """
+    
+    def __init__(self, maxSize = DEFAULT_LRU_SIZE):
+        """
+        Initialise the cache
+        
+        @maxSize the maximum number of entries that will be held in the cache
+        """
+        
+        # initialise members
+        self.maxSize = maxSize
+        self._entries = {}
+        
+        # the entries are also kept in a circular linked list (of [prev, next, key, value] links) in the order
+        # they were used, the root link sits between the most and least recently used entries
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return key in self._entries
+        
+    def _unlink(self, link):
+        """
+        This method is used to remove a link from the usage list
+        """
+        
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+        
+    def _append(self, link):
+        """
+        This method is used to add a link to the most recently used end of the usage list
+        """
+        
+        last = self._root[0]
+        link[0] = last
+        link[1] = self._root
+        last[1] = link
+        self._root[0] = link
+        
+    def get(self, key, default = None):
+        """
+        This method is used to get a value from the cache, returning the default if the key is not cached
+        """
+        
+        # look for the entry
+        link = self._entries.get(key)
+        if link is None:
+            return default
+        
+        # mark the entry as the most recently used
+        self._unlink(link)
+        self._append(link)
+        
+        return link[3]
+    
+    def set(self, key, value):
+        """
+        This method is used to add a value to the cache, discarding the least recently used value if required
+        """
+        
+        # if the key is already cached, then just update the value
+        link = self._entries.get(key)
+        if link is not None:
+            link[3] = value
+            self._unlink(link)
+            self._append(link)
+            return
+        
+        # if the cache is full, then remove the oldest entry
+        if len(self._entries) >= self.maxSize:
+            oldest = self._root[1]
+            self._unlink(oldest)
+            del self._entries[oldest[2]]
+            
+        # add the new entry
+        link = [None, None, key, value]
+        self._append(link)
+        self._entries[key] = link
+        
+    def delete(self, key):
+        """
+        This method is used to remove a value from the cache
+        """
+        
+        link = self._entries.pop(key, None)
+        if link is not None:
+            self._unlink(link)
+            
+    def clear(self):
+        """
+        This method is used to empty the cache
+        """
+        
+        self._entries = {}
+        self._root[:] = [self._root, self._root, None, None]
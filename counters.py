@@ -0,0 +1,117 @@
+# File: counters.py
+# This file is used to define a sharded counter.  A count that is updated by a number of tasks at the same time
+# (such as the number of tweets found for a popular rule) can't be kept on a single entity, as the tasks contend
+# for the entity and the datastore limits how often a single entity can be written.  Instead the count is split
+# across a number of shards, each increment updates a shard picked at random, and the total is the sum of the
+# shards (which is cached).
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import random
+import logging
+
+# import the appengine libraries
+from google.appengine.ext import db
+from google.appengine.api import memcache
+
+# import other gaetools libraries
+import cachehelper
+
+# initialise some default values
+DEFAULT_SHARD_COUNT = 10
+COUNTER_CACHE_TIME = 600
+
+class CounterShard(db.Model):
+    """
+    This model is used to store one of the shards of a sharded counter.  Shards are stored against a key made
+    up of the name of the counter and the index of the shard.
+    """
+
+    name = db.StringProperty(required = True)
+    count = db.IntegerProperty(required = True, default = 0)
+
+class ShardedCounter:
+    """
+    The ShardedCounter class is used to increment and read a counter that is split across a number of shards.  The
+    number of shards can be increased but should never be decreased, as the counts held by the shards that are
+    dropped would be lost.
+    """
+
+    def __init__(self, name, shardCount = DEFAULT_SHARD_COUNT):
+        """
+        Initialise the counter
+
+        @name the name of the counter
+        @shardCount the number of shards the count is split across
+        """
+
+        # initialise members
+        self.name = name
+        self.shardCount = shardCount
+        self.cacheKey = cachehelper.createCacheKey("counter", name)
+
+    def shardKeyName(self, index):
+        """
+        This method is used to return the key name of the specified shard
+        """
+
+        return "%s_%d" % (self.name, index)
+
+    def shardKeys(self):
+        """
+        This method is used to return the keys of all of the shards of the counter (whether they have been
+        written or not), so the counter can be deleted along with whatever it was counting
+        """
+
+        return [db.Key.from_path('CounterShard', self.shardKeyName(index)) for index in range(self.shardCount)]
+
+    def increment(self, delta = 1):
+        """
+        This method is used to add to the count, a shard is picked at random and updated in a transaction
+
+        @delta the amount to add to the count
+        """
+
+        # if there is nothing to add, then don't bother writing anything
+        if not delta:
+            return
+
+        keyName = self.shardKeyName(random.randint(0, self.shardCount - 1))
+
+        def incrementShard():
+            shard = CounterShard.get_by_key_name(keyName)
+            if shard is None:
+                shard = CounterShard(key_name = keyName, name = self.name, count = 0)
+
+            shard.count += delta
+            shard.put()
+
+        db.run_in_transaction(incrementShard)
+
+        # keep the cached total up to date (if it isn't cached, then it will be summed the next time it is read)
+        memcache.incr(self.cacheKey, delta)
+
+    def getCount(self):
+        """
+        This method is used to read the count, the total of the shards is cached so most reads won't need to
+        touch the datastore
+        """
+
+        # check the cache first
+        fnresult = memcache.get(self.cacheKey)
+        if fnresult is not None:
+            return fnresult
+
+        # sum the shards
+        fnresult = 0
+        for shard in CounterShard.get_by_key_name([self.shardKeyName(index) for index in range(self.shardCount)]):
+            if shard is not None:
+                fnresult += shard.count
+
+        # cache the total (if someone else has beaten us to it, then their total is at least as up to date as ours)
+        if not memcache.add(self.cacheKey, fnresult, time = COUNTER_CACHE_TIME):
+            logging.debug("total for counter %s was cached while it was being summed", self.name)
+
+        return fnresult
@@ -0,0 +1,145 @@
+# File: datehelper.py
+# This file is used to define some helper functions for dealing with the dates returned by twitter.  Parsing
+# the created_at date of every tweet with strptime turned out to be one of the more expensive parts of twawling,
+# so the functions in here pick the date apart by position instead (with strptime kept as a fallback).
+#
+# The module can be run directly to run a simple benchmark of the parser against strptime.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import time
+import random
+import logging
+import datetime
+
+# define the date time formats used by twitter (the twitter module uses these as well)
+DATETIME_FORMAT_TWITTERSEARCH = "%a, %d %b %Y %H:%M:%S +0000"
+DATETIME_FORMAT_TWITTER = "%a %b %d %H:%M:%S +0000 %Y"
+
+# define the months (the same abbreviations are used for both formats)
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
+# define the maximum number of parsed dates we will hold on to
+DEFAULT_PARSE_CACHE_SIZE = 4096
+
+# initialise the cache of parsed dates.  Lots of tweets share the same created_at date (especially on busy
+# searches) so it is worth holding on to the dates we have already parsed
+_parseCache = {}
+
+def _parseFixed(value):
+    """
+    This function is used to parse a date in either of the twitter formats by reading each part of the date from
+    its fixed position in the string.  The function returns None if the value is not laid out as we expect.
+
+    @value the date string to parse
+    """
+
+    # check for the standard twitter format: Wed Aug 27 13:08:45 +0000 2008
+    if (len(value) == 30) and (value[19:26] == ' +0000 ') and (value[13] == ':') and (value[16] == ':'):
+        return datetime.datetime(int(value[26:30]), MONTHS[value[4:7]], int(value[8:10]),
+                                 int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+    # check for the search format: Wed, 27 Aug 2008 13:08:45 +0000
+    if (len(value) == 31) and (value[25:31] == ' +0000') and (value[19] == ':') and (value[22] == ':'):
+        return datetime.datetime(int(value[12:16]), MONTHS[value[8:11]], int(value[5:7]),
+                                 int(value[17:19]), int(value[20:22]), int(value[23:25]))
+
+    return None
+
+def parseUncached(value, dateFormat = DATETIME_FORMAT_TWITTER):
+    """
+    This function is used to parse a twitter date without using the cache.  The fixed position parser is tried
+    first, and if the value doesn't look like one of the twitter formats then we fall back to strptime.
+
+    @value the date string to parse
+    @dateFormat the format the date is expected to be in, this is only used if we have to fall back to strptime
+    """
+
+    # try the fast parser first
+    try:
+        fnresult = _parseFixed(value)
+    except (KeyError, ValueError):
+        fnresult = None
+
+    # if the value was not what we expected, then let strptime deal with it
+    if fnresult is None:
+        logging.debug("unexpected date format, falling back to strptime for %s", value)
+        fnresult = datetime.datetime.strptime(value, dateFormat)
+
+    return fnresult
+
+def parseTwitterDate(value, dateFormat = DATETIME_FORMAT_TWITTER):
+    """
+    This function is used to parse a date returned by twitter (in either the standard or search format) into
+    a datetime.  Dates that have already been parsed are returned from a cache.
+
+    @value the date string to parse
+    @dateFormat the format the date is expected to be in, this is only used if we have to fall back to strptime
+    """
+
+    # check the cache first
+    fnresult = _parseCache.get(value)
+    if fnresult is not None:
+        return fnresult
+
+    # parse the date
+    fnresult = parseUncached(value, dateFormat)
+
+    # add the date to the cache (we just start again once the cache is full, it's cheaper than tracking usage)
+    if len(_parseCache) >= DEFAULT_PARSE_CACHE_SIZE:
+        _parseCache.clear()
+
+    _parseCache[value] = fnresult
+
+    return fnresult
+
+def benchmark(iterations = 20000, distinctDates = 500):
+    """
+    This function is used to compare the performance of the date parser against strptime.  The function returns
+    a dict of the time taken (in seconds) to parse the dates using strptime, the fixed position parser, and the
+    cached parser.
+
+    @iterations the number of dates to parse with each method
+    @distinctDates the number of different dates to use, a smaller number will show more benefit from the cache
+    """
+
+    # generate some dates to parse (spread across both formats)
+    startDate = datetime.datetime(2010, 1, 1)
+    samples = []
+    for index in range(distinctDates):
+        sampleDate = startDate + datetime.timedelta(seconds = random.randint(0, 86400 * 365))
+
+        if index % 2:
+            samples.append((sampleDate.strftime(DATETIME_FORMAT_TWITTERSEARCH), DATETIME_FORMAT_TWITTERSEARCH))
+        else:
+            samples.append((sampleDate.strftime(DATETIME_FORMAT_TWITTER), DATETIME_FORMAT_TWITTER))
+
+    values = [samples[index % distinctDates] for index in range(iterations)]
+
+    # check the parsers agree before we start timing them
+    for (value, dateFormat) in samples:
+        assert parseUncached(value, dateFormat) == datetime.datetime.strptime(value, dateFormat)
+
+    # time each of the methods
+    fnresult = {}
+    for (name, parser) in [('strptime', datetime.datetime.strptime), ('fixed', parseUncached), ('cached', parseTwitterDate)]:
+        _parseCache.clear()
+
+        started = time.time()
+        for (value, dateFormat) in values:
+            parser(value, dateFormat)
+
+        fnresult[name] = time.time() - started
+
+    return fnresult
+
+if __name__ == "__main__":
+    results = benchmark()
+
+    for name in ('strptime', 'fixed', 'cached'):
+        print "%-10s %.4fs (%.1fx)" % (name, results[name], results['strptime'] / max(results[name], 0.000001))
@@ -0,0 +1,291 @@
+# File: export.py
+# This file is used to export the tweets found by a rule over a range of days.  The tweets are formatted a line at
+# a time (as newline delimited json, or csv) by a generator, so an export never needs to hold more than a batch of
+# tweets in memory.  The ExportTask walks through the days a batch at a time (the archived and then the live tweets
+# for each day), and checkpoints how far it has got after every batch, so an export that is too big for a single
+# slice carries on where it left off in the next slice.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import csv
+import logging
+import datetime
+import cStringIO
+
+# import the django simplejson lib
+from django.utils import simplejson
+
+# import other gaetools libraries
+import slicer
+import archive
+import twawlermodel
+
+# define the export formats, and the fields that are exported
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+EXPORT_FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+EXPORT_FIELDS = ('tweet_id', 'created_at', 'from_user_id', 'from_user_name', 'to_user_id', 'text', 'iso_language_code', 'profile_image_url')
+
+# initialise some default values
+DEFAULT_EXPORT_BATCH_SIZE = 500
+MIN_EXPORT_INTERVAL = datetime.timedelta(seconds = 5)
+
+# define the positions of an export within a day, the archived tweets are exported first and then the live tweets
+POSITION_ARCHIVE = 'archive'
+POSITION_LIVE = 'live'
+
+def _userId(key):
+    """
+    This function is used to get the twitter id of a user from the key of the user (see TwitterUser.keyNameFor)
+    """
+
+    if (key is None) or (not key.name()):
+        return None
+
+    return key.name()[1:]
+
+def exportRow(tweet):
+    """
+    This function is used to get the values of the exported fields for a tweet (either a Tweet model or an
+    archive.ArchivedTweet), as a dict.  The users are exported by id so they don't have to be read.
+    """
+
+    if isinstance(tweet, twawlermodel.Tweet):
+        fromUser = twawlermodel.Tweet.from_user.get_value_for_datastore(tweet)
+        toUser = twawlermodel.Tweet.to_user.get_value_for_datastore(tweet)
+    else:
+        fromUser = tweet.from_user
+        toUser = tweet.to_user
+
+    return {'tweet_id': tweet.tweet_id,
+            'created_at': tweet.created_at.isoformat(),
+            'from_user_id': _userId(fromUser),
+            'from_user_name': tweet.from_user_name,
+            'to_user_id': _userId(toUser),
+            'text': tweet.text,
+            'iso_language_code': tweet.iso_language_code,
+            'profile_image_url': tweet.profile_image_url}
+
+def formatTweets(tweets, format = FORMAT_NDJSON, header = False):
+    """
+    This generator is used to format tweets for export, a (utf-8 encoded) line is yielded for each tweet
+
+    @tweets the tweets to format, this can be any iterable (including another generator)
+    @format the export format, either FORMAT_NDJSON or FORMAT_CSV
+    @header if True then a header line is written first (this only applies to csv)
+    """
+
+    if format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format '%s'" % format)
+
+    # newline delimited json doesn't need anything special
+    if format == FORMAT_NDJSON:
+        for tweet in tweets:
+            yield simplejson.dumps(exportRow(tweet)) + "\n"
+
+        return
+
+    # the csv writer writes to a buffer that we empty after every line (the writer doesn't understand unicode,
+    # so the values are encoded first)
+    buffer = cStringIO.StringIO()
+    writer = csv.writer(buffer)
+
+    def formatLine(values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([('' if (value is None) else unicode(value).encode('utf-8')) for value in values])
+
+        return buffer.getvalue()
+
+    if header:
+        yield formatLine(EXPORT_FIELDS)
+
+    for tweet in tweets:
+        row = exportRow(tweet)
+        yield formatLine([row[field] for field in EXPORT_FIELDS])
+
+class ExportTask(slicer.SlicedTask):
+    """
+    The ExportTask is used to export the tweets found by a rule over a range of days to an output.  The days are
+    exported in order, and for each day the archived tweets for the rule are exported a part at a time and then
+    the live tweets a batch at a time, using query cursors.  A tweet can be in more than one archive part, or in 
+    the archive and still live (if the archiving of a batch was interrupted), but the tweets of a day come back
+    in id order, so the id of the last tweet exported for the day is kept and tweets up to it are skipped.  After
+    each batch has been written the position of the export (and the last id exported for the day) is saved in a 
+    checkpoint named after the export, so running the task again with the same name carries on from where the 
+    last slice finished.
+
+    The output can be anything with a write method, and it needs to be appended to by every slice of the export
+    (a file that is reopened for appending for instance).  If a slice dies after writing a batch but before the
+    checkpoint is saved then the batch will be written again, so the consumer of the export should ignore repeated
+    tweet ids.
+    """
+
+    def __init__(self, exportName, ruleName, startDate, endDate, output, format = FORMAT_NDJSON, batchSize = DEFAULT_EXPORT_BATCH_SIZE, maxInterval = slicer.DEFAULT_MAX_INTERVAL):
+        """
+        Initialise the new ExportTask object
+
+        @exportName the name of the export, this is used to name the checkpoint
+        @ruleName the name of the rule to export the tweets for
+        @startDate the first day to export
+        @endDate the last day to export
+        @output the object the formatted lines are written to
+        @format the export format, either FORMAT_NDJSON or FORMAT_CSV
+        @batchSize the number of live tweets exported at a time
+        """
+
+        # call the inherited constructor
+        slicer.SlicedTask.__init__(self, maxInterval)
+
+        # check the format now, rather than after we have started
+        if format not in EXPORT_FORMATS:
+            raise ValueError("Unknown export format '%s'" % format)
+
+        # initialise members
+        self.exportName = exportName
+        self.ruleName = ruleName.lower()
+        self.startDate = startDate
+        self.endDate = endDate
+        self.output = output
+        self.format = format
+        self.batchSize = batchSize
+        self.checkpoint = None
+
+    def setup(self, request):
+        """
+        This method is used to load the checkpoint of the export
+        """
+
+        # call the inherited setup
+        slicer.SlicedTask.setup(self, request)
+
+        self.checkpoint = slicer.TaskCheckpoint.findOrCreate("export_%s" % self.exportName)
+        if self.checkpoint.complete:
+            logging.info("export %s has already been completed", self.exportName)
+            self.taskComplete = True
+            
+    def getPosition(self):
+        """
+        This method is used to read the day, the position within the day and the id of the last tweet exported 
+        for the day from the checkpoint
+        """
+        
+        if not self.checkpoint.position:
+            return (self.startDate, POSITION_ARCHIVE, 0)
+        
+        (positionDate, position, lastId) = self.checkpoint.position.split(':')
+        
+        return (datetime.datetime.strptime(positionDate, "%Y%m%d").date(), position, long(lastId))
+    
+    def setPosition(self, date, position, lastId = 0, cursor = None):
+        """
+        This method is used to move the checkpoint to a new position (the checkpoint is not saved)
+        """
+        
+        self.checkpoint.position = "%s:%s:%d" % (date.strftime("%Y%m%d"), position, lastId)
+        self.checkpoint.cursor = cursor
+        
+    def unseenTweets(self, tweets, lastId):
+        """
+        This method is used to remove the tweets up to the last id exported for the day from a batch (the 
+        tweets are in id order)
+        """
+        
+        return [tweet for tweet in tweets if tweet.tweet_id > lastId]
+
+    def nextBatch(self):
+        """
+        This method is used to read the next batch of tweets to export and move the checkpoint on past them
+        (the checkpoint is not saved)
+        """
+
+        (date, position, lastId) = self.getPosition()
+
+        while date <= self.endDate:
+            # export the archived tweets for the day a part at a time
+            if position == POSITION_ARCHIVE:
+                query = archive.TweetArchive.queryParts(self.ruleName, date, date)
+                if self.checkpoint.cursor:
+                    query.with_cursor(self.checkpoint.cursor)
+
+                parts = query.fetch(1)
+                if parts:
+                    fnresult = self.unseenTweets(archive.decodeTweets(parts[0].data, parts[0].date), lastId)
+                    self.setPosition(date, POSITION_ARCHIVE, max([lastId] + [tweet.tweet_id for tweet in fnresult]), query.cursor())
+                    return fnresult
+
+                # we have reached the end of the archive for the day, so move on to the live tweets
+                self.setPosition(date, POSITION_LIVE, lastId)
+
+            # export the live tweets for the day (the tweets that were saved before rules were recorded against 
+            # them have only been archived)
+            fnresult = []
+            if self.ruleName != archive.UNASSIGNED_RULE:
+                query = archive.queryLiveTweets(self.ruleName, date, date)
+                if self.checkpoint.cursor:
+                    query.with_cursor(self.checkpoint.cursor)
+
+                tweets = query.fetch(self.batchSize)
+                fnresult = self.unseenTweets(tweets, lastId)
+
+                # if the batch was full, then there may be more tweets for the day
+                if len(tweets) == self.batchSize:
+                    self.setPosition(date, POSITION_LIVE, max([lastId] + [tweet.tweet_id for tweet in fnresult]), query.cursor())
+                    return fnresult
+
+            # the day is done, so move on to the next one
+            date += datetime.timedelta(days = 1)
+            (position, lastId) = (POSITION_ARCHIVE, 0)
+            self.setPosition(date, position)
+
+            if fnresult:
+                return fnresult
+                
+            # don't walk through any more empty days than we have time for
+            if self.getTimeRemaining() < MIN_EXPORT_INTERVAL:
+                return []
+
+        # we have been through all of the days
+        self.checkpoint.complete = True
+
+        return []
+
+    def runTask(self, sliceAction):
+        """
+        This method is used to export the next batch of tweets, returning True once the export is complete or we
+        don't have time for another batch
+        """
+
+        # call inherited functionality
+        slicer.SlicedTask.runTask(self, sliceAction)
+
+        # make sure we have enough time left to export a batch
+        if self.getTimeRemaining() < MIN_EXPORT_INTERVAL:
+            logging.debug("not enough time remaining to export another batch")
+            return True
+
+        # the csv header is written before the first batch
+        header = (self.checkpoint.processedCount == 0) and (self.checkpoint.position is None)
+
+        # write the batch and then save the checkpoint
+        tweets = self.nextBatch()
+        for line in formatTweets(tweets, self.format, header):
+            self.output.write(line)
+
+        self.checkpoint.processedCount += len(tweets)
+        self.checkpoint.put()
+
+        return self.checkpoint.complete
+
+    def tearDown(self):
+        """
+        This method is used to log how far the export has got
+        """
+
+        if self.checkpoint is not None:
+            logging.info("exported %s tweets for %s so far (complete = %s)", self.checkpoint.processedCount, self.exportName, self.checkpoint.complete)
+
+        # call the inherited tear down
+        slicer.SlicedTask.tearDown(self)
@@ -0,0 +1,281 @@
+# File: inspectors.py
+# This file is used to define the tweet inspectors that gaetools provides.  Inspectors decide whether a tweet is
+# worth saving, and most of them do this by looking for keywords or hashtags in the text of the tweet.  Rather than
+# each of these inspectors scanning the text of every tweet separately, the inspectors are compiled into a single
+# matcher (an Aho-Corasick automaton) so the text of each tweet is only scanned once no matter how many keywords
+# we are looking for.  The compiled inspector works on a whole page of tweets at a time.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import logging
+
+class KeywordMatcher:
+    """
+    The KeywordMatcher is used to find any of a number of patterns in a piece of text in a single pass.  Each pattern
+    is given a value, and matching text returns the set of values of the patterns that were found.  Matching is not
+    case sensitive, and by default patterns only match whole words.
+    """
+
+    def __init__(self, wholeWords = True):
+        """
+        Initialise the matcher
+
+        @wholeWords if True then a pattern will only match if it isn't part of a longer word
+        """
+
+        # initialise members
+        self.wholeWords = wholeWords
+        self.patternCount = 0
+
+        # initialise the automaton, each state has a dict of transitions, a failure state and a list of the
+        # (pattern length, value) pairs that end at the state
+        self._transitions = [{}]
+        self._failures = [0]
+        self._outputs = [[]]
+        self._compiled = True
+
+    def addPattern(self, pattern, value):
+        """
+        This method is used to add a pattern to the matcher
+
+        @pattern the text to look for
+        @value the value that will be returned when the pattern is found
+        """
+
+        # ignore empty patterns
+        pattern = pattern.lower()
+        if not pattern:
+            return
+
+        # follow (or add) the states for each of the characters of the pattern
+        state = 0
+        for char in pattern:
+            nextState = self._transitions[state].get(char)
+            if nextState is None:
+                nextState = len(self._transitions)
+                self._transitions.append({})
+                self._failures.append(0)
+                self._outputs.append([])
+                self._transitions[state][char] = nextState
+
+            state = nextState
+
+        self._outputs[state].append((len(pattern), value))
+        self.patternCount += 1
+        self._compiled = False
+
+    def compile(self):
+        """
+        This method is used to build the failure links of the automaton, it is called automatically the first time
+        the matcher is used after patterns have been added
+        """
+
+        # work through the states a level at a time, the states directly below the root fail back to the root
+        queue = self._transitions[0].values()
+        for state in queue:
+            self._failures[state] = 0
+
+        while queue:
+            nextQueue = []
+
+            for state in queue:
+                for (char, nextState) in self._transitions[state].items():
+                    nextQueue.append(nextState)
+
+                    # find the longest suffix of the pattern so far that can be continued with the character
+                    failure = self._failures[state]
+                    while failure and (char not in self._transitions[failure]):
+                        failure = self._failures[failure]
+
+                    failure = self._transitions[failure].get(char, 0)
+                    self._failures[nextState] = failure
+
+                    # anything that matches at the failure state also matches here
+                    self._outputs[nextState] = self._outputs[nextState] + self._outputs[failure]
+
+            queue = nextQueue
+
+        self._compiled = True
+
+    def _isWordChar(self, char):
+        """
+        This method is used to check whether a character is part of a word
+        """
+
+        return char.isalnum() or (char == '_')
+
+    def match(self, text):
+        """
+        This method is used to find the patterns in the specified text, the set of the values of the patterns that
+        were found is returned
+
+        @text the text to search
+        """
+
+        # make sure the automaton is ready
+        if not self._compiled:
+            self.compile()
+
+        # initialise variables
+        fnresult = set()
+        text = text.lower()
+        transitions = self._transitions
+        failures = self._failures
+        outputs = self._outputs
+        state = 0
+
+        # run the text through the automaton
+        for (index, char) in enumerate(text):
+            while state and (char not in transitions[state]):
+                state = failures[state]
+
+            state = transitions[state].get(char, 0)
+
+            # check for any patterns that end here
+            for (length, value) in outputs[state]:
+                if self.wholeWords:
+                    start = index - length + 1
+                    if (start > 0) and self._isWordChar(text[start - 1]) and self._isWordChar(text[start]):
+                        continue
+                    if (index + 1 < len(text)) and self._isWordChar(text[index + 1]) and self._isWordChar(text[index]):
+                        continue
+
+                fnresult.add(value)
+
+        return fnresult
+
+class KeywordInspector:
+    """
+    The KeywordInspector describes an inspector that looks for any of a number of keywords in the text of a tweet.
+    By default only the tweets that contain one of the keywords are worth saving, but an excluding inspector
+    marks the tweets that contain one of the keywords as not worth saving instead.
+    """
+
+    def __init__(self, keywords, exclude = False):
+        """
+        Initialise the inspector
+
+        @keywords the list of keywords to look for
+        @exclude if True then tweets containing the keywords are not worth saving
+        """
+
+        # initialise members
+        self.keywords = list(keywords)
+        self.exclude = exclude
+
+    def patterns(self):
+        """
+        This method is used to return the patterns that should be matched for the inspector
+        """
+
+        return self.keywords
+
+class HashtagInspector(KeywordInspector):
+    """
+    The HashtagInspector describes an inspector that looks for any of a number of hashtags in the text of a tweet
+    """
+
+    def patterns(self):
+        """
+        This method is used to return the patterns that should be matched for the inspector, the hashtags are
+        given the leading # if they don't already have it
+        """
+
+        return [hashtag if hashtag.startswith('#') else '#' + hashtag for hashtag in self.keywords]
+
+class CompiledInspector:
+    """
+    The CompiledInspector is used to run a number of keyword and hashtag inspectors over a page of tweets.  The
+    patterns of all of the inspectors are compiled into a single matcher, so the text of each tweet is scanned once.
+    A tweet remains worth saving only if it is found by every including inspector and none of the excluding
+    inspectors, which is the same result as running each of the inspectors in turn.
+
+    The compiled inspector can be added to the batchInspectors of a TwawlTask (or called with a single tweet from
+    the tweetInspectors).
+    """
+
+    def __init__(self, inspectors = None):
+        """
+        Initialise the compiled inspector
+
+        @inspectors the list of keyword and hashtag inspectors to compile
+        """
+
+        # initialise members
+        self.inspectors = []
+        self.matcher = None
+
+        # add the inspectors
+        for inspector in inspectors or []:
+            self.addInspector(inspector)
+
+    def addInspector(self, inspector):
+        """
+        This method is used to add an inspector, the matcher will be rebuilt the next time a tweet is inspected
+        """
+
+        self.inspectors.append(inspector)
+        self.matcher = None
+
+    def compile(self):
+        """
+        This method is used to build the matcher for all of the inspectors
+        """
+
+        self.matcher = KeywordMatcher()
+
+        # each pattern is given the index of the inspector it belongs to
+        for (index, inspector) in enumerate(self.inspectors):
+            for pattern in inspector.patterns():
+                self.matcher.addPattern(pattern, index)
+
+        self.matcher.compile()
+
+        # remember which inspectors need to match for a tweet to be saved
+        self._including = set([index for (index, inspector) in enumerate(self.inspectors) if not inspector.exclude])
+        self._excluding = set([index for (index, inspector) in enumerate(self.inspectors) if inspector.exclude])
+
+        logging.debug("compiled %s inspectors with %s patterns", len(self.inspectors), self.matcher.patternCount)
+
+    def isWorthSaving(self, text):
+        """
+        This method is used to check the text of a tweet against the inspectors
+        """
+
+        if self.matcher is None:
+            self.compile()
+
+        matched = self.matcher.match(text)
+
+        return self._including.issubset(matched) and not (self._excluding & matched)
+
+    def inspectPage(self, page):
+        """
+        This method is used to inspect all of the tweets in a page (a twitter.TweetBatch), updating the worthSaving
+        column of the page in one go
+
+        @page the page of tweets to inspect
+        """
+
+        # the tweets that have already been ruled out don't need to be looked at again
+        worthSaving = page.column('worthSaving')
+        texts = page.column('text')
+
+        page.columns['worthSaving'] = [saving and self.isWorthSaving(text) for (saving, text) in zip(worthSaving, texts)]
+
+    def __call__(self, page):
+        """
+        This method allows the compiled inspector to be used as a batch inspector
+        """
+
+        self.inspectPage(page)
+
+    def inspectTweet(self, tweet):
+        """
+        This method is used to inspect a single tweet, for use with the tweetInspectors of a TwawlTask
+        """
+
+        if tweet.worthSaving:
+            tweet.worthSaving = self.isWorthSaving(tweet.text)
@@ -4,14 +4,49 @@ This file is used to persist oauth access tokens for later user
 
 Section:    Version History
 23/01/2010 (DJO) - Created File
+16/10/2026 (DJO) - Added the access token cache
 """
 
 # import standard libraries
+import time
 import datetime
 import logging
 
 # import appengine libraries
 from google.appengine.ext import db
+from google.appengine.api import memcache
+
+# import other libraries
+import oauth
+import cachehelper
+
+# define the cache settings for access tokens (tokens are only kept in the instance cache for a short time, so 
+# a token that is invalidated by another instance is dropped soon after)
+TOKEN_CACHE_SIZE = 200
+TOKEN_CACHE_TIME = 3600
+TOKEN_INSTANCE_CACHE_TIME = 30
+TOKEN_CACHE_PREFIX = cachehelper.createCacheKey("oauthtoken", "")
+
+# initialise the instance cache for access tokens
+_tokenCache = cachehelper.LRUCache(TOKEN_CACHE_SIZE)
+
+class CachedAccessToken:
+    """
+    This class is used to hold an access token in the instance cache, both in its encoded form and parsed
+    ready to use
+    """
+    
+    def __init__(self, encoded, expires):
+        """
+        Initialise the cached token
+        
+        @encoded the encoded access token
+        @expires the time (in seconds since the epoch) the token should be removed from the cache
+        """
+        
+        self.encoded = encoded
+        self.token = oauth.OAuthToken.from_string(encoded)
+        self.expires = expires
 
 class OAuthAccessKey(db.Model):
     """
@@ -65,4 +100,88 @@ class OAuthAccessKey(db.Model):
         if allowCreate and (fnresult == None):
             fnresult = OAuthAccessKey(requestKey = key, partnerId = partnerId)
             
-        return fnresult
\ No newline at end of file
+        return fnresult
+        
+    @staticmethod
+    def _findCachedToken(cacheKey, finder):
+        """
+        This static method is used to find an access token, looking in the instance cache first, then memcache
+        and finally the database (using the specified finder).  The CachedAccessToken is returned, or None if
+        there is no access token.
+        
+        @cacheKey the key the token is cached against
+        @finder a function that returns the OAuthAccessKey from the database
+        """
+        
+        now = time.time()
+        
+        # look in the instance cache first
+        cachedToken = _tokenCache.get(cacheKey)
+        if (cachedToken is not None) and (cachedToken.expires > now):
+            return cachedToken
+        
+        # then look in memcache
+        encoded = memcache.get(TOKEN_CACHE_PREFIX + cacheKey)
+        
+        # and finally the database
+        if encoded is None:
+            accesskey_data = finder()
+            if (accesskey_data is None) or (not accesskey_data.accessKeyEncoded):
+                return None
+            
+            encoded = accesskey_data.accessKeyEncoded
+            memcache.set(TOKEN_CACHE_PREFIX + cacheKey, encoded, time = TOKEN_CACHE_TIME)
+            
+        # if the token hasn't changed, then we can keep using the parsed token
+        if (cachedToken is not None) and (cachedToken.encoded == encoded):
+            cachedToken.expires = now + TOKEN_INSTANCE_CACHE_TIME
+            return cachedToken
+            
+        # add the token to the instance cache
+        fnresult = CachedAccessToken(encoded, now + TOKEN_INSTANCE_CACHE_TIME)
+        _tokenCache.set(cacheKey, fnresult)
+        
+        return fnresult
+    
+    @staticmethod
+    def findAccessTokenByUserName(username, parsed = False):
+        """
+        This static method is used to find the latest access token for the specified username (through the 
+        token cache).  The encoded access token is returned, or the parsed oauth.OAuthToken if parsed is True.
+        """
+        
+        fnresult = OAuthAccessKey._findCachedToken("user_" + username, lambda: OAuthAccessKey.findByUserName(username))
+        if fnresult is None:
+            return None
+        
+        return fnresult.token if parsed else fnresult.encoded
+    
+    @staticmethod
+    def findAccessTokenByRequestKey(key, parsed = False):
+        """
+        This static method is used to find the access token for the specified request key (through the token
+        cache).  The encoded access token is returned, or the parsed oauth.OAuthToken if parsed is True.
+        """
+        
+        fnresult = OAuthAccessKey._findCachedToken("request_%s" % key, lambda: OAuthAccessKey.findByRequestKey(key))
+        if fnresult is None:
+            return None
+        
+        return fnresult.token if parsed else fnresult.encoded
+    
+    @staticmethod
+    def invalidateAccessToken(key = None, username = None):
+        """
+        This static method is used to remove the access tokens for the specified request key and username from
+        the token cache, this should be called whenever a new access token is stored.  Other instances will
+        pick up the new token once their cached token expires.
+        """
+        
+        cacheKeys = ["request_%s" % key]
+        if username:
+            cacheKeys.append("user_" + username)
+            
+        for cacheKey in cacheKeys:
+            _tokenCache.delete(cacheKey)
+            
+        memcache.delete_multi(cacheKeys, key_prefix = TOKEN_CACHE_PREFIX)
\ No newline at end of file
@@ -6,6 +6,7 @@
 # 19/05/2009 (DJO) - Created File
 
 # import standard libaries
+import re
 import logging
 import exceptions
 
@@ -13,11 +14,11 @@ import exceptions
 import yaml
 
 # import the appengine libraries
-from google.appengine.api import urlfetch
 from google.appengine.api import memcache
 
 # import other gaetools libraries
 import cachehelper
+import transport
 
 # initialise constants
 CONFKEY_MATCH = "match"
@@ -60,7 +61,7 @@ class ProxyConfig:
                 tmpConfigurations = yaml.load(fHandle)
                 
                 # validate the configuration
-                validateConfig(tmpConfigurations)
+                self.validateConfig(tmpConfigurations)
 
                 # save the datamap to the cache
                 self.configurations = tmpConfigurations
@@ -74,8 +75,9 @@ class ProxyConfig:
         """
         
         # log a warning if the config has no elements, it's not an error the proxy just won't do anything
-        if (config is None) or (config.length == 0):
+        if (config is None) or (len(config) == 0):
             logging.warn("The configuration is empty, the content proxy will behave similar to an inert gas")
+            return
         
         # iterate over the elements of the config and check for errors
         for configItem in config:
@@ -98,7 +100,7 @@ class ContentProxy:
     The ContentProxy class is used to bring content from a specific url and return the content to the display
     """
     
-    def __init__(self, configName = DEFAULT_PROXY_CONFIG):
+    def __init__(self, configName = DEFAULT_PROXY_CONFIG, proxy_transport = None):
         """
         The ContentProxy class constructor.  The constructor is responsible for
         loading the specified proxy configuration and initialise member variables
@@ -107,6 +109,9 @@ class ContentProxy:
         # load the specified proxy configuration
         self.config = ProxyConfig(configName)
         
+        # initialise the transport used to retrieve the content
+        self.transport = transport.getTransport() if (proxy_transport is None) else proxy_transport
+        
     def get(self, uri):
         """
         The get method is used to retrieve the specified url and return the content 
@@ -115,10 +120,19 @@ class ContentProxy:
         logging.debug("requested %s", uri)
         
         # iterate through the configurations and look for a match to the url
-        for config in self.configurations:
-            if config.
-        
-        return "Hello World!"
+        for config in (self.config.configurations or []):
+            if re.match(config[CONFKEY_MATCH], uri):
+                # retrieve the content from the base url of the matching configuration
+                request_result = self.transport.fetch(config[CONFKEY_BASEURL] + uri)
+                
+                if request_result.status_code == 200:
+                    return request_result.content
+                
+                logging.warning("Unable to retrieve %s (%s)", uri, request_result.status_code)
+                return None
+            
+        logging.warning("No proxy configuration matches %s", uri)
+        return None
         
 class CachingContentProxy(ContentProxy):
     """
@@ -0,0 +1,144 @@
+# File: ratelimit.py
+# This file is used to define a scheduler that keeps the requests we make to twitter within the rate limit.  Twitter
+# tells us how many requests we have left (and when the limit resets) in the X-RateLimit headers of each response,
+# the scheduler keeps track of this in memcache so every instance making requests sees the same picture.  Twitter
+# counts the requests for each account and endpoint separately, so the state is kept in a separate bucket for each
+# of them.  When the remaining requests start to run low, the requests are spread out over the time remaining until
+# the reset rather than being used up straight away.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import time
+import hashlib
+import logging
+import datetime
+
+# import the appengine libraries
+from google.appengine.api import memcache
+
+# import other gaetools libraries
+import cachehelper
+
+# define the names of the rate limit headers
+HEADER_LIMIT = 'X-RateLimit-Limit'
+HEADER_REMAINING = 'X-RateLimit-Remaining'
+HEADER_RESET = 'X-RateLimit-Reset'
+
+# initialise some default values
+DEFAULT_SCHEDULER_NAME = "twitter"
+DEFAULT_LOW_WATERMARK = 0.25
+DEFAULT_RESERVE = 2
+
+class RateLimitScheduler:
+    """
+    The RateLimitScheduler class is a token bucket that is refilled from the rate limit headers returned by twitter.
+    Each request takes a token from the bucket before it is made (see acquire), and the bucket is topped up to the
+    remaining count reported by twitter as each response arrives (see update).  Once the bucket drops below the
+    low watermark, requests are paced so the remaining tokens last until the limit is reset.  Twitter keeps a
+    separate limit for each access token and endpoint, so the bucket to use is passed to acquire and update (the
+    requests use the access token and the url of the endpoint, see TwitterRequest.getRateLimitBucket).
+    """
+
+    def __init__(self, name = DEFAULT_SCHEDULER_NAME, lowWatermark = DEFAULT_LOW_WATERMARK, reserve = DEFAULT_RESERVE):
+        """
+        Initialise the scheduler
+
+        @name the name of the rate limit, schedulers with the same name share the same state
+        @lowWatermark the fraction of the limit below which requests will be paced
+        @reserve the number of requests that will be held back until the limit is reset
+        """
+
+        # initialise members
+        self.name = name
+        self.lowWatermark = lowWatermark
+        self.reserve = reserve
+
+    def keyPrefixFor(self, bucket):
+        """
+        This method is used to generate the prefix of the cache keys used to store the state of a bucket, the
+        bucket is hashed as it contains the access token
+        """
+
+        return cachehelper.createCacheKey("ratelimit", self.name, bucket and hashlib.md5(bucket).hexdigest(), "")
+
+    def update(self, request_result, bucket = None):
+        """
+        This method is used to update the state of the rate limit from the headers of a response
+
+        @request_result the result returned by the transport
+        @bucket the bucket the request was made against
+        """
+
+        # read the rate limit headers, if they aren't all there then we don't know anything new
+        try:
+            limit = int(request_result.getHeader(HEADER_LIMIT))
+            remaining = int(request_result.getHeader(HEADER_REMAINING))
+            reset = int(request_result.getHeader(HEADER_RESET))
+        except (TypeError, ValueError):
+            return
+
+        logging.debug("rate limit %s: %s of %s requests remaining until %s", self.name, remaining, limit, reset)
+
+        # save the state, it can be forgotten once the limit has been reset
+        expires = max(int(reset - time.time()), 0) + 60
+        memcache.set_multi({ 'limit': limit, 'remaining': remaining, 'reset': reset }, key_prefix = self.keyPrefixFor(bucket), time = expires)
+
+    def acquire(self, bucket = None):
+        """
+        This method is used to take a token for a request.  If True is returned then the request can be made,
+        otherwise the request should be left until later.
+
+        @bucket the bucket the request will be made against
+        """
+
+        # get the current state of the rate limit
+        keyPrefix = self.keyPrefixFor(bucket)
+        state = memcache.get_multi(['limit', 'reset', 'next'], key_prefix = keyPrefix)
+        now = time.time()
+
+        # if we don't know the limit (or it has been reset) then go ahead, the response will tell us where we are
+        if ('limit' not in state) or ('reset' not in state) or (now >= state['reset']):
+            return True
+
+        # take a token
+        remaining = memcache.decr(keyPrefix + 'remaining')
+        if remaining is None:
+            return True
+
+        # if we are down to the reserve, then wait until the limit is reset
+        if remaining < self.reserve:
+            logging.warning("rate limit %s is exhausted, requests will resume at %s", self.name, state['reset'])
+            memcache.incr(keyPrefix + 'remaining')
+            return False
+
+        # if we are running low, then space the remaining requests out until the reset
+        if remaining < state['limit'] * self.lowWatermark:
+            if now < state.get('next', 0):
+                logging.debug("rate limit %s is running low, backing off", self.name)
+                memcache.incr(keyPrefix + 'remaining')
+                return False
+
+            interval = float(state['reset'] - now) / max(remaining - self.reserve, 1)
+            memcache.set(keyPrefix + 'next', now + interval, time = int(state['reset'] - now) + 1)
+
+        return True
+
+    def orderCandidates(self, candidates, lastServed):
+        """
+        This method is used to decide the order in which a number of candidates (rules for instance) should make
+        their requests.  The candidates that were served least recently go first, so when the rate limit is
+        running low every candidate still gets its turn.
+
+        @candidates the list of candidates
+        @lastServed a function that returns the datetime a candidate last made a request (or None if it never has)
+        """
+
+        decorated = []
+        for (index, candidate) in enumerate(candidates):
+            decorated.append((lastServed(candidate) or datetime.datetime.min, index, candidate))
+
+        decorated.sort()
+
+        return [candidate for (served, index, candidate) in decorated]
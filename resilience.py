@@ -0,0 +1,199 @@
+# File: resilience.py
+# This file is used to define the classes that help gaetools cope with an unreliable upstream service.  The retry
+# policy decides whether (and when) a failed request should be tried again, and the circuit breaker stops us making
+# requests to an endpoint that keeps failing so we don't spend the time we have waiting on requests that are bound
+# to fail.  The state of each circuit breaker is kept in memcache so that every instance knows when an endpoint
+# is unhealthy.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import time
+import random
+import logging
+import datetime
+import urlparse
+
+# import the appengine libraries
+from google.appengine.api import memcache
+
+# import other gaetools libraries
+import cachehelper
+
+# initialise some default values
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 4.0
+DEFAULT_RETRY_STATUSES = (500, 502, 503, 504)
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60
+DEFAULT_TRIAL_TIMEOUT = 30
+
+class RetryPolicy:
+    """
+    The RetryPolicy class is used to decide whether a failed request should be retried.  Requests are retried
+    with an exponential backoff, and the delay is jittered (a random delay between zero and the backoff) so that
+    lots of tasks failing at the same time don't all retry at the same time.
+    """
+
+    def __init__(self, maxAttempts = DEFAULT_MAX_ATTEMPTS, baseDelay = DEFAULT_BASE_DELAY, maxDelay = DEFAULT_MAX_DELAY, retryStatuses = DEFAULT_RETRY_STATUSES):
+        """
+        Initialise the retry policy
+
+        @maxAttempts the maximum number of times a request will be attempted (including the first attempt)
+        @baseDelay the backoff (in seconds) after the first attempt, this is doubled for each attempt after that
+        @maxDelay the maximum backoff (in seconds)
+        @retryStatuses the http status codes that are worth retrying
+        """
+
+        # initialise members
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.retryStatuses = retryStatuses
+
+    def isFailure(self, request_result):
+        """
+        This method is used to check whether a result is a failure that is worth retrying.  A result of None
+        means that no response was received at all.
+        """
+
+        return (request_result is None) or (request_result.status_code in self.retryStatuses)
+
+    def getDelay(self, attempt, deadline = None):
+        """
+        This method is used to get the number of seconds to wait before retrying a request.  None is returned
+        if the request should not be retried, either because we have run out of attempts or because retrying
+        would take us past the deadline.
+
+        @attempt the number of the attempt that failed (starting at zero)
+        @deadline the datetime (utc) by which the request needs to have finished
+        """
+
+        # check we have some attempts left
+        if attempt + 1 >= self.maxAttempts:
+            return None
+
+        # work out the delay
+        fnresult = random.uniform(0, min(self.maxDelay, self.baseDelay * (2 ** attempt)))
+
+        # check there will still be time for the retry after the delay
+        if (deadline is not None) and (datetime.datetime.utcnow() + datetime.timedelta(seconds = fnresult) >= deadline):
+            logging.debug("not retrying the request, the deadline is too close")
+            return None
+
+        return fnresult
+
+class CircuitBreaker:
+    """
+    The CircuitBreaker class is used to keep track of the failures for an endpoint.  Once the number of failures
+    in a row reaches the threshold the circuit is opened, and requests to the endpoint are refused until the reset
+    timeout has passed.  After that a single trial request is let through (the caller that manages to add the 
+    trial key to memcache makes it), if it succeeds the circuit is closed again and if it fails the circuit is 
+    opened straight away.  If the trial doesn't report back within the trial timeout another one is let through.
+    """
+
+    def __init__(self, name, failureThreshold = DEFAULT_FAILURE_THRESHOLD, resetTimeout = DEFAULT_RESET_TIMEOUT, trialTimeout = DEFAULT_TRIAL_TIMEOUT):
+        """
+        Initialise the circuit breaker
+
+        @name the name of the endpoint, circuit breakers with the same name share the same state
+        @failureThreshold the number of failures in a row that will open the circuit
+        @resetTimeout the number of seconds the circuit stays open
+        @trialTimeout the number of seconds other requests wait on a trial request before another is let through
+        """
+
+        # initialise members
+        self.name = name
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.trialTimeout = trialTimeout
+        self.keyPrefix = cachehelper.createCacheKey("circuit", name, "")
+
+        # initialise the state we know about locally, so we don't have to ask memcache while the circuit is open
+        self._openUntil = 0
+        self._failures = 0
+
+    def allowRequest(self):
+        """
+        This method is used to check whether a request to the endpoint should be made
+        """
+
+        now = time.time()
+
+        # if we already know the circuit is open, then there is no need to check
+        if now < self._openUntil:
+            return False
+
+        # check the shared state
+        state = memcache.get_multi(['open', 'failures'], key_prefix = self.keyPrefix)
+        self._openUntil = state.get('open', 0)
+        self._failures = state.get('failures', 0)
+
+        if now < self._openUntil:
+            logging.warning("circuit for %s is open, requests will resume at %s", self.name, self._openUntil)
+            return False
+
+        # if the circuit has been opened and the reset timeout has passed, then only one request gets to try
+        if self._failures >= self.failureThreshold:
+            if not memcache.add(self.keyPrefix + 'trial', now, time = self.trialTimeout):
+                logging.debug("circuit for %s is waiting on a trial request", self.name)
+                return False
+            
+            logging.info("circuit for %s is half open, letting a trial request through", self.name)
+
+        return True
+
+    def isOpen(self):
+        """
+        This method is used to check whether this instance has seen the circuit opened (memcache is not checked)
+        """
+
+        return time.time() < self._openUntil
+
+    def recordSuccess(self):
+        """
+        This method is used to record a successful request, closing the circuit
+        """
+
+        if self._failures or self._openUntil:
+            memcache.delete_multi(['open', 'failures', 'trial'], key_prefix = self.keyPrefix)
+
+        self._openUntil = 0
+        self._failures = 0
+
+    def recordFailure(self):
+        """
+        This method is used to record a failed request, opening the circuit if we have reached the threshold
+        """
+
+        self._failures = memcache.incr(self.keyPrefix + 'failures', initial_value = 0) or (self._failures + 1)
+
+        # if we have had too many failures, then open the circuit
+        if self._failures >= self.failureThreshold:
+            logging.warning("%s failures in a row for %s, opening the circuit", self._failures, self.name)
+
+            self._openUntil = time.time() + self.resetTimeout
+            memcache.set(self.keyPrefix + 'open', self._openUntil, time = self.resetTimeout)
+            memcache.delete(self.keyPrefix + 'trial')
+
+    @staticmethod
+    def forUrl(url):
+        """
+        This static method is used to return the circuit breaker for the endpoint of the specified url (the
+        query string is not part of the endpoint)
+        """
+
+        (scheme, netloc, path) = urlparse.urlsplit(url)[:3]
+        name = "%s://%s%s" % (scheme, netloc, path)
+
+        fnresult = _breakers.get(name)
+        if fnresult is None:
+            fnresult = CircuitBreaker(name)
+            _breakers[name] = fnresult
+
+        return fnresult
+
+# initialise the circuit breakers for the endpoints we have used
+_breakers = {}
@@ -0,0 +1,303 @@
+# File: rollups.py
+# This file is used to define the rollups that keep track of the number of tweets found for each rule over time.
+# The tweets found for a rule are counted by the minute, hour, day and month they were created in, and the counts
+# are updated as the tweets are processed.  This means we can chart the activity of a rule (or count the tweets
+# found between two times) by reading a handful of rollups rather than going through the tweets themselves.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import random
+import logging
+import datetime
+
+# import the appengine libraries
+from google.appengine.ext import db
+
+# define the resolutions, from the coarsest to the finest
+RESOLUTION_MONTH = 'month'
+RESOLUTION_DAY = 'day'
+RESOLUTION_HOUR = 'hour'
+RESOLUTION_MINUTE = 'minute'
+RESOLUTIONS = (RESOLUTION_MONTH, RESOLUTION_DAY, RESOLUTION_HOUR, RESOLUTION_MINUTE)
+
+# define the default maximum number of points returned in a series
+DEFAULT_MAX_POINTS = 100
+
+# define the maximum number of rollups updated in a single transaction (the datastore won't put more entities than
+# this at once), and the number of minutes a buffer holds before it should be written
+MAX_TRANSACTION_ROLLUPS = 500
+MAX_BUFFER_MINUTES = 1000
+
+# define the number of shards the rollups of a rule and month are split across (tasks updating the rollups of the
+# same rule at the same time pick different shards, so they don't contend for one entity group), and the maximum
+# number of rollups read at once
+DEFAULT_ROLLUP_SHARDS = 5
+MAX_BATCH_GET = 500
+
+def periodStart(value, resolution):
+    """
+    This function is used to return the start of the period (at the specified resolution) that contains the value
+    """
+
+    if resolution == RESOLUTION_MINUTE:
+        return value.replace(second = 0, microsecond = 0)
+    elif resolution == RESOLUTION_HOUR:
+        return value.replace(minute = 0, second = 0, microsecond = 0)
+    elif resolution == RESOLUTION_DAY:
+        return value.replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+
+    return value.replace(day = 1, hour = 0, minute = 0, second = 0, microsecond = 0)
+
+def nextPeriod(value, resolution):
+    """
+    This function is used to return the start of the period (at the specified resolution) after the period that
+    starts at the value
+    """
+
+    if resolution == RESOLUTION_MINUTE:
+        return value + datetime.timedelta(minutes = 1)
+    elif resolution == RESOLUTION_HOUR:
+        return value + datetime.timedelta(hours = 1)
+    elif resolution == RESOLUTION_DAY:
+        return value + datetime.timedelta(days = 1)
+
+    if value.month == 12:
+        return value.replace(year = value.year + 1, month = 1)
+
+    return value.replace(month = value.month + 1)
+
+class TwawlRollup(db.Model):
+    """
+    This model is used to store the number of tweets found for a rule in a period of time.  The rollups for a rule
+    and month are kept in the same entity group, so the rollups touched by a page of tweets can be updated in a
+    transaction (or a few, if more than MAX_TRANSACTION_ROLLUPS rollups in the month are touched).  Like the
+    sharded counters, each rule and month is split across DEFAULT_ROLLUP_SHARDS entity groups, an update goes to
+    a shard picked at random and the count for a period is the sum of its shards.
+    """
+
+    ruleName = db.StringProperty(required = True)
+    resolution = db.StringProperty(required = True)
+    periodStart = db.DateTimeProperty(required = True)
+    totalTweets = db.IntegerProperty(required = True, default = 0)
+
+    def keyFor(ruleName, resolution, start, shard = 0):
+        """
+        This static method is used to generate the key of the rollup for a rule, resolution and period in the
+        specified shard (the first shard has the key the rollups had before they were sharded)
+        """
+
+        groupName = "%s_%04d-%02d" % (ruleName, start.year, start.month)
+        if shard:
+            groupName = "%s_%d" % (groupName, shard)
+            
+        keyName = "%s_%s" % (resolution, start.isoformat())
+
+        return db.Key.from_path('TwawlRollupGroup', groupName, 'TwawlRollup', keyName)
+
+    def addCounts(ruleName, minuteCounts, skipChunks = (), chunkWritten = None):
+        """
+        This static method is used to add the tweets counted by the minute they were created in to the rollups
+        for the rule at each of the resolutions.  The counts are written in chunks (each in its own transaction),
+        so a caller that has to try again after a failure can pass the chunks that were already written.
+
+        @ruleName the name of the rule
+        @minuteCounts a dict mapping the start of each minute to the number of tweets created in that minute
+        @skipChunks the ids of the chunks that have already been written
+        @chunkWritten a function that is passed the id of each chunk once it has been written
+        """
+
+        # work out the count for each of the rollups (grouped by the month the rollups belong to)
+        groups = {}
+        for (minute, count) in minuteCounts.items():
+            for resolution in RESOLUTIONS:
+                start = periodStart(minute, resolution)
+                group = groups.setdefault((minute.year, minute.month), {})
+                group[(resolution, start)] = group.get((resolution, start), 0) + count
+
+        # update the rollups for each month, in as many transactions as it takes to keep each one under the limit
+        # (coarsest rollups first, so if we fail part of the way through the months and days are already up to date)
+        for ((year, month), group) in groups.items():
+            periods = sorted(group.keys(), key = lambda period: (RESOLUTIONS.index(period[0]), period[1]))
+            
+            for offset in range(0, len(periods), MAX_TRANSACTION_ROLLUPS):
+                chunkId = "%04d-%02d:%d" % (year, month, offset)
+                if chunkId in skipChunks:
+                    continue
+                
+                chunk = dict([(period, group[period]) for period in periods[offset:offset + MAX_TRANSACTION_ROLLUPS]])
+                db.run_in_transaction(TwawlRollup._updateGroup, ruleName, chunk, random.randint(0, DEFAULT_ROLLUP_SHARDS - 1))
+                
+                if chunkWritten:
+                    chunkWritten(chunkId)
+
+        logging.debug("updated the rollups for %s from %s minutes of tweets", ruleName, len(minuteCounts))
+
+    def _updateGroup(ruleName, counts, shard):
+        """
+        This static method is used to add the counts to the rollups of an entity group (this is run in a transaction)
+        """
+
+        periods = counts.keys()
+        rollups = TwawlRollup.get([TwawlRollup.keyFor(ruleName, resolution, start, shard) for (resolution, start) in periods])
+
+        for (index, (resolution, start)) in enumerate(periods):
+            if rollups[index] is None:
+                key = TwawlRollup.keyFor(ruleName, resolution, start, shard)
+                rollups[index] = TwawlRollup(parent = key.parent(), key_name = key.name(), ruleName = ruleName,
+                                             resolution = resolution, periodStart = start, totalTweets = 0)
+
+            rollups[index].totalTweets += counts[(resolution, start)]
+
+        db.put(rollups)
+
+    def sumPeriods(ruleName, periods):
+        """
+        This static method is used to read the total tweets of each of the periods (a list of (resolution, 
+        periodStart) tuples) for the rule, adding up the shards of each period
+        """
+
+        # read the shards of every period
+        keys = []
+        for (resolution, start) in periods:
+            keys += [TwawlRollup.keyFor(ruleName, resolution, start, shard) for shard in range(DEFAULT_ROLLUP_SHARDS)]
+
+        rollups = []
+        for offset in range(0, len(keys), MAX_BATCH_GET):
+            rollups += TwawlRollup.get(keys[offset:offset + MAX_BATCH_GET])
+
+        # add up the shards of each period
+        fnresult = []
+        for index in range(len(periods)):
+            shards = rollups[index * DEFAULT_ROLLUP_SHARDS:(index + 1) * DEFAULT_ROLLUP_SHARDS]
+            fnresult.append(sum([rollup.totalTweets for rollup in shards if rollup is not None]))
+
+        return fnresult
+
+    def coveringPeriods(start, end):
+        """
+        This static method is used to split the window from start (inclusive) to end (exclusive) into the fewest
+        periods that exactly cover it, using the coarsest resolution that fits each part of the window.  A list of
+        (resolution, periodStart) tuples is returned.  The window is taken to the nearest minute.
+        """
+
+        # initialise variables
+        fnresult = []
+        current = periodStart(start, RESOLUTION_MINUTE)
+        end = periodStart(end, RESOLUTION_MINUTE)
+
+        # step through the window, taking the coarsest period that starts at the current time and fits in the window
+        while current < end:
+            for resolution in RESOLUTIONS:
+                if (periodStart(current, resolution) == current) and (nextPeriod(current, resolution) <= end):
+                    fnresult.append((resolution, current))
+                    current = nextPeriod(current, resolution)
+                    break
+
+        return fnresult
+
+    def countTweets(ruleName, start, end):
+        """
+        This static method is used to count the tweets found for the rule that were created from start (inclusive)
+        to end (exclusive), by reading the coarsest rollups that cover the window
+        """
+
+        return sum(TwawlRollup.sumPeriods(ruleName, TwawlRollup.coveringPeriods(start, end)))
+
+    def chooseResolution(start, end, maxPoints = DEFAULT_MAX_POINTS):
+        """
+        This static method is used to choose the finest resolution that will chart the window in no more than
+        the maximum number of points (the coarsest resolution is used if none of them will)
+        """
+
+        span = end - start
+        spanMinutes = span.days * 1440 + span.seconds // 60
+
+        for (resolution, minutes) in ((RESOLUTION_MINUTE, 1), (RESOLUTION_HOUR, 60), (RESOLUTION_DAY, 1440)):
+            if spanMinutes <= minutes * maxPoints:
+                return resolution
+
+        return RESOLUTION_MONTH
+
+    def getSeries(ruleName, start, end, resolution = None, maxPoints = DEFAULT_MAX_POINTS):
+        """
+        This static method is used to get the number of tweets found for the rule in each period of the window,
+        for charting.  A list of (periodStart, totalTweets) tuples is returned.
+
+        @ruleName the name of the rule
+        @start the start of the window
+        @end the end of the window
+        @resolution the resolution of the series, if not specified then chooseResolution is used
+        @maxPoints the maximum number of points used when choosing the resolution
+        """
+
+        if resolution is None:
+            resolution = TwawlRollup.chooseResolution(start, end, maxPoints)
+
+        # work out the periods in the window
+        periods = []
+        current = periodStart(start, resolution)
+        while current < end:
+            periods.append(current)
+            current = nextPeriod(current, resolution)
+
+        # read the rollups for the periods
+        totals = TwawlRollup.sumPeriods(ruleName, [(resolution, period) for period in periods])
+
+        return zip(periods, totals)
+
+    keyFor = staticmethod(keyFor)
+    addCounts = staticmethod(addCounts)
+    _updateGroup = staticmethod(_updateGroup)
+    sumPeriods = staticmethod(sumPeriods)
+    coveringPeriods = staticmethod(coveringPeriods)
+    countTweets = staticmethod(countTweets)
+    chooseResolution = staticmethod(chooseResolution)
+    getSeries = staticmethod(getSeries)
+
+class RollupBuffer:
+    """
+    The RollupBuffer is used to count the tweets by the minute they were created in, until the counts are added to
+    the rollups
+    """
+
+    def __init__(self):
+        """
+        Initialise the buffer
+        """
+
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def isFull(self, maxMinutes = MAX_BUFFER_MINUTES):
+        """
+        This method is used to check whether the buffer holds enough minutes that it should be written
+        """
+
+        return len(self.counts) >= maxMinutes
+
+    def add(self, createdAt, count = 1):
+        """
+        This method is used to count a tweet
+        """
+
+        minute = periodStart(createdAt, RESOLUTION_MINUTE)
+        self.counts[minute] = self.counts.get(minute, 0) + count
+
+    def merge(self, counts):
+        """
+        This method is used to add the counts from another buffer (or a journal)
+        """
+
+        for (minute, count) in counts.items():
+            self.counts[minute] = self.counts.get(minute, 0) + count
+
+    def clear(self):
+        """
+        This method is used to empty the buffer
+        """
+
+        self.counts = {}
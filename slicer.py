@@ -3,6 +3,7 @@
 # 
 # Section: Version History
 # 14/05/2009 (DJO) - Created File
+# 16/10/2026 (DJO) - Added the TaskCheckpoint model
 
 # import standard libraries
 import string
@@ -10,12 +11,41 @@ import logging
 import datetime
 
 # import the gae libraries
+from google.appengine.ext import db
 from google.appengine.ext import webapp
 
 # define the requeue interval - we really don't want to queue up an excess of events...
 DEFAULT_MAX_INTERVAL = datetime.timedelta(seconds = 25)
 DEFAULT_WRITECACHE_INTERVAL = 600
 
+class TaskCheckpoint(db.Model):
+    """
+    The TaskCheckpoint model is used to record how far a sliced task has got through its data, so that a task
+    with more to do than will fit in a slice can pick up where it left off in the next slice.  Checkpoints are
+    stored against the name of the task.  The cursor is a datastore query cursor, and the position can be used
+    by the task to record anything else it needs to know to carry on.
+    """
+    
+    cursor = db.TextProperty()
+    position = db.StringProperty()
+    processedCount = db.IntegerProperty(default = 0)
+    complete = db.BooleanProperty(default = False)
+    updated = db.DateTimeProperty(auto_now = True)
+    
+    def findOrCreate(name):
+        """
+        This static method is used to find the checkpoint for the named task, a new (unsaved) checkpoint is
+        returned if the task hasn't been checkpointed before
+        """
+        
+        fnresult = TaskCheckpoint.get_by_key_name(name)
+        if fnresult is None:
+            fnresult = TaskCheckpoint(key_name = name, processedCount = 0, complete = False)
+            
+        return fnresult
+    
+    findOrCreate = staticmethod(findOrCreate)
+
 class SlicedTask:
     """
     The sliced task is used to define standard behaviour for a task that has to execute within a 
@@ -47,6 +77,16 @@ class SlicedTask:
         
         return self.startTime + self.sliceTime - datetime.datetime.utcnow() 
     
+    def getSecondsRemaining(self):
+        """
+        This method is used to get the number of seconds remaining in this execution slice (zero once the slice
+        has run out of time, rather than the negative time remaining)
+        """
+        
+        timeRemaining = self.getTimeRemaining()
+        
+        return max(0, timeRemaining.days * 86400 + timeRemaining.seconds + timeRemaining.microseconds / 1000000.0)
+    
     def run(self, request, sliceAction):
         """
         This method is used to run the task, the method keeps a check on the time the task started and makes
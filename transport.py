@@ -0,0 +1,487 @@
+# File: transport.py
+# This file is used to define the transports that gaetools uses to make http requests.  On the appengine requests
+# are made using urlfetch, but when running elsewhere (or when we want to point the twitter library at a local stub
+# server for testing) a transport that keeps a pool of keep-alive connections can be used instead.  Both transports
+# return results that look like a urlfetch result, so the rest of the library doesn't need to care which is used.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import time
+import socket
+import httplib
+import logging
+import urlparse
+import threading
+
+# import the appengine libraries (if we are running on the appengine)
+try:
+    from google.appengine.api import urlfetch
+    from google.appengine.api import apiproxy_stub_map
+except ImportError:
+    urlfetch = None
+    apiproxy_stub_map = None
+
+# initialise some default values
+DEFAULT_TIMEOUT = 10
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 4
+EXPIRY_GRACE_SECONDS = 2
+
+class TransportError(Exception):
+    """
+    The TransportError exception is raised when a request could not be made, or no response was received (as
+    opposed to an unsuccessful response being returned).
+    """
+
+class FetchResult:
+    """
+    The FetchResult class is used to hold the response to a request.  It has the same members as a urlfetch
+    result, the only difference being that the names of the headers are always lower case.
+    """
+
+    def __init__(self, status_code, content, headers = None):
+        """
+        Initialise the result
+        """
+
+        # initialise members
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+        # copy the headers across, using lower case names
+        if headers:
+            for (name, value) in headers.items():
+                self.headers[name.lower()] = value
+
+    def getHeader(self, name, default = None):
+        """
+        This method is used to get the value of a response header (the name is not case sensitive)
+        """
+
+        return self.headers.get(name.lower(), default)
+
+class Transport:
+    """
+    The Transport class defines the methods that each of the transports implement.  Additionally the transport
+    can be given a map of host overrides, which are used to send requests for a host somewhere else (such as a
+    stub server).
+    """
+
+    def __init__(self, hostOverrides = None):
+        """
+        Initialise the transport
+
+        @hostOverrides a dict that maps a host name to the base url that requests for the host should be sent to,
+        for example { 'search.twitter.com': 'http://localhost:8080' }
+        """
+
+        # initialise members
+        self.hostOverrides = hostOverrides or {}
+
+    def resolveUrl(self, url):
+        """
+        This method is used to apply the host overrides to the specified url
+        """
+
+        # if we don't have any overrides, then there is nothing to do
+        if not self.hostOverrides:
+            return url
+
+        # check for an override of the host
+        parts = urlparse.urlsplit(url)
+        override = self.hostOverrides.get(parts[1])
+        if override is None:
+            return url
+
+        (scheme, netloc) = urlparse.urlsplit(override)[:2]
+        return urlparse.urlunsplit((scheme, netloc) + tuple(parts[2:]))
+
+    def fetch(self, url, headers = None, method = 'GET', payload = None, deadline = None):
+        """
+        This method is used to make a request and wait for the response, a FetchResult is returned
+
+        @url the url to request
+        @headers a dict of headers to send with the request
+        @method the http method to use
+        @payload the body of the request (if any)
+        @deadline the maximum number of seconds to wait for the response
+        """
+
+        raise NotImplementedError()
+
+    def startFetch(self, url, headers = None, method = 'GET', payload = None, deadline = None):
+        """
+        This method is used to start a request without waiting for the response.  A handle is returned and the
+        result of the request can be obtained with its getResult method once the response has arrived.
+        """
+
+        raise NotImplementedError()
+
+class UrlFetchTransport(Transport):
+    """
+    The UrlFetchTransport makes requests using the appengine urlfetch service
+    """
+
+    def fetch(self, url, headers = None, method = 'GET', payload = None, deadline = None):
+        """
+        This method is used to make a request with urlfetch and wait for the response
+        """
+
+        return self.startFetch(url, headers, method, payload, deadline).getResult()
+
+    def startFetch(self, url, headers = None, method = 'GET', payload = None, deadline = None):
+        """
+        This method is used to start an asynchronous urlfetch call
+        """
+
+        try:
+            rpc = urlfetch.create_rpc(deadline = deadline)
+            urlfetch.make_fetch_call(rpc, self.resolveUrl(url), payload = payload, method = method, headers = headers or {})
+        except urlfetch.Error, err:
+            raise TransportError("Unable to fetch %s: %s" % (url, err))
+
+        return UrlFetchHandle(rpc)
+
+class UrlFetchHandle:
+    """
+    The UrlFetchHandle is used to wait on an asynchronous urlfetch call
+    """
+
+    def __init__(self, rpc):
+        """
+        Initialise the handle for the specified rpc
+        """
+
+        self.rpc = rpc
+
+    def getResult(self):
+        """
+        This method is used to wait for the response and return the result
+        """
+
+        try:
+            request_result = self.rpc.get_result()
+        except urlfetch.Error, err:
+            raise TransportError("Request failed: %s" % err)
+
+        return FetchResult(request_result.status_code, request_result.content, request_result.headers)
+
+    @staticmethod
+    def waitAny(handles):
+        """
+        This static method is used to wait for the first of the specified handles to complete
+        """
+
+        rpc = apiproxy_stub_map.UserRPC.wait_any([handle.rpc for handle in handles])
+        for handle in handles:
+            if handle.rpc is rpc:
+                return handle
+
+        return None
+
+class PooledHttpTransport(Transport):
+    """
+    The PooledHttpTransport makes requests using httplib, keeping the connections open between requests so they
+    can be reused.  The number of connections to each host is capped, and requests will wait for a connection to
+    become free once the cap is reached.  Asynchronous requests are run on their own thread.
+    """
+
+    def __init__(self, hostOverrides = None, maxConnectionsPerHost = DEFAULT_MAX_CONNECTIONS_PER_HOST, timeout = DEFAULT_TIMEOUT):
+        """
+        Initialise the transport
+
+        @hostOverrides the host overrides (see Transport)
+        @maxConnectionsPerHost the maximum number of connections that will be opened to any one host
+        @timeout the default number of seconds to wait for a response
+        """
+
+        # call the inherited constructor
+        Transport.__init__(self, hostOverrides)
+
+        # initialise members
+        self.maxConnectionsPerHost = maxConnectionsPerHost
+        self.timeout = timeout
+        self._lock = threading.Condition()
+        self._idleConnections = {}
+        self._openConnections = {}
+
+    def _acquireConnection(self, scheme, netloc, expires, fresh = False):
+        """
+        This method is used to get a connection to the specified host, reusing an idle connection if there is one
+        (unless a fresh connection is asked for).  A (connection, reused) tuple is returned, and a TransportError
+        is raised if no connection becomes free before the request expires.
+        """
+
+        hostKey = (scheme, netloc)
+
+        self._lock.acquire()
+        try:
+            # wait until there is either an idle connection or room for a new one
+            while (not self._idleConnections.get(hostKey)) and (self._openConnections.get(hostKey, 0) >= self.maxConnectionsPerHost):
+                remaining = expires - time.time()
+                if remaining <= 0:
+                    raise TransportError("No connection to %s became free in time" % netloc)
+                
+                self._lock.wait(remaining)
+
+            # reuse an idle connection if we have one (an idle connection is closed to make room for a fresh one)
+            connection = None
+            if self._idleConnections.get(hostKey):
+                connection = self._idleConnections[hostKey].pop()
+                if fresh:
+                    connection.close()
+                    connection = None
+                    self._openConnections[hostKey] -= 1
+                    
+            # otherwise open a new one
+            reused = connection is not None
+            if not reused:
+                if scheme == 'https':
+                    connection = httplib.HTTPSConnection(netloc)
+                else:
+                    connection = httplib.HTTPConnection(netloc)
+
+                self._openConnections[hostKey] = self._openConnections.get(hostKey, 0) + 1
+        finally:
+            self._lock.release()
+
+        # apply what is left of the timeout for this request (to the socket as well if the connection is already open)
+        connection.timeout = max(expires - time.time(), 0.1)
+        if connection.sock is not None:
+            connection.sock.settimeout(connection.timeout)
+
+        return (connection, reused)
+
+    def _releaseConnection(self, scheme, netloc, connection, reusable):
+        """
+        This method is used to return a connection to the pool (or close it if it can't be reused)
+        """
+
+        hostKey = (scheme, netloc)
+
+        self._lock.acquire()
+        try:
+            if reusable:
+                self._idleConnections.setdefault(hostKey, []).append(connection)
+            else:
+                connection.close()
+                self._openConnections[hostKey] -= 1
+
+            # let anyone waiting for a connection know
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def fetch(self, url, headers = None, method = 'GET', payload = None, deadline = None):
+        """
+        This method is used to make a request using a pooled connection and wait for the response
+        """
+
+        # work out where the request is going
+        (scheme, netloc, path, query) = urlparse.urlsplit(self.resolveUrl(url))[:4]
+        if query:
+            path += '?' + query
+
+        # initialise variables
+        expires = time.time() + (deadline or self.timeout)
+        fresh = False
+
+        # make the request
+        while True:
+            (connection, reused) = self._acquireConnection(scheme, netloc, expires, fresh)
+            reusable = False
+            try:
+                try:
+                    connection.request(method, path or '/', payload, headers or {})
+                    response = connection.getresponse()
+                    content = response.read()
+
+                    # if the server is going to close the connection, then we can't reuse it
+                    reusable = not response.will_close
+                    break
+                except socket.timeout, err:
+                    raise TransportError("Unable to fetch %s: %s" % (url, err))
+                except (httplib.BadStatusLine, socket.error), err:
+                    # the server may have closed an idle connection since it was last used, so try once more on 
+                    # a fresh connection
+                    if reused and not fresh:
+                        logging.debug("Reused connection to %s failed (%s), retrying on a fresh connection", netloc, err)
+                        fresh = True
+                        continue
+                    
+                    raise TransportError("Unable to fetch %s: %s" % (url, err))
+                except httplib.HTTPException, err:
+                    raise TransportError("Unable to fetch %s: %s" % (url, err))
+            finally:
+                self._releaseConnection(scheme, netloc, connection, reusable)
+
+        return FetchResult(response.status, content, dict(response.getheaders()))
+
+    def startFetch(self, url, headers = None, method = 'GET', payload = None, deadline = None):
+        """
+        This method is used to start a request on a separate thread
+        """
+
+        return ThreadedFetchHandle(self, url, headers, method, payload, deadline)
+
+    def close(self):
+        """
+        This method is used to close all of the idle connections
+        """
+
+        self._lock.acquire()
+        try:
+            for (hostKey, connections) in self._idleConnections.items():
+                for connection in connections:
+                    connection.close()
+
+                self._openConnections[hostKey] -= len(connections)
+
+            self._idleConnections = {}
+        finally:
+            self._lock.release()
+
+class ThreadedFetchHandle:
+    """
+    The ThreadedFetchHandle is used to run a request for the PooledHttpTransport on its own thread
+    """
+
+    # the condition used to signal that a request has completed
+    completed = threading.Condition()
+
+    def __init__(self, transport, url, headers, method, payload, deadline):
+        """
+        Initialise the handle and start the request
+        """
+
+        # initialise members (if the request hasn't finished a little after its deadline then we stop waiting for it)
+        self.url = url
+        self.done = False
+        self.result = None
+        self.error = None
+        self.expires = time.time() + (deadline or transport.timeout) + EXPIRY_GRACE_SECONDS
+
+        # start the request
+        self.thread = threading.Thread(target = self._run, args = (transport, url, headers, method, payload, deadline))
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def _run(self, transport, url, headers, method, payload, deadline):
+        """
+        This method is used to make the request (on the request thread)
+        """
+
+        # initialise variables
+        result = None
+        error = None
+
+        try:
+            try:
+                result = transport.fetch(url, headers, method, payload, deadline)
+            except TransportError, err:
+                error = err
+            except Exception, err:
+                # anything else is reported as a transport error, otherwise the handle would never be done
+                logging.exception("Unexpected error fetching %s", url)
+                error = TransportError("Unable to fetch %s: %s" % (url, err))
+        finally:
+            # let anyone who is waiting know that we are done (unless they have already given up on us)
+            ThreadedFetchHandle.completed.acquire()
+            try:
+                if not self.done:
+                    self.result = result
+                    self.error = error
+                    self.done = True
+
+                ThreadedFetchHandle.completed.notifyAll()
+            finally:
+                ThreadedFetchHandle.completed.release()
+
+    def _checkExpired(self, now):
+        """
+        This method is used to give up on the request if it has gone past its deadline, the handle is then done
+        and has a TransportError.  The completed condition must be held by the caller.
+        """
+
+        if (not self.done) and (now >= self.expires):
+            self.error = TransportError("No response received in time for %s" % self.url)
+            self.done = True
+
+    def getResult(self):
+        """
+        This method is used to wait for the response (until the deadline of the request) and return the result
+        """
+
+        self.thread.join(max(self.expires - time.time(), 0))
+
+        ThreadedFetchHandle.completed.acquire()
+        try:
+            self._checkExpired(time.time())
+        finally:
+            ThreadedFetchHandle.completed.release()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+    @staticmethod
+    def waitAny(handles):
+        """
+        This static method is used to wait for the first of the specified handles to complete.  A request that
+        goes past its deadline counts as complete (with a TransportError), so we never wait forever.
+        """
+
+        ThreadedFetchHandle.completed.acquire()
+        try:
+            while True:
+                now = time.time()
+                for handle in handles:
+                    handle._checkExpired(now)
+                    if handle.done:
+                        return handle
+
+                ThreadedFetchHandle.completed.wait(max(min([handle.expires for handle in handles]) - now, 0))
+        finally:
+            ThreadedFetchHandle.completed.release()
+
+def waitAny(handles):
+    """
+    This function is used to wait for the first of the specified handles to complete, and return it.  All of the
+    handles should have been started by the same type of transport.
+    """
+
+    if not handles:
+        return None
+
+    return handles[0].waitAny(handles)
+
+# initialise the default transport
+_defaultTransport = None
+
+def getTransport():
+    """
+    This function is used to return the transport that should be used by default.  Unless a transport has been
+    set, urlfetch is used on the appengine and a pooled http transport is used everywhere else.
+    """
+
+    global _defaultTransport
+
+    if _defaultTransport is None:
+        if urlfetch is not None:
+            _defaultTransport = UrlFetchTransport()
+        else:
+            _defaultTransport = PooledHttpTransport()
+
+    return _defaultTransport
+
+def setTransport(transport):
+    """
+    This function is used to set the transport that is used by default
+    """
+
+    global _defaultTransport
+
+    _defaultTransport = transport
@@ -13,18 +13,36 @@ from google.appengine.ext import db
 from google.appengine.api import memcache
 
 # import other gaetools libs
+import counters
 import cachehelper
 
+# define the cache settings for twitter users
+USER_CACHE_SIZE = 5000
+USER_CACHE_TIME = 86400
+USER_CACHE_PREFIX = cachehelper.createCacheKey("twitteruser", "")
+
+# define the maximum number of values in an IN filter (used to find the users saved before they were keyed)
+MAX_IN_FILTER_VALUES = 30
+
+# define the cache settings for twawl history
+HISTORY_CACHE_TIME = 172800
+
+# initialise the instance cache for twitter users
+_userCache = cachehelper.LRUCache(USER_CACHE_SIZE)
+
 class TwawlRule(db.Model):
     """
     This class is used to define the model that encapsulates a particular rule of tweets that we are looking
-    for in the system.  Twawl rules are used to group together relevant twawl history records
+    for in the system.  Twawl rules are used to group together relevant twawl history records.  If the retention
+    days are set then the tweets and history for the rule are purged once they are older than that (see the
+    PurgeTask), otherwise they are kept forever.
     """
     
     ruleName = db.StringProperty(required = True)
     lastSearch = db.DateTimeProperty(required = False)
     highTweetId = db.IntegerProperty(required = True, default = 0)
     totalTweets = db.IntegerProperty(required = True, default = 0)
+    retentionDays = db.IntegerProperty(required = False)
     
     def update(self, highTweet, tweetsIncrement):
         """
@@ -35,20 +53,46 @@ class TwawlRule(db.Model):
         self.lastSearch = datetime.datetime.utcnow()
         self.highTweetId = highTweet 
         
-        # update the total tweets of the rule
-        if (self.totalTweets is None):
-            self.totalTweets = tweetsIncrement
-        else:
-            self.totalTweets = self.totalTweets + tweetsIncrement
-            
         # save the rule to the database
         self.put()
         
+        # update the total tweets of the rule (the total is kept in a sharded counter, so tasks running at the 
+        # same time for the same rule don't lose each others tweets)
+        self.tweetCounter().increment(tweetsIncrement)
+        
         # add an info log entry about the number of tweets processed
         logging.info("successfully processed %s tweets, high tweet id now %s", tweetsIncrement, highTweet)
         
         # clear the cache key for the update
         memcache.delete(cachehelper.createCacheKey("twawlrule", self.ruleName))
+        
+    def tweetCounter(self):
+        """
+        This method is used to return the counter that holds the total tweets for the rule
+        """
+        
+        return counters.ShardedCounter(cachehelper.createCacheKey("ruletweets", self.ruleName))
+    
+    def getRetentionCutoff(self):
+        """
+        This method is used to return the start of the first day that is still kept for the rule, anything
+        before this can be purged.  None is returned if the rule keeps everything.
+        """
+        
+        if not self.retentionDays:
+            return None
+        
+        cutoff = datetime.datetime.utcnow().date() - datetime.timedelta(days = self.retentionDays)
+        
+        return datetime.datetime(cutoff.year, cutoff.month, cutoff.day)
+    
+    def getTotalTweets(self):
+        """
+        This method is used to return the total tweets found for the rule.  The totalTweets property holds the 
+        total from before the counter was introduced.
+        """
+        
+        return (self.totalTweets or 0) + self.tweetCounter().getCount()
     
     def findOrCreate(searchName):
         # convert the rulename to lower case
@@ -103,11 +147,13 @@ class TwawlHistory(db.Model):
     def find(searchRule, searchDate):
         """
         This static method will be used to find the TwawlHistory.  First hitting the cache
-        for information and then checking the databsae is not available.
+        for information and then checking the databsae is not available.  History is stored against a key
+        made up of the rule name and the date, so it can be found with a get.
         """
         
         # check the cache for the twawl history record
-        fnresult = memcache.get(cachehelper.createCacheKey("twawlHistory", searchRule.ruleName, searchDate.isoformat()))
+        cacheKey = TwawlHistory.cacheKeyFor(searchRule.ruleName, searchDate)
+        fnresult = memcache.get(cacheKey)
         
         # if found, return the value
         if fnresult is not None:
@@ -115,10 +161,87 @@ class TwawlHistory(db.Model):
             return fnresult
         
         # look for the specified date in the database
-        query = TwawlHistory.gql("WHERE rule = :rule AND searchDate = :date", rule=searchRule, date=searchDate)
+        fnresult = TwawlHistory.get_by_key_name(TwawlHistory.keyNameFor(searchRule.ruleName, searchDate))
         
-        # go looking for the result
-        return query.get()
+        # history written before it was keyed has to be found with a query
+        if fnresult is None:
+            query = TwawlHistory.gql("WHERE rule = :rule AND searchDate = :date", rule=searchRule, date=searchDate)
+            fnresult = query.get()
+            
+        # if we found the history, then cache it so we don't need to go to the database next time
+        if fnresult is not None:
+            # we already have the rule, so save the reference from having to fetch it again
+            fnresult.rule = searchRule
+            memcache.set(cacheKey, fnresult, time = HISTORY_CACHE_TIME)
+            
+        return fnresult
+    
+    def keyNameFor(ruleName, searchDate):
+        """
+        This static method is used to generate the key name that the history for a rule and date is stored against
+        """
+        
+        return "h_%s_%s" % (searchDate.isoformat(), ruleName)
+    
+    def cacheKeyFor(ruleName, searchDate):
+        """
+        This static method is used to generate the key that the history for a rule and date is cached against
+        """
+        
+        return cachehelper.createCacheKey("twawlHistory", ruleName, searchDate.isoformat())
+    
+    def counterFor(ruleName, searchDate):
+        """
+        This static method is used to return the counter that holds the total tweets for the history of a rule
+        and date
+        """
+        
+        return counters.ShardedCounter(cachehelper.createCacheKey("historytweets", ruleName, searchDate.isoformat()))
+    
+    def searchDateFromKey(key):
+        """
+        This static method is used to get the date of a history from its key (see keyNameFor), None is returned
+        for the histories that were saved before they were stored against a key name
+        """
+        
+        if not (key.name() and key.name().startswith("h_")):
+            return None
+        
+        return datetime.datetime.strptime(key.name()[2:12], "%Y-%m-%d").date()
+    
+    def put(self):
+        """
+        This method is used to save the history to the database, and then update the cache with the saved history
+        """
+        
+        fnresult = db.Model.put(self)
+        
+        # update the cache
+        memcache.set(TwawlHistory.cacheKeyFor(self.rule.ruleName, self.searchDate), self, time = HISTORY_CACHE_TIME)
+        
+        return fnresult
+    
+    def tweetCounter(self):
+        """
+        This method is used to return the counter that holds the total tweets for the history
+        """
+        
+        return TwawlHistory.counterFor(self.rule.ruleName, self.searchDate)
+    
+    def addTweets(self, tweetsIncrement):
+        """
+        This method is used to add to the total tweets for the day
+        """
+        
+        self.tweetCounter().increment(tweetsIncrement)
+        
+    def getTotalTweets(self):
+        """
+        This method is used to return the total tweets found for the day.  The totalTweets property holds the 
+        total from before the counter was introduced.
+        """
+        
+        return (self.totalTweets or 0) + self.tweetCounter().getCount()
     
     def findOrCreateToday(ruleName):
         """
@@ -127,16 +250,30 @@ class TwawlHistory(db.Model):
         be done at the end of the operation, we should leave that until then).
         """
         
+        return TwawlHistory.findOrCreateForDate(ruleName, datetime.datetime.utcnow().date())
+    
+    def findOrCreateForDate(ruleName, searchDate):
+        """
+        This static method is used to find the search history object for the specified date.  As with 
+        findOrCreateToday, the method does not do a put to the database.
+        """
+        
+        # check the cache first, in the usual case that is all we need to do
+        fnresult = memcache.get(TwawlHistory.cacheKeyFor(ruleName.lower(), searchDate))
+        if fnresult is not None:
+            return fnresult
+        
         # look for the twawl rule
         searchRule = TwawlRule.findOrCreate(ruleName)
         
         # if the strUrl is blank, then set to a default
-        fnresult = TwawlHistory.find(searchRule, datetime.datetime.utcnow().date())
+        fnresult = TwawlHistory.find(searchRule, searchDate)
         
         # if we didn't find the result, we better create a new one
         if (fnresult == None):
             fnresult = TwawlHistory(
-                                     searchDate = datetime.datetime.utcnow().date()
+                                     key_name = TwawlHistory.keyNameFor(searchRule.ruleName, searchDate)
+                                     ,searchDate = searchDate
                                      ,totalTweets = 0
                                      ,highTweetId = 0
                                      ,rule = searchRule
@@ -149,7 +286,12 @@ class TwawlHistory(db.Model):
     
     # define the static methods
     find = staticmethod(find)
+    keyNameFor = staticmethod(keyNameFor)
+    cacheKeyFor = staticmethod(cacheKeyFor)
+    counterFor = staticmethod(counterFor)
+    searchDateFromKey = staticmethod(searchDateFromKey)
     findOrCreateToday = staticmethod(findOrCreateToday)
+    findOrCreateForDate = staticmethod(findOrCreateForDate)
     
 class TweetSource(db.Model):
     """
@@ -191,40 +333,158 @@ class TwitterUser(db.Model):
     def findOrCreate(id, name = None, imageUrl = None):
         """
         This static method is used to locate the user id, or create the new user as specified in the parameters.
-        At this stage no caching is used in this method, but it could be updated to do so.  I just worry that the
-        number of different users I expect to come across in twawling could mean that there is little value 
-        in caching these details. 
+        Users are stored against a key derived from their twitter id, which means that we can look them up 
+        through the instance and memcache caches rather than querying the database.  The same few thousand
+        users turn up over and over again, so most lookups never make it to the datastore.
         """
         
         # if the id is 0, then return None
         if (id is None) or (id == 0): 
             return None
         
-        # initialise the query
-        query = TwitterUser.gql("WHERE userId = :id", id=id)
+        # find (or create) the user
+        (users, changedUsers) = TwitterUser.findOrCreateMany({ id: (name, imageUrl) })
         
-        # return the first user found (should only be one)
-        fnresult = query.get()
+        # if the user is new or has been updated, then save it to the database
+        if changedUsers:
+            db.put(changedUsers)
+            TwitterUser.cacheMany(changedUsers)
+            
+        return users.get(id)
         
-        # if we didn't find the user, then create a new TwitterUser record and save it to the database
-        if fnresult is None:
-            fnresult = TwitterUser(userId = id, userName = name, profileImageUrl = imageUrl)
-            fnresult.put()
-        # otherwise, if the username on the entry we found is empty, then we should update with the name if not empty
-        elif (fnresult.userName is None) and (name is not None):
-            fnresult.userName = name
-            fnresult.profileImageUrl = imageUrl
-            fnresult.put()
+    def keyNameFor(id):
+        """
+        This static method is used to generate the key name that a twitter user is stored against.  Storing
+        users against a key derived from their twitter id means we can find them with a get rather than a query.
+        """
+        
+        return "u%s" % id
+    
+    def cacheMany(users):
+        """
+        This static method is used to add the specified users to both the instance cache and memcache.  Users
+        should only be cached once they have been saved to the database.
+        """
+        
+        # add the users to the instance cache
+        for user in users:
+            _userCache.set(user.userId, user)
             
+        # add the users to memcache
+        failedKeys = memcache.set_multi(dict([(str(user.userId), user) for user in users]), key_prefix = USER_CACHE_PREFIX, time = USER_CACHE_TIME)
+        if failedKeys:
+            logging.warning("Unable to write %s twitter users to the cache", len(failedKeys))
+    
+    def resolveMany(userIds):
+        """
+        This static method is used to find a number of existing users at once.  Users are looked for in the 
+        instance cache first, then memcache, and whatever is left is retrieved from the database with a single
+        multi-get (users saved before they were keyed by their twitter id are then looked for with a query).  A 
+        dict of the users that were found (keyed by twitter id) is returned.
+        
+        @userIds a list of the twitter ids of the users to find
+        """
+        
+        # initialise variables
+        fnresult = {}
+        missingIds = []
+        
+        # look for the users in the instance cache first
+        for id in userIds:
+            if (id is None) or (id == 0) or (id in fnresult):
+                continue
+            
+            user = _userCache.get(id)
+            if user is None:
+                missingIds.append(id)
+            else:
+                fnresult[id] = user
+                
+        # then look in memcache for the users we didn't find
+        if missingIds:
+            cachedUsers = memcache.get_multi([str(id) for id in missingIds], key_prefix = USER_CACHE_PREFIX)
             
+            uncachedIds = []
+            for id in missingIds:
+                user = cachedUsers.get(str(id))
+                if user is None:
+                    uncachedIds.append(id)
+                else:
+                    fnresult[id] = user
+                    _userCache.set(id, user)
+                    
+            missingIds = uncachedIds
+            
+        # and finally get the remaining users from the database in one hit
+        if missingIds:
+            foundUsers = [user for user in TwitterUser.get_by_key_name([TwitterUser.keyNameFor(id) for id in missingIds]) if user is not None]
+            
+            for user in foundUsers:
+                fnresult[user.userId] = user
+                
+            # users saved before they were keyed have to be found with a query
+            unkeyedIds = [id for id in missingIds if id not in fnresult]
+            for offset in range(0, len(unkeyedIds), MAX_IN_FILTER_VALUES):
+                query = TwitterUser.all().filter('userId IN', unkeyedIds[offset:offset + MAX_IN_FILTER_VALUES])
+                
+                for user in query:
+                    if user.userId not in fnresult:
+                        fnresult[user.userId] = user
+                        foundUsers.append(user)
+                
+            # cache the users so we don't need to go to the database next time
+            if foundUsers:
+                TwitterUser.cacheMany(foundUsers)
+                
+        logging.debug("resolved %s of %s twitter users, %s read from the database", len(fnresult), len(userIds), len(missingIds))
+        
         return fnresult
+
+    def findOrCreateMany(userDetails):
+        """
+        This static method is used to locate (or create) a number of users at once.  The method does not write 
+        anything to the database, instead the users that were created or changed are returned so they can be saved 
+        in the same batch as whatever is referencing them (and then cached using cacheMany).
+        
+        @userDetails a dict of twitter user ids mapped to a (name, imageUrl) tuple
+        """
+        
+        # initialise variables
+        fnresult = TwitterUser.resolveMany(userDetails.keys())
+        changedUsers = []
+        
+        # iterate through the requested users and create the users we couldn't find
+        for (id, (name, imageUrl)) in userDetails.items():
+            # ignore the empty user ids
+            if (id is None) or (id == 0):
+                continue
+            
+            # if we didn't find the user, then create a new user (but don't save it yet)
+            user = fnresult.get(id)
+            if user is None:
+                user = TwitterUser(key_name = TwitterUser.keyNameFor(id), userId = id, userName = name, profileImageUrl = imageUrl)
+                changedUsers.append(user)
+                fnresult[id] = user
+            # otherwise, if the username on the entry we found is empty, then we should update with the name if not empty
+            elif (user.userName is None) and (name is not None):
+                user.userName = name
+                user.profileImageUrl = imageUrl
+                changedUsers.append(user)
+                
+        return (fnresult, changedUsers)
         
-    findOrCreate = staticmethod(findOrCreate)    
+    findOrCreate = staticmethod(findOrCreate)
+    keyNameFor = staticmethod(keyNameFor)
+    cacheMany = staticmethod(cacheMany)
+    resolveMany = staticmethod(resolveMany)
+    findOrCreateMany = staticmethod(findOrCreateMany)
     
 class Tweet(db.Model):
     """
     The Tweet class encapsulates details about a tweet from twitter.  At this stage the data stored in the model
-    is related to the results of a search, but this will be extended as the gaetools library grows.
+    is related to the results of a search, but this will be extended as the gaetools library grows.  The rules
+    list holds the names of the rules that found the tweet, once a tweet is old enough it is moved into the
+    archive for each of these rules (see archive.py).
     """
     
     tweet_id = db.IntegerProperty(required = True)
@@ -234,4 +494,16 @@ class Tweet(db.Model):
     profile_image_url = db.StringProperty(required = False)
     to_user = db.ReferenceProperty(TwitterUser, required = False, collection_name = "TweetDestUser_set")
     text = db.StringProperty(required = True, multiline = True)
-    iso_language_code = db.StringProperty(required = False)
\ No newline at end of file
+    iso_language_code = db.StringProperty(required = False)
+    rules = db.StringListProperty()
+    
+    def keyNameFor(id):
+        """
+        This static method is used to generate the key name that a tweet is stored against.  Storing tweets 
+        against their twitter id means the same tweet can't be stored twice, and we can check whether a tweet
+        has already been saved with a get.
+        """
+        
+        return "t%s" % id
+    
+    keyNameFor = staticmethod(keyNameFor)
@@ -5,22 +5,83 @@
 # 14/05/2009 (DJO) - Created File
 
 # import standard libraries
+import re
+import time
+import bisect
+import random
 import string
 import logging
 import datetime
 
 # import appengine libraries
 from google.appengine.ext import db
+from google.appengine.api import memcache
 
 # import local libraries
 import twitter
 import slicer
+import archive
+import transport
+import tweetindex
+import rollups
+import ratelimit
+import inspectors
+import cachehelper
 import twawlermodel
 from oauthmodel import OAuthAccessKey
 
 # define the minimum amount of time required to process some tweets
 MIN_TWEET_PROCESSING_INTERVAL = datetime.timedelta(seconds = 5)
 
+# define the number of requests a multi rule task will have in flight at once (the requests themselves limit how
+# long they wait for a response, see twitter.MAX_REQUEST_DEADLINE)
+DEFAULT_MAX_CONCURRENT_REQUESTS = 10
+
+# define the maximum length of a search query, and the searches that can be merged into a single query
+MAX_SEARCH_QUERY_LENGTH = 140
+MERGEABLE_SEARCH = re.compile(r'^(#?\w+|"[^"]+")$', re.UNICODE)
+
+# define how long the journal of a task that hasn't been updated is kept before we assume the task has died, and
+# how long a journal is kept in the cache (and how many times a task will try to update the journal when other
+# tasks are updating it at the same time)
+JOURNAL_STALE_INTERVAL = datetime.timedelta(minutes = 2)
+JOURNAL_CACHE_TIME = 86400
+JOURNAL_UPDATE_ATTEMPTS = 10
+
+# define the steps an update to the history and the rule is written in (the rollups are written in chunks, each of
+# which is a step named after the chunk)
+STEP_HISTORY = 'history'
+STEP_RULE = 'rule'
+
+# define how old tweets need to be before they are archived, how many are archived at a time, and the minimum
+# amount of time required to archive a batch
+DEFAULT_ARCHIVE_AFTER_DAYS = 30
+DEFAULT_ARCHIVE_BATCH_SIZE = 500
+MIN_ARCHIVE_INTERVAL = datetime.timedelta(seconds = 10)
+
+# define how often the retention purge is run, how many entities are deleted at a time (the number is adjusted to
+# fit the time left in the slice) and the minimum amount of time required to delete a batch
+PURGE_INTERVAL = datetime.timedelta(days = 1)
+DEFAULT_PURGE_BATCH_SIZE = 100
+MIN_PURGE_BATCH_SIZE = 10
+MAX_PURGE_BATCH_SIZE = 500
+MIN_PURGE_INTERVAL = datetime.timedelta(seconds = 3)
+
+# define the phases of the purge for each rule, and the phases that purge the tweets that no rule recorded itself
+# against and the search index once all of the rules have been purged
+PURGE_TWEETS = 'tweets'
+PURGE_ARCHIVE = 'archive'
+PURGE_ROLLUPS = 'rollups'
+PURGE_HISTORIES = 'histories'
+PURGE_PHASES = (PURGE_TWEETS, PURGE_ARCHIVE, PURGE_ROLLUPS, PURGE_HISTORIES)
+PURGE_UNASSIGNED_TWEETS = 'unassignedtweets'
+PURGE_UNASSIGNED_ARCHIVE = 'unassignedarchive'
+PURGE_POSTINGS = 'postings'
+COMMON_PURGE_PHASES = (PURGE_UNASSIGNED_TWEETS, PURGE_UNASSIGNED_ARCHIVE, PURGE_POSTINGS)
+
+# define the resolutions of the rollups that are purged (the day and month rollups are small enough to keep)
+PURGED_ROLLUP_RESOLUTIONS = (rollups.RESOLUTION_MINUTE, rollups.RESOLUTION_HOUR)
+
 # define the twitter base search api
 TWITTER_BASEURL = 'http://twitter.com/'
 TWITTER_SEARCHURL = TWITTER_BASEURL + 'search.json?q=%s&since_id=%s'
@@ -51,18 +112,32 @@ class TwawlTask(slicer.SlicedTask):
         self.nextRequest = None
         self.processedCount = 0
         self.currentHistory = None
+        self.currentRule = None
         self.searchType = "search"
+        self.pageWriter = None
+        self.prefetch = False
+        self.scheduler = ratelimit.RateLimitScheduler()
+        self.prefetchRequest = None
+        self.prefetchPage = None
+        
+        # initialise the details of the rule and history updates that haven't been written yet
+        self.taskId = "%016x" % random.getrandbits(64)
+        self.pendingTweets = 0
+        self.pendingHighTweetId = 0
+        self.pendingDate = None
+        self.pendingRollups = rollups.RollupBuffer()
+        self.pendingSteps = []
+        self.pageRollups = rollups.RollupBuffer()
+        self.lastWrite = None
+        self.journalChecked = False
         
         # initialise function callbacks
         self.tweetInspectors = []
+        self.batchInspectors = []
         
-        # if the run user has been specified, then find the access key for the user
+        # if the run user has been specified, then find the access key for the user (this is usually cached)
         if run_as_user:
-            accesskey_data = OAuthAccessKey.findByUserName(run_as_user)
-            
-            # if we have found some data, then update the access key
-            if accesskey_data:
-                self._accessKey = accesskey_data.accessKeyEncoded
+            self._accessKey = OAuthAccessKey.findAccessTokenByUserName(run_as_user)
                 
     def inspectTweet(self, tweet):
         """
@@ -75,6 +150,16 @@ class TwawlTask(slicer.SlicedTask):
         for inspector in self.tweetInspectors:
             inspector(tweet)
         
+    def inspectPage(self, page):
+        """
+        This method is used to give each of the batch inspectors the whole page of tweets before the tweets are
+        processed.  Batch inspectors work on the columns of the page (a twitter.TweetBatch) and can mark many tweets
+        as not worth saving in one go, see inspectors.CompiledInspector.
+        """
+        
+        for inspector in self.batchInspectors:
+            inspector(page)
+        
     def processTweet(self, tweet):
         """
         This method is used to process a tweet and aggregate it into the database
@@ -82,15 +167,19 @@ class TwawlTask(slicer.SlicedTask):
         
         # update the high tweet id
         if (tweet is not None):
-            # increment the processed count
+            # increment the processed count (and count the tweet towards the rollups for the rule)
             self.processedCount += 1
+            self.pageRollups.add(tweet.created_at)
             
             # inspect the tweet
             self.inspectTweet(tweet)
             
-            # if we have been told to save the tweet, then save it to the database
+            # if we have been told to save the tweet, then queue it to be written with the rest of the page
             if tweet.worthSaving:
-                tweet.save(self.currentHistory)
+                if self.pageWriter is not None:
+                    self.pageWriter.add(tweet, self.ruleName)
+                else:
+                    tweet.save(self.currentHistory)
 
             # if the tweet id is higher than the current high tweet id, then update
             if (tweet.id > self.highTweetId):
@@ -108,67 +197,1175 @@ class TwawlTask(slicer.SlicedTask):
         # call inherited functionality 
         slicer.SlicedTask.runTask(self, sliceAction) 
         
+        # if we aren't able to make a request, then we are done
+        if not self.canRequest():
+            self.cancelPrefetch()
+            return True
+        
+        # create the twitter search request and run it (if the page was prefetched, then just wait for the response)
+        search_request = self.createRequest()
+        if search_request.pendingFetch is not None:
+            fnresult = self.processRequest(search_request, search_request.completeFetch)
+            
+            # if the prefetched page failed and can be retried, then wait for the retry as there is nothing else to do
+            if search_request.retryAt is None:
+                return fnresult
+            
+            return self.processRequest(search_request, search_request.executeRetry)
+        
+        # batch inspectors need the whole page, and prefetching needs to know about the next page before the page
+        # is processed, otherwise the tweets can be processed as they are decoded
+        if self.batchInspectors or self.prefetch:
+            return self.processRequest(search_request, search_request.execute)
+        
+        return self.processRequest(search_request, search_request.executeStreaming)
+    
+    def tearDown(self):
+        """
+        This method is used to clean up the task, abandoning any page that was being prefetched
+        """
+        
+        self.cancelPrefetch()
+        
+        # write anything we have been holding on to
+        self.writeRecords()
+        
+        # call the inherited tear down
+        slicer.SlicedTask.tearDown(self)
+    
+    def canRequest(self):
+        """
+        This method is used to check that the task is able to make a request to twitter, i.e. we have enough time 
+        remaining and the task has been set up properly
+        """
+        
         # check that we have got enough time to make a twitter api call
-        fnresult = (self.getTimeRemaining() < MIN_TWEET_PROCESSING_INTERVAL)
+        fnresult = (self.getTimeRemaining() >= MIN_TWEET_PROCESSING_INTERVAL)
         
         # if the twawl name is not set, then log a warning and mark as complete
         if (self.ruleName == ''):
             logging.warning("No twawl rule name is set, unable to twawl for tweets")
-            fnresult = True
+            fnresult = False
             
         # if we don't have an access key we can't do anything
         if (self._accessKey is None):
             logging.warning("No access key set, suspect we have don't have a validation access key for %s", self._runAsUser)
-            fnresult = True
+            fnresult = False
             
+        return fnresult
+    
+    def createRequest(self):
+        """
+        This method is used to create the twitter request for the next page of tweets for the rule
+        """
+        
         # reset the processed count
         self.processedCount = 0 
-               
-        # if we haven't run out of time then carry on
-        if (not fnresult):
-            # get the rule instance
-            rule = twawlermodel.TwawlRule.findOrCreate(self.ruleName)
-            
-            # create the twitter search request
-            search_request = twitter.newRequest(self.searchType, twitter_config = self._twitterConfig)
-            search_request.accessToken = self._accessKey
-            search_request.highTweetId = rule.highTweetId
-            search_request.nextPage = self.nextRequest
-            search_request.searchQuery = self.searchFor
-            search_request.language = "en"
-            
-            logging.debug("High tweet id is %s", search_request.highTweetId)
-            
-            # make the request
-            search_request.execute(self.processTweet)
-            
-            # if the request was not successful, return that we have finished immediately
-            if not search_request.successful:
-                return True
-            
-            # save the next page results, for if we get another shot
-            self.nextRequest = search_request.nextPage
-            
-            # update the function result, based on the success of our search
-            foundTweets = (search_request.nextPage is not None) or (self.highTweetId > search_request.highTweetId)
-            fnresult = not foundTweets
-            
-            # if the request resulted in us finding some tweets, then update the history
-            if foundTweets:         
-                # get the search history for today
-                self.currentHistory = twawlermodel.TwawlHistory.findOrCreateToday(self.ruleName)
-                self.currentHistory.highTweetId = self.highTweetId
+        self.pageRollups.clear()
+        
+        # get the rule instance
+        self.loadRule()
+        
+        # if the page we want has already been requested, then use that request
+        if (self.prefetchRequest is not None) and (self.prefetchPage == self.nextRequest):
+            fnresult = self.prefetchRequest
+            self.prefetchRequest = None
+            self.prefetchPage = None
+            
+            logging.debug("Using the prefetched request for page %s", self.nextRequest)
+            return fnresult
+        
+        # any other prefetched page is no longer any use to us
+        self.cancelPrefetch()
+        
+        return self.buildRequest(self.nextRequest)
+    
+    def loadRule(self):
+        """
+        This method is used to load the rule that we are twawling for
+        """
+        
+        # the first time we load the rule, finish off the updates of any tasks for the rule that have died
+        if not self.journalChecked:
+            self.recoverJournal()
+            self.journalChecked = True
+            
+        self.currentRule = twawlermodel.TwawlRule.findOrCreate(self.ruleName)
+        
+        # the rule may not have been updated with the tweets we have found yet
+        if self.pendingHighTweetId > self.currentRule.highTweetId:
+            self.currentRule.highTweetId = self.pendingHighTweetId
+        
+    def getSinceId(self):
+        """
+        This method is used to return the id of the tweet that the search should start after
+        """
+        
+        return self.currentRule.highTweetId
+    
+    def getLastSearched(self):
+        """
+        This method is used to return when the rule was last searched (None if it never has been), the rule is
+        loaded if it hasn't been already
+        """
+        
+        if self.currentRule is None:
+            self.loadRule()
+            
+        return self.currentRule.lastSearch
+    
+    def buildRequest(self, nextPage):
+        """
+        This method is used to build a twitter request for the specified page of results for the current rule
+        
+        @nextPage the next page parameters returned by twitter, or None for the first page
+        """
+        
+        # create the twitter search request
+        fnresult = twitter.newRequest(self.searchType, twitter_config = self._twitterConfig)
+        fnresult.accessToken = self._accessKey
+        fnresult.scheduler = self.scheduler
+        fnresult.highTweetId = self.getSinceId()
+        fnresult.nextPage = nextPage
+        fnresult.searchQuery = self.searchFor
+        fnresult.language = "en"
+        
+        # don't let the request retry past the point where we would have no time left to process the tweets
+        fnresult.deadline = self.startTime + self.sliceTime - MIN_TWEET_PROCESSING_INTERVAL
+        
+        # we process the tweets as they arrive, so there is no need for the request to hold on to them
+        fnresult.retainTweets = False
+        
+        # if we have batch inspectors, then let them look at each page before the tweets are processed
+        if self.batchInspectors:
+            fnresult.pageCallback = self.inspectPage
+        
+        # if we are prefetching, then we want to know about the next page as soon as possible
+        if self.prefetch:
+            fnresult.nextPageCallback = self.startPrefetch
+        
+        logging.debug("High tweet id is %s", fnresult.highTweetId)
+        
+        return fnresult
+    
+    def startPrefetch(self, search_request):
+        """
+        This method is used to request the next page of results while the current page is being processed.  Only
+        one page is prefetched at a time, and we won't start if there isn't enough time left in the slice to 
+        make use of the page.
+        
+        @search_request the request that has just received the current page
+        """
+        
+        # if we already have a page on the way, then leave it at that
+        if self.prefetchRequest is not None:
+            return
+        
+        # make sure the response will arrive with enough time left to process it
+        secondsRemaining = self.getSecondsRemaining() - MIN_TWEET_PROCESSING_INTERVAL.seconds
+        if secondsRemaining < MIN_TWEET_PROCESSING_INTERVAL.seconds:
+            logging.debug("Not enough time remaining to prefetch page %s", search_request.nextPage)
+            return
+        
+        # start the request for the next page
+        prefetchRequest = self.buildRequest(search_request.nextPage)
+        if prefetchRequest.startFetch(secondsRemaining) is not None:
+            self.prefetchRequest = prefetchRequest
+            self.prefetchPage = search_request.nextPage
+            
+            logging.debug("Prefetching page %s", self.prefetchPage)
+            
+    def cancelPrefetch(self):
+        """
+        This method is used to abandon the page that is being prefetched (if any).  The response is ignored and
+        the page will be requested again the next time it is required.
+        """
+        
+        if self.prefetchRequest is not None:
+            logging.debug("Abandoning the prefetch of page %s", self.prefetchPage)
+            
+        self.prefetchRequest = None
+        self.prefetchPage = None
+    
+    def processRequest(self, search_request, executeAction):
+        """
+        This method is used to run the request (by calling the execute action with the tweet processing callback)
+        and then update the rule and history with the results.  The method returns True once there are no more
+        tweets to be found for the rule.
+        
+        @search_request the request created by createRequest
+        @executeAction the method used to run the request, either execute, executeStreaming or completeFetch of 
+        the request
+        """
+        
+        # run the request, collecting the tweets from the page so they can be written in a single batch
+        self.pageWriter = twitter.TweetPageWriter()
+        try:
+            executeAction(self.processTweet)
+            
+            # write the tweets from the page to the database
+            self.pageWriter.flush()
+        finally:
+            self.pageWriter = None
+        
+        # if the request was not successful, return that we have finished immediately
+        if not search_request.successful:
+            return True
+        
+        # save the next page results, for if we get another shot
+        self.nextRequest = search_request.nextPage
+        
+        # update the function result, based on the success of our search
+        foundTweets = (search_request.nextPage is not None) or (self.highTweetId > search_request.highTweetId)
+        fnresult = not foundTweets
+        
+        # if the request resulted in us finding some tweets, then update the history
+        if foundTweets:         
+            self.recordTweets()
+            
+        return fnresult
+    
+    def recordTweets(self):
+        """
+        This method is used to update todays history and the rule with the tweets processed by the last request.
+        The updates are held on to (and journaled in the cache in case the task dies) and only written to the
+        database every writeCacheInterval seconds, and when the task is torn down.
+        """
+        
+        # if the day has ticked over (or the last write failed part of the way through), then the pending updates
+        # need to be written first
+        today = datetime.datetime.utcnow().date()
+        if ((self.pendingDate is not None) and (self.pendingDate != today)) or self.pendingSteps:
+            self.writeRecords()
+            
+        # add the tweets to the pending updates
+        self.pendingTweets += self.processedCount
+        self.pendingRollups.merge(self.pageRollups.counts)
+        self.pageRollups.clear()
+        self.pendingHighTweetId = max(self.pendingHighTweetId, self.highTweetId)
+        self.pendingDate = today
+        
+        # if it is time (or we are holding too many rollup counts), then write the updates, otherwise journal them
+        if self.lastWrite is None:
+            self.lastWrite = self.startTime
+            
+        if (datetime.datetime.utcnow() - self.lastWrite >= datetime.timedelta(seconds = self.writeCacheInterval)) or self.pendingRollups.isFull():
+            self.writeRecords()
+        else:
+            self.writeJournal()
+            
+    def writeRecords(self):
+        """
+        This method is used to write the pending updates to the history and the rule
+        """
+        
+        # if we have nothing to write, then there is nothing to do
+        if self.pendingDate is None:
+            return
+        
+        # journal each step as it is written, so if we fail part of the way through the steps that were written
+        # aren't written again (by us or by the task that recovers the journal)
+        def stepWritten(step):
+            self.pendingSteps.append(step)
+            self.writeJournal()
+            
+        self.currentHistory = self.applyRecords(self.ruleName, self.pendingHighTweetId, self.pendingTweets, self.pendingDate, 
+                                                self.pendingRollups.counts, self.pendingSteps, stepWritten)
+        
+        # the updates have been written, so we no longer need the journal
+        self.pendingTweets = 0
+        self.pendingDate = None
+        self.pendingRollups.clear()
+        self.pendingSteps = []
+        self.lastWrite = datetime.datetime.utcnow()
+        self.writeJournal()
+        
+    def applyRecords(ruleName, highTweetId, tweets, searchDate, rollupCounts = None, writtenSteps = (), stepWritten = None):
+        """
+        This static method is used to write an update to the history for the date, the rule and the rollups for 
+        the rule, the history is returned.  The update is written in steps (the history, the rule and each chunk
+        of the rollups), the steps that were written by an earlier attempt are skipped.
+        
+        @writtenSteps the names of the steps that have already been written
+        @stepWritten a function that is passed the name of each step once it has been written
+        """
+        
+        # update the history
+        fnresult = twawlermodel.TwawlHistory.findOrCreateForDate(ruleName, searchDate)
+        if STEP_HISTORY not in writtenSteps:
+            fnresult.highTweetId = max(fnresult.highTweetId, highTweetId)
+            fnresult.put()
+            fnresult.addTweets(tweets)
+            
+            if stepWritten:
+                stepWritten(STEP_HISTORY)
+        
+        # update the rule
+        rule = twawlermodel.TwawlRule.findOrCreate(ruleName)
+        if STEP_RULE not in writtenSteps:
+            rule.update(max(rule.highTweetId, highTweetId), tweets)
+            
+            if stepWritten:
+                stepWritten(STEP_RULE)
+        
+        # update the rollups (the steps are named after the chunks of the rollups)
+        if rollupCounts:
+            rollups.TwawlRollup.addCounts(rule.ruleName, rollupCounts, writtenSteps, stepWritten)
+        
+        return fnresult
+    
+    applyRecords = staticmethod(applyRecords)
+    
+    def updateJournal(self, changeJournal):
+        """
+        This method is used to make a change to the journal for the rule.  The journal is shared by all of the
+        tasks for the rule, so the change is saved with a compare and set, and if another task has changed the 
+        journal in the meantime the change is made again to the journal as it is now.  True is returned once the
+        change has been saved (or there was nothing to change), False if we gave up.
+        
+        @changeJournal a function that is passed the journal (a dict) to change, it returns True if it changed
+        the journal and False if there is nothing to save
+        """
+        
+        journalKey = cachehelper.createCacheKey("twawljournal", self.ruleName)
+        client = memcache.Client()
+        
+        for attempt in range(JOURNAL_UPDATE_ATTEMPTS):
+            journal = client.gets(journalKey)
+            
+            # if there isn't a journal yet, then add one (this fails if another task adds one first)
+            if journal is None:
+                journal = {}
+                if not changeJournal(journal):
+                    return True
+                
+                if client.add(journalKey, journal, time = JOURNAL_CACHE_TIME):
+                    return True
+            else:
+                if not changeJournal(journal):
+                    return True
+                
+                if client.cas(journalKey, journal, time = JOURNAL_CACHE_TIME):
+                    return True
+                
+        logging.warning("unable to update the journal for rule %s after %s attempts", self.ruleName, JOURNAL_UPDATE_ATTEMPTS)
+        return False
+    
+    def writeJournal(self):
+        """
+        This method is used to save the pending updates for the task to the journal for the rule (or remove them 
+        from the journal if there aren't any).  The journal holds the pending updates of each task for the rule, 
+        keyed by the id of the task.
+        """
+        
+        def changeJournal(journal):
+            # if we have nothing pending, then remove our entry (if we aren't in the journal there is nothing to do)
+            if self.pendingDate is None:
+                return journal.pop(self.taskId, None) is not None
+            
+            journal[self.taskId] = (self.pendingHighTweetId, self.pendingTweets, self.pendingDate, datetime.datetime.utcnow(), self.pendingRollups.counts, 
+                                    list(self.pendingSteps))
+            return True
+        
+        self.updateJournal(changeJournal)
+        
+    def recoverJournal(self):
+        """
+        This method is used to write the updates that were journaled by tasks for the rule that died before they
+        were able to write them.  A task is assumed to have died if it hasn't updated its journal entry for
+        JOURNAL_STALE_INTERVAL.
+        """
+        
+        # initialise variables
+        staleBefore = datetime.datetime.utcnow() - JOURNAL_STALE_INTERVAL
+        staleEntries = []
+        
+        def removeStaleEntries(journal):
+            # find the entries of the tasks that have died (starting again each time the journal is changed)
+            del staleEntries[:]
+            for (taskId, entry) in journal.items():
+                if entry[3] < staleBefore:
+                    staleEntries.append((taskId, entry))
+                    del journal[taskId]
+                    
+            return len(staleEntries) > 0
+        
+        # remove the entries from the journal before we write them, an entry is only written by the task that 
+        # managed to remove it, so two tasks recovering the journal at the same time can't both write it
+        if not self.updateJournal(removeStaleEntries):
+            return
+        
+        # write the updates
+        for (taskId, entry) in staleEntries:
+            # entries journaled before the rollups (and the steps) were added won't have them
+            (highTweetId, tweets, searchDate, updated) = entry[:4]
+            rollupCounts = (len(entry) > 4) and entry[4] or None
+            writtenSteps = (len(entry) > 5) and entry[5] or []
+            
+            logging.warning("recovering %s tweets for rule %s journaled by task %s at %s (steps already written %s)", tweets, self.ruleName, taskId, updated, writtenSteps)
+            TwawlTask.applyRecords(self.ruleName, highTweetId, tweets, searchDate, rollupCounts, writtenSteps)
+    
+class MultiRuleTwawlTask(TwawlTask):
+    """
+    The MultiRuleTwawlTask is used to twawl for a number of rules within the one slice.  Rather than waiting on 
+    each request in turn, the requests for the rules are sent to twitter at the same time (using the asynchronous
+    fetches of the request transport) and each response is processed as soon as it arrives.  Each rule is looked after by its 
+    own TwawlTask, this task just coordinates the requests.
+    """
+    
+    def __init__(self, run_as_user, twitter_config = None, maxInterval = slicer.DEFAULT_MAX_INTERVAL, maxConcurrent = DEFAULT_MAX_CONCURRENT_REQUESTS):
+        """
+        Initialise the new MultiRuleTwawlTask object
+        """
+        
+        # call the inherited constructor
+        TwawlTask.__init__(self, run_as_user, twitter_config, maxInterval)
+        
+        # initialise members
+        self.maxConcurrent = maxConcurrent
+        self.rules = []
+        self.ruleTasks = []
+        
+    def addRule(self, ruleName, searchFor):
+        """
+        This method is used to add a rule that will be twawled for by the task
+        
+        @ruleName the name of the rule
+        @searchFor the search query for the rule
+        """
+        
+        self.rules.append((ruleName, searchFor))
+        
+    def setup(self, request):
+        """
+        This method is used to create the tasks for each of the rules
+        """
+        
+        # call the inherited setup
+        TwawlTask.setup(self, request)
+        
+        # create a task for each of the rules, sharing the details of this task
+        self.ruleTasks = []
+        for (ruleName, searchFor) in self.rules:
+            ruleTask = TwawlTask(None, self._twitterConfig, self.sliceTime)
+            ruleTask._runAsUser = self._runAsUser
+            ruleTask._accessKey = self._accessKey
+            ruleTask.startTime = self.startTime
+            ruleTask.ruleName = ruleName
+            ruleTask.searchFor = searchFor
+            ruleTask.searchType = self.searchType
+            ruleTask.prefetch = self.prefetch
+            ruleTask.scheduler = self.scheduler
+            ruleTask.tweetInspectors = self.tweetInspectors
+            ruleTask.batchInspectors = self.batchInspectors
+            
+            self.ruleTasks.append(ruleTask)
+            
+    def tearDown(self):
+        """
+        This method is used to clean up the task and the tasks for each of the rules
+        """
+        
+        for ruleTask in self.ruleTasks:
+            ruleTask.tearDown()
+            
+        # call the inherited tear down
+        TwawlTask.tearDown(self)
+        
+    def _lastSearched(self, ruleTask):
+        """
+        This method is used to return when the rule for a rule task was last searched (if we know)
+        """
+        
+        return ruleTask.getLastSearched()
+    
+    def runTask(self, sliceAction):
+        """
+        In the context of this task we will request the next page of tweets for each of the rules that have not
+        yet been completed, with up to maxConcurrent requests in flight at any one time.  The task is complete
+        once all of the rules are complete.
+        """
+        
+        # call inherited functionality 
+        slicer.SlicedTask.runTask(self, sliceAction) 
+        
+        # initialise variables, the rules that were searched least recently go first
+        waitingTasks = [ruleTask for ruleTask in self.ruleTasks if not ruleTask.taskComplete]
+        waitingTasks = self.scheduler.orderCandidates(waitingTasks, self._lastSearched)
+        activeRequests = {}
+        retryRequests = []
+        requestCount = 0
+        
+        while waitingTasks or activeRequests or retryRequests:
+            # start the retries that are due (they take priority over the rules that haven't been searched yet)
+            now = datetime.datetime.utcnow()
+            for (retryAt, ruleTask, search_request) in [retry for retry in retryRequests if retry[0] <= now]:
+                retryRequests.remove((retryAt, ruleTask, search_request))
                 
-                # update the total tweets for the history
-                if (self.currentHistory.totalTweets is None):
-                    self.currentHistory.totalTweets = self.processedCount
+                # if we have run out of time, then the retry is left for the next slice
+                pendingFetch = None
+                secondsRemaining = self.getSecondsRemaining()
+                if secondsRemaining > 0:
+                    pendingFetch = search_request.startFetch(secondsRemaining, search_request.retryAttempt)
+                    
+                if pendingFetch is None:
+                    ruleTask.taskComplete = True
                 else:
-                    self.currentHistory.totalTweets = self.currentHistory.totalTweets + self.processedCount  
+                    activeRequests[pendingFetch] = (ruleTask, search_request)
+                    
+            # start requests for the waiting rules until we reach the concurrency limit
+            while waitingTasks and (len(activeRequests) < self.maxConcurrent):
+                ruleTask = waitingTasks.pop(0)
                 
-                # save todays history
-                self.currentHistory.put()
+                # if the rule can't make a request (we are probably out of time) then leave it for the next slice, 
+                # the rule tasks are created again for each slice so it is only complete for this one
+                if not ruleTask.canRequest():
+                    ruleTask.taskComplete = True
+                    continue
+                
+                # start the request (unless it was prefetched), don't wait any longer for the response than the time we have left
+                search_request = ruleTask.createRequest()
+                pendingFetch = search_request.pendingFetch
+                secondsRemaining = self.getSecondsRemaining()
+                if (pendingFetch is None) and (secondsRemaining > 0):
+                    pendingFetch = search_request.startFetch(secondsRemaining)
+                
+                if pendingFetch is None:
+                    ruleTask.taskComplete = True
+                else:
+                    activeRequests[pendingFetch] = (ruleTask, search_request)
+                    requestCount += 1
+                    
+            # if nothing is in flight, then wait for the next retry to be due (if there is one)
+            if not activeRequests:
+                if not retryRequests:
+                    break
                 
-                # update the total tweets for the rule
-                rule.update(self.highTweetId, self.processedCount)
+                retryDelay = min(retryRequests)[0] - datetime.datetime.utcnow()
+                if retryDelay > datetime.timedelta(0):
+                    time.sleep(retryDelay.seconds + retryDelay.microseconds / 1000000.0)
+                    
+                continue
             
-        return fnresult
\ No newline at end of file
+            # wait for the next response to arrive and process it
+            pendingFetch = transport.waitAny(activeRequests.keys())
+            (ruleTask, search_request) = activeRequests.pop(pendingFetch)
+            
+            ruleTask.taskComplete = ruleTask.processRequest(search_request, search_request.completeFetch)
+            
+            # if the request failed and can be retried, then start it again once the retry is due (the other 
+            # requests carry on in the meantime)
+            if search_request.retryAt is not None:
+                ruleTask.taskComplete = False
+                retryRequests.append((search_request.retryAt, ruleTask, search_request))
+            
+        # if we weren't able to start any requests, then there is no point trying again in this slice
+        if requestCount == 0:
+            return True
+        
+        # we are complete when all of the rules are complete
+        for ruleTask in self.ruleTasks:
+            if not ruleTask.taskComplete:
+                return False
+            
+        return True
+
+class RulePackTask(TwawlTask):
+    """
+    The RulePackTask is used to search for a number of rules using a single query (the searches for each of the rules
+    are OR'd together).  The tweets that are returned are matched against the search for each of the rules, and
+    passed to the task for each rule that they match, so the history and high tweet id of each of the rules are
+    kept up to date as if the rules had been searched for separately.
+    """
+    
+    def __init__(self, ruleTasks, twitter_config = None, maxInterval = slicer.DEFAULT_MAX_INTERVAL):
+        """
+        Initialise the new RulePackTask object
+        
+        @ruleTasks the tasks for the rules in the pack
+        """
+        
+        # call the inherited constructor
+        TwawlTask.__init__(self, None, twitter_config, maxInterval)
+        
+        # initialise members
+        self.ruleTasks = ruleTasks
+        self.ruleName = ", ".join([ruleTask.ruleName for ruleTask in ruleTasks])
+        self.searchFor = " OR ".join([ruleTask.searchFor for ruleTask in ruleTasks])
+        self.unmatchedCount = 0
+        self.sinceIds = []
+        
+        # build the matcher used to work out which rules a tweet belongs to
+        self.matcher = inspectors.KeywordMatcher()
+        for (index, ruleTask) in enumerate(ruleTasks):
+            self.matcher.addPattern(ruleTask.searchFor.strip('"'), index)
+            
+    def loadRule(self):
+        """
+        This method is used to load the rules for each of the tasks in the pack.  When we are starting a new
+        search, we also remember where each of the rules was up to, as the rules are updated as each page is
+        processed and the later pages of the search will contain older tweets.
+        """
+        
+        for ruleTask in self.ruleTasks:
+            ruleTask.processedCount = 0
+            ruleTask.pageRollups.clear()
+            ruleTask.loadRule()
+            
+        if (self.nextRequest is None) or (not self.sinceIds):
+            self.sinceIds = [ruleTask.getSinceId() for ruleTask in self.ruleTasks]
+            
+    def getSinceId(self):
+        """
+        This method is used to return the id of the tweet that the search should start after, the search has to 
+        start after the rule that is furthest behind
+        """
+        
+        return min(self.sinceIds)
+    
+    def getLastSearched(self):
+        """
+        This method is used to return when the pack was last searched, which is when the rule in the pack that
+        was searched least recently was searched (None if one of the rules has never been searched)
+        """
+        
+        fnresult = [ruleTask.getLastSearched() for ruleTask in self.ruleTasks]
+        if None in fnresult:
+            return None
+        
+        return min(fnresult)
+    
+    def processTweet(self, tweet):
+        """
+        This method is used to pass a tweet to the tasks for each of the rules that it matches
+        """
+        
+        if tweet is None:
+            return
+        
+        # update the processed count and the high tweet id for the pack
+        self.processedCount += 1
+        if (tweet.id > self.highTweetId):
+            self.highTweetId = tweet.id
+            
+        # find the rules that the tweet belongs to
+        matchedRules = self.matcher.match(tweet.text)
+        if not matchedRules:
+            self.unmatchedCount += 1
+            logging.debug("Tweet %s did not match any of the rules in the pack", tweet.id)
+            
+        for index in matchedRules:
+            ruleTask = self.ruleTasks[index]
+            
+            # the pack searches from the rule that is furthest behind, so skip the tweets this rule has already seen
+            if tweet.id <= self.sinceIds[index]:
+                continue
+            
+            # the tweets for all of the rules are written with the page for the pack
+            ruleTask.pageWriter = self.pageWriter
+            ruleTask.processTweet(tweet)
+            ruleTask.pageWriter = None
+            
+    def recordTweets(self):
+        """
+        This method is used to update the history and the rule for each of the rules that found tweets
+        """
+        
+        for ruleTask in self.ruleTasks:
+            if ruleTask.processedCount > 0:
+                ruleTask.recordTweets()
+                ruleTask.processedCount = 0
+                
+    def tearDown(self):
+        """
+        This method is used to clean up the task and the tasks for each of the rules in the pack
+        """
+        
+        for ruleTask in self.ruleTasks:
+            ruleTask.tearDown()
+            
+        # call the inherited tear down
+        TwawlTask.tearDown(self)
+        
+    def processRequest(self, search_request, executeAction):
+        """
+        This method is used to run the request for the pack.  Once we have reached the end of the search, the rules
+        that didn't find anything are moved up to the high tweet id of the pack, otherwise the rules that are
+        behind would hold the search for the whole pack back.
+        """
+        
+        # run the request
+        fnresult = TwawlTask.processRequest(self, search_request, executeAction)
+        
+        # if we have reached the end of the search, then bring the rules up to date
+        if search_request.successful and (search_request.nextPage is None):
+            for ruleTask in self.ruleTasks:
+                if ruleTask.currentRule.highTweetId < self.highTweetId:
+                    ruleTask.highTweetId = self.highTweetId
+                    ruleTask.recordTweets()
+                    
+        return fnresult
+                
+class MergedRuleTwawlTask(MultiRuleTwawlTask):
+    """
+    The MergedRuleTwawlTask is used to twawl for a large number of rules, packing the rules into as few search
+    queries as possible.  Rules with a simple search (a single keyword, hashtag or quoted phrase) are packed into
+    queries up to the maximum length of a search query, the remaining rules are searched for on their own.  The
+    requests for the packs (and the remaining rules) are made concurrently in the same way as the multi rule task.
+    """
+    
+    def __init__(self, run_as_user, twitter_config = None, maxInterval = slicer.DEFAULT_MAX_INTERVAL, maxConcurrent = DEFAULT_MAX_CONCURRENT_REQUESTS, maxQueryLength = MAX_SEARCH_QUERY_LENGTH):
+        """
+        Initialise the new MergedRuleTwawlTask object
+        """
+        
+        # call the inherited constructor
+        MultiRuleTwawlTask.__init__(self, run_as_user, twitter_config, maxInterval, maxConcurrent)
+        
+        # initialise members
+        self.maxQueryLength = maxQueryLength
+        
+    def setup(self, request):
+        """
+        This method is used to create the tasks for each of the rules, and then pack the rules together
+        """
+        
+        # call the inherited setup
+        MultiRuleTwawlTask.setup(self, request)
+        
+        # only searches can be merged
+        if self.searchType != "search":
+            return
+        
+        # pack the rules that can be merged
+        packs = []
+        unpackedTasks = []
+        currentPack = []
+        queryLength = 0
+        
+        for ruleTask in self.ruleTasks:
+            if not MERGEABLE_SEARCH.match(ruleTask.searchFor):
+                unpackedTasks.append(ruleTask)
+                continue
+            
+            # if the search won't fit in the current pack, then start a new one
+            addedLength = len(ruleTask.searchFor) + (len(" OR ") if currentPack else 0)
+            if currentPack and (queryLength + addedLength > self.maxQueryLength):
+                packs.append(currentPack)
+                currentPack = []
+                addedLength = len(ruleTask.searchFor)
+                queryLength = 0
+                
+            currentPack.append(ruleTask)
+            queryLength += addedLength
+            
+        if currentPack:
+            packs.append(currentPack)
+        
+        # create a task for each of the packs (there is no point in a pack for a single rule)
+        self.ruleTasks = unpackedTasks
+        for pack in packs:
+            if len(pack) == 1:
+                self.ruleTasks.append(pack[0])
+            else:
+                self.ruleTasks.append(self.createPack(pack))
+                
+        logging.debug("packed %s rules into %s requests", len(self.rules), len(self.ruleTasks))
+        
+    def createPack(self, ruleTasks):
+        """
+        This method is used to create the task for a pack of rules, sharing the details of this task
+        """
+        
+        fnresult = RulePackTask(ruleTasks, self._twitterConfig, self.sliceTime)
+        fnresult._runAsUser = self._runAsUser
+        fnresult._accessKey = self._accessKey
+        fnresult.startTime = self.startTime
+        fnresult.searchType = self.searchType
+        fnresult.prefetch = self.prefetch
+        fnresult.scheduler = self.scheduler
+        fnresult.tweetInspectors = self.tweetInspectors
+        fnresult.batchInspectors = self.batchInspectors
+        
+        return fnresult
+
+class ArchiveTask(slicer.SlicedTask):
+    """
+    The ArchiveTask is used to move the tweets that are older than a number of days into the archive (see
+    archive.TweetArchive), a batch at a time.  Only whole days are archived, so the tweets for a rule and day
+    usually end up in a single archive part.  The task is complete once there are no tweets left to archive.
+    """
+    
+    def __init__(self, archiveAfterDays = DEFAULT_ARCHIVE_AFTER_DAYS, batchSize = DEFAULT_ARCHIVE_BATCH_SIZE, maxInterval = slicer.DEFAULT_MAX_INTERVAL):
+        """
+        Initialise the new ArchiveTask object
+        
+        @archiveAfterDays the number of days tweets are kept before they are archived
+        @batchSize the number of tweets archived at a time
+        """
+        
+        # call the inherited constructor
+        slicer.SlicedTask.__init__(self, maxInterval)
+        
+        # initialise members
+        self.archiveAfterDays = archiveAfterDays
+        self.batchSize = batchSize
+        self.archiveBefore = None
+        self.archivedCount = 0
+        
+    def setup(self, request):
+        """
+        This method is used to work out which tweets are old enough to be archived
+        """
+        
+        # call the inherited setup
+        slicer.SlicedTask.setup(self, request)
+        
+        today = datetime.datetime.utcnow().date() - datetime.timedelta(days = self.archiveAfterDays)
+        self.archiveBefore = datetime.datetime(today.year, today.month, today.day)
+        
+    def runTask(self, sliceAction):
+        """
+        This method is used to archive the next batch of the oldest tweets, returning True once there are no
+        more tweets to archive
+        """
+        
+        # call inherited functionality 
+        slicer.SlicedTask.runTask(self, sliceAction)
+        
+        # make sure we have enough time left to archive a batch
+        if self.getTimeRemaining() < MIN_ARCHIVE_INTERVAL:
+            logging.debug("not enough time remaining to archive another batch")
+            return True
+        
+        # find the oldest tweets
+        query = twawlermodel.Tweet.all()
+        query.filter('created_at <', self.archiveBefore)
+        query.order('created_at')
+        tweets = query.fetch(self.batchSize)
+        
+        if not tweets:
+            return True
+        
+        # keep the tweets for the last day back if the batch is full, so the day is archived in one go next time
+        # (unless the day doesn't fit in a batch at all)
+        if len(tweets) == self.batchSize:
+            lastDate = tweets[-1].created_at.date()
+            wholeDays = [tweet for tweet in tweets if tweet.created_at.date() < lastDate]
+            if wholeDays:
+                tweets = wholeDays
+                
+        archive.TweetArchive.archiveTweets(tweets)
+        self.archivedCount += len(tweets)
+        
+        return False
+        
+    def tearDown(self):
+        """
+        This method is used to log the number of tweets that were archived
+        """
+        
+        logging.info("archived %s tweets created before %s", self.archivedCount, self.archiveBefore)
+        
+        # call the inherited tear down
+        slicer.SlicedTask.tearDown(self)
+
+class PurgeTask(slicer.SlicedTask):
+    """
+    The PurgeTask is used to delete the tweets, archived tweets, minute and hour rollups and history of each rule
+    that are older than the retention days of the rule (the day and month rollups are kept, as there are only a
+    few of them for each rule).  For each rule the keys of the entities to delete are found with keys only
+    queries, and deleted in batches that are sized to fit the time left in the slice.  The position of the purge
+    (the rule, what is being purged and the query cursor) is checkpointed after every batch, so the purge carries
+    on where it left off in the next slice.  Once the purge has been through all of the rules it isn't run again
+    until PURGE_INTERVAL has passed.
+
+    A tweet can be found by more than one rule, so a tweet is only deleted once it has passed the retention of
+    every rule that found it.  When the rule being purged has the longest retention of all of the rules this is
+    always true and the tweets are deleted by key, otherwise the tweets are read to check their rules first.  For 
+    the same reason the search index (which isn't kept by rule) is only purged for the days that have passed the
+    retention of every rule, once all of the rules have been purged.  The tweets that were saved without a rule 
+    (and so are never found by the query for a rule) and their archive parts are purged at the same time.
+    """
+    
+    def __init__(self, maxInterval = slicer.DEFAULT_MAX_INTERVAL, checkpointName = "purge"):
+        """
+        Initialise the new PurgeTask object
+        
+        @checkpointName the name of the checkpoint the position of the purge is saved in
+        """
+        
+        # call the inherited constructor
+        slicer.SlicedTask.__init__(self, maxInterval)
+        
+        # initialise members
+        self.checkpointName = checkpointName
+        self.checkpoint = None
+        self.rules = []
+        self.cutoffs = {}
+        self.keepForever = False
+        self.commonCutoff = None
+        self.batchSize = DEFAULT_PURGE_BATCH_SIZE
+        self.deletedCount = 0
+        
+    def setup(self, request):
+        """
+        This method is used to load the checkpoint of the purge, and the retention of each of the rules
+        """
+        
+        # call the inherited setup
+        slicer.SlicedTask.setup(self, request)
+        
+        self.checkpoint = slicer.TaskCheckpoint.findOrCreate(self.checkpointName)
+        
+        # if the last purge finished recently, then there is nothing to do (otherwise start a new purge)
+        if self.checkpoint.complete:
+            if datetime.datetime.utcnow() - self.checkpoint.updated < PURGE_INTERVAL:
+                logging.debug("the last purge completed at %s, nothing to do", self.checkpoint.updated)
+                self.taskComplete = True
+                return
+            
+            self.checkpoint.complete = False
+            self.checkpoint.position = None
+            self.checkpoint.cursor = None
+            self.checkpoint.processedCount = 0
+            
+        # find the rules that have a retention policy (in name order, so the position of the purge is stable)
+        for rule in twawlermodel.TwawlRule.all():
+            cutoff = rule.getRetentionCutoff()
+            if cutoff is None:
+                self.keepForever = True
+            else:
+                self.cutoffs[rule.ruleName] = cutoff
+                self.rules.append(rule)
+                
+        self.rules.sort(key = lambda rule: rule.ruleName)
+        
+        # the search index and the tweets without a rule can only be purged once they have passed the retention of 
+        # every rule
+        if self.cutoffs and (not self.keepForever):
+            self.commonCutoff = min(self.cutoffs.values())
+        
+    def getPosition(self):
+        """
+        This method is used to return the index of the rule being purged and the phase of the purge from the
+        checkpoint.  If the rule no longer has a retention policy, then the purge moves on to the next rule.  The
+        tweets without a rule and the search index are purged after the last rule.
+        """
+        
+        if not self.checkpoint.position:
+            return (0, PURGE_PHASES[0])
+        
+        (phase, ruleName) = self.checkpoint.position.split(':', 1)
+        if phase in COMMON_PURGE_PHASES:
+            return (len(self.rules), phase)
+        
+        ruleIndex = bisect.bisect_left([rule.ruleName for rule in self.rules], ruleName)
+        
+        if (ruleIndex < len(self.rules)) and (self.rules[ruleIndex].ruleName == ruleName):
+            return (ruleIndex, phase)
+        
+        self.checkpoint.cursor = None
+        
+        # if there are no rules left, then move on to the phases that come after the rules
+        if ruleIndex >= len(self.rules):
+            return (ruleIndex, COMMON_PURGE_PHASES[0])
+        
+        return (ruleIndex, PURGE_PHASES[0])
+    
+    def setPosition(self, ruleIndex, phase, cursor = None):
+        """
+        This method is used to update the position of the purge in the checkpoint, once we have run out of rules
+        the tweets without a rule and the search index are purged (if they can be) and then the purge is complete
+        """
+        
+        if ruleIndex >= len(self.rules):
+            if (phase in COMMON_PURGE_PHASES) and (self.commonCutoff is not None):
+                self.checkpoint.position = "%s:" % phase
+                self.checkpoint.cursor = cursor
+            else:
+                self.checkpoint.complete = True
+                self.checkpoint.position = None
+                self.checkpoint.cursor = None
+        else:
+            self.checkpoint.position = "%s:%s" % (phase, self.rules[ruleIndex].ruleName)
+            self.checkpoint.cursor = cursor
+            
+    def nextPosition(self, ruleIndex, phase):
+        """
+        This method is used to move the purge on to the next phase (or the next rule, or the phases that come 
+        after the rules once all of the rules are done)
+        """
+        
+        if phase in COMMON_PURGE_PHASES:
+            phaseIndex = COMMON_PURGE_PHASES.index(phase) + 1
+            if phaseIndex < len(COMMON_PURGE_PHASES):
+                self.setPosition(len(self.rules), COMMON_PURGE_PHASES[phaseIndex])
+            else:
+                self.setPosition(len(self.rules), None)
+            return
+        
+        phaseIndex = PURGE_PHASES.index(phase) + 1
+        if phaseIndex < len(PURGE_PHASES):
+            self.setPosition(ruleIndex, PURGE_PHASES[phaseIndex])
+        elif ruleIndex + 1 < len(self.rules):
+            self.setPosition(ruleIndex + 1, PURGE_PHASES[0])
+        else:
+            self.setPosition(len(self.rules), COMMON_PURGE_PHASES[0])
+            
+    def createQuery(self, rule, phase):
+        """
+        This method is used to create the keys only query for the entities of the rule that have passed its
+        retention, for the specified phase of the purge (the rule is None for the phases that come after the rules).
+        The composite indexes that the queries need are defined in index.yaml.
+        """
+        
+        # the tweets without a rule can't be queried for (an empty list isn't indexed), so the tweets that have 
+        # passed the retention of every rule are read and checked (see findDeleteKeys)
+        if phase == PURGE_UNASSIGNED_TWEETS:
+            fnresult = twawlermodel.Tweet.all(keys_only = True)
+            fnresult.filter('created_at <', self.commonCutoff)
+            return fnresult
+        
+        # the tweets without a rule are archived under the unassigned rule
+        if phase == PURGE_UNASSIGNED_ARCHIVE:
+            return archive.TweetArchive.queryParts(archive.UNASSIGNED_RULE, archive.EARLIEST_DATE, self.commonCutoff.date() - datetime.timedelta(days = 1), keysOnly = True)
+        
+        # the search index is kept by term and day, not by rule
+        if phase == PURGE_POSTINGS:
+            fnresult = tweetindex.TweetPosting.all(keys_only = True)
+            fnresult.filter('date <', self.commonCutoff.date())
+            return fnresult
+        
+        cutoff = self.cutoffs[rule.ruleName]
+        
+        if phase == PURGE_TWEETS:
+            fnresult = twawlermodel.Tweet.all(keys_only = True)
+            fnresult.filter('rules =', rule.ruleName)
+            fnresult.filter('created_at <', cutoff)
+        elif phase == PURGE_ARCHIVE:
+            fnresult = archive.TweetArchive.queryParts(rule.ruleName, archive.EARLIEST_DATE, cutoff.date() - datetime.timedelta(days = 1), keysOnly = True)
+        elif phase == PURGE_ROLLUPS:
+            fnresult = rollups.TwawlRollup.all(keys_only = True)
+            fnresult.filter('ruleName =', rule.ruleName)
+            fnresult.filter('periodStart <', cutoff)
+        else:
+            fnresult = twawlermodel.TwawlHistory.all(keys_only = True)
+            fnresult.filter('rule =', rule.key())
+            fnresult.filter('searchDate <', cutoff.date())
+            
+        return fnresult
+    
+    def isExpired(self, tweet):
+        """
+        This method is used to check whether a tweet has passed the retention of all of the rules that found it
+        """
+        
+        for ruleName in tweet.rules:
+            cutoff = self.cutoffs.get(ruleName)
+            if (cutoff is None) or (tweet.created_at >= cutoff):
+                return False
+            
+        return True
+    
+    def findDeleteKeys(self, rule, phase, keys):
+        """
+        This method is used to work out which keys should be deleted from the keys found by the query, along with
+        anything that needs to be deleted with them
+        """
+        
+        if phase == PURGE_TWEETS:
+            # if no other rule keeps tweets for longer than this one, then the tweets can be deleted by key
+            if (not self.keepForever) and (self.cutoffs[rule.ruleName] <= min(self.cutoffs.values())):
+                return keys
+            
+            return [tweet.key() for tweet in db.get(keys) if (tweet is not None) and self.isExpired(tweet)]
+        
+        elif phase == PURGE_UNASSIGNED_TWEETS:
+            # the tweets with rules are left to the purge of their rules
+            return [tweet.key() for tweet in db.get(keys) if (tweet is not None) and (not tweet.rules)]
+        
+        elif phase == PURGE_HISTORIES:
+            # the tweet counters of the histories are deleted along with them
+            fnresult = list(keys)
+            for key in keys:
+                searchDate = twawlermodel.TwawlHistory.searchDateFromKey(key)
+                if searchDate is not None:
+                    fnresult.extend(twawlermodel.TwawlHistory.counterFor(rule.ruleName, searchDate).shardKeys())
+                    
+            return fnresult
+        
+        elif phase == PURGE_ROLLUPS:
+            # only the finer rollups are deleted (the resolution starts the key name of a rollup, see keyFor)
+            return [key for key in keys if key.name().split('_', 1)[0] in PURGED_ROLLUP_RESOLUTIONS]
+        
+        return keys
+        
+    def runTask(self, sliceAction):
+        """
+        This method is used to delete the next batch of entities, returning True once the purge is complete or
+        we don't have time for another batch
+        """
+        
+        # call inherited functionality 
+        slicer.SlicedTask.runTask(self, sliceAction)
+        
+        # make sure we have enough time left to delete a batch
+        if self.getTimeRemaining() < MIN_PURGE_INTERVAL:
+            logging.debug("not enough time remaining to purge another batch")
+            return True
+        
+        # find where we are up to
+        started = time.time()
+        (ruleIndex, phase) = self.getPosition()
+        if (ruleIndex >= len(self.rules)) and ((phase not in COMMON_PURGE_PHASES) or (self.commonCutoff is None)):
+            self.setPosition(ruleIndex, phase)
+            self.checkpoint.put()
+            return True
+        
+        rule = (ruleIndex < len(self.rules)) and self.rules[ruleIndex] or None
+        
+        # find the next batch of keys
+        batchSize = self.batchSize
+        query = self.createQuery(rule, phase)
+        if self.checkpoint.cursor:
+            query.with_cursor(self.checkpoint.cursor)
+            
+        keys = query.fetch(batchSize)
+        
+        # delete the batch
+        deleteKeys = self.findDeleteKeys(rule, phase, keys)
+        for offset in range(0, len(deleteKeys), MAX_PURGE_BATCH_SIZE):
+            db.delete(deleteKeys[offset:offset + MAX_PURGE_BATCH_SIZE])
+            
+        self.deletedCount += len(deleteKeys)
+        logging.debug("purged %s %s entities for rule %s", len(deleteKeys), phase, rule and rule.ruleName)
+        
+        # if the batch wasn't full, then we have finished this phase
+        if len(keys) < batchSize:
+            self.nextPosition(ruleIndex, phase)
+        else:
+            self.setPosition(ruleIndex, phase, query.cursor())
+            
+        self.checkpoint.processedCount += len(deleteKeys)
+        self.checkpoint.put()
+        
+        # size the next batch so that it takes no more than half of the time we have left
+        elapsed = time.time() - started
+        if keys and (elapsed > 0):
+            remaining = self.getTimeRemaining() - MIN_PURGE_INTERVAL
+            remainingSeconds = remaining.days * 86400 + remaining.seconds + remaining.microseconds / 1000000.0
+            self.batchSize = max(MIN_PURGE_BATCH_SIZE, min(MAX_PURGE_BATCH_SIZE, int(remainingSeconds / 2 * len(keys) / elapsed)))
+        
+        return self.checkpoint.complete
+    
+    def tearDown(self):
+        """
+        This method is used to log the number of entities that were purged
+        """
+        
+        if self.checkpoint is not None:
+            logging.info("purged %s entities (%s this purge, complete = %s)", self.deletedCount, self.checkpoint.processedCount, self.checkpoint.complete)
+        
+        # call the inherited tear down
+        slicer.SlicedTask.tearDown(self)
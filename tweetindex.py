@@ -0,0 +1,542 @@
+# File: tweetindex.py
+# This file is used to define the full text index over the tweets that have been saved.  Without the index the only
+# way to find the saved tweets that mention a word is to go through all of them.  As the tweets are saved the text
+# of each tweet is split into terms, and the id of the tweet is added to the posting list for each of its terms on
+# the day the tweet was created.  Searching for a number of terms then only needs to read the posting lists for
+# those terms, and intersect them.
+#
+# Posting lists are stored as sorted lists of tweet ids, delta encoded (each id is stored as the difference from
+# the previous id) as variable length integers and then compressed.  Each page of tweets that is saved adds a new
+# block to the posting list of each of its terms, so writers never have to update an existing entity (and never
+# contend with each other).  The posting lists that have built up too many blocks are merged in the background by
+# the IndexCompactTask, so neither the writers nor the searches have to wait for it.
+#
+# Section: Version History
+# 16/10/2026 (DJO) - Created File
+
+# import standard libraries
+import re
+import zlib
+import random
+import logging
+import datetime
+
+# import the appengine libraries
+from google.appengine.ext import db
+
+# import other gaetools libraries
+import slicer
+import archive
+import twawlermodel
+
+# initialise some default values
+MAX_TERM_LENGTH = 100
+MAX_BLOCKS_BEFORE_COMPACT = 20
+MAX_BLOCK_POSTINGS = 100000
+MAX_BATCH_PUT = 500
+MAX_BLOCK_FETCH = 1000
+DEFAULT_SEARCH_DAYS = 30
+DEFAULT_PAGE_SIZE = 20
+DEFAULT_COMPACT_DAYS = 2
+DEFAULT_COMPACT_BATCH_SIZE = 1000
+MIN_COMPACT_INTERVAL = datetime.timedelta(seconds = 5)
+
+# define the words that are too common to be worth indexing
+STOP_WORDS = set(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in', 'is', 'it', 'of',
+                  'on', 'or', 'so', 'the', 'to', 'rt', 'was', 'with'])
+
+# initialise the regular expressions used to split the text of a tweet into terms
+URL_PATTERN = re.compile(r"https?://\S+", re.IGNORECASE)
+TERM_PATTERN = re.compile(r"[#@]?\w+", re.UNICODE)
+
+def tokenize(text, expand = True):
+    """
+    This function is used to split the text of a tweet into the set of terms that are indexed.  Terms are lower
+    case, links are ignored, and hashtags and mentions are kept with their leading # or @.
+
+    @text the text to split
+    @expand if True then hashtags and mentions are also indexed as plain words (so searching for "python" finds
+    tweets tagged #python), this is turned off when a query is being split
+    """
+
+    fnresult = set()
+
+    for term in TERM_PATTERN.findall(URL_PATTERN.sub(' ', text.lower())):
+        word = term.lstrip('#@')
+
+        # ignore the terms that aren't worth indexing
+        if (len(word) < 2) or (len(term) > MAX_TERM_LENGTH) or (word in STOP_WORDS):
+            continue
+
+        fnresult.add(term)
+        if expand and (word != term):
+            fnresult.add(word)
+
+    return fnresult
+
+def encodePostings(tweetIds):
+    """
+    This function is used to encode a list of tweet ids, the ids are sorted and each is written as the difference
+    from the previous id using a variable length integer (7 bits to a byte) and the result is compressed
+    """
+
+    # initialise variables
+    encoded = []
+    previous = 0
+
+    for tweetId in sorted(set(tweetIds)):
+        delta = tweetId - previous
+        previous = tweetId
+
+        # write the delta 7 bits at a time, the high bit is set on every byte but the last
+        while delta >= 0x80:
+            encoded.append(chr((delta & 0x7f) | 0x80))
+            delta >>= 7
+
+        encoded.append(chr(delta))
+
+    return zlib.compress(''.join(encoded))
+
+def decodePostings(data):
+    """
+    This function is used to read a list of tweet ids written by encodePostings, the ids are returned in order
+    """
+
+    # initialise variables
+    fnresult = []
+    previous = 0
+    delta = 0
+    shift = 0
+
+    for char in zlib.decompress(data):
+        byte = ord(char)
+        delta |= (byte & 0x7f) << shift
+
+        if byte & 0x80:
+            shift += 7
+        else:
+            previous += delta
+            fnresult.append(previous)
+            delta = 0
+            shift = 0
+
+    return fnresult
+
+def _formatDate(value):
+    """
+    This function is used to format a date for use in a key name (or cursor)
+    """
+
+    return value.strftime("%Y%m%d")
+
+class TweetPosting(db.Model):
+    """
+    This model is used to store a block of the posting list for a term on a day.  Blocks are stored against a key
+    name made up of the term, the day and the range of the tweet ids in the block, so all of the blocks for a term
+    and day sit together in key order and can be read with a single key range query.  Two pages can hold the same
+    range of ids for a term (the same tweets found by two tasks, or ids that interleave), so the key name ends with
+    a random suffix to stop one block overwriting the other.
+    """
+
+    term = db.StringProperty(required = True)
+    date = db.DateProperty(required = True)
+    count = db.IntegerProperty(required = True, default = 0)
+    postings = db.BlobProperty(required = True)
+
+    def keyPrefixFor(term, date):
+        """
+        This static method is used to generate the start of the key names of the blocks for a term and day
+        """
+
+        return u"%s|%s|" % (term, _formatDate(date))
+
+    def keyNameFor(term, date, firstId, lastId, suffix):
+        """
+        This static method is used to generate the key name of a block, the ids are padded so that the blocks
+        are in id order
+        """
+
+        return u"%s%020d-%020d-%s" % (TweetPosting.keyPrefixFor(term, date), firstId, lastId, suffix)
+
+    def create(term, date, tweetIds):
+        """
+        This static method is used to create (but not save) a block holding the specified tweet ids
+        """
+
+        tweetIds = sorted(set(tweetIds))
+        suffix = "%08x" % random.getrandbits(32)
+
+        return TweetPosting(key_name = TweetPosting.keyNameFor(term, date, tweetIds[0], tweetIds[-1], suffix),
+                            term = term,
+                            date = date,
+                            count = len(tweetIds),
+                            postings = db.Blob(encodePostings(tweetIds)))
+
+    def addTweets(tweets):
+        """
+        This static method is used to add a page of tweets to the index.  A single block is written for each of
+        the terms (and days) found on the page, and the blocks are saved in batches.
+
+        @tweets the tweets to add, these need id, created_at and text attributes
+        """
+
+        # gather the ids for each term and day
+        postings = {}
+        for tweet in tweets:
+            date = tweet.created_at.date()
+            for term in tokenize(tweet.text):
+                postings.setdefault((term, date), []).append(tweet.id)
+
+        # if there is nothing to index, then don't go any further
+        if not postings:
+            return 0
+
+        # create the blocks and save them
+        blocks = [TweetPosting.create(term, date, tweetIds) for ((term, date), tweetIds) in postings.items()]
+        for offset in range(0, len(blocks), MAX_BATCH_PUT):
+            db.put(blocks[offset:offset + MAX_BATCH_PUT])
+
+        logging.debug("indexed %s tweets with %s posting blocks", len(tweets), len(blocks))
+
+        return len(blocks)
+
+    def findBlocks(term, date):
+        """
+        This static method is used to read all of the blocks of the posting list for a term and day, the blocks
+        are read MAX_BLOCK_FETCH at a time until there are none left
+        """
+
+        # initialise variables
+        fnresult = []
+        prefix = TweetPosting.keyPrefixFor(term, date)
+
+        query = TweetPosting.all()
+        query.filter('__key__ >=', db.Key.from_path('TweetPosting', prefix))
+        query.filter('__key__ <', db.Key.from_path('TweetPosting', prefix + u'\ufffd'))
+
+        while True:
+            blocks = query.fetch(MAX_BLOCK_FETCH)
+            fnresult.extend(blocks)
+
+            # if we didn't get a full batch, then we have all of the blocks
+            if len(blocks) < MAX_BLOCK_FETCH:
+                return fnresult
+
+            query.with_cursor(query.cursor())
+
+    def readPostings(term, date):
+        """
+        This static method is used to read the posting list for a term and day, the tweet ids are returned in
+        order
+        """
+
+        # initialise variables
+        tweetIds = set()
+
+        for block in TweetPosting.findBlocks(term, date):
+            tweetIds.update(decodePostings(block.postings))
+
+        return sorted(tweetIds)
+
+    def compactTerm(term, date):
+        """
+        This static method is used to merge the blocks of the posting list for a term and day, if it has more
+        than MAX_BLOCKS_BEFORE_COMPACT blocks.  True is returned if the blocks were merged.
+        """
+
+        # initialise variables
+        blocks = TweetPosting.findBlocks(term, date)
+        tweetIds = set()
+
+        if len(blocks) <= MAX_BLOCKS_BEFORE_COMPACT:
+            return False
+
+        for block in blocks:
+            tweetIds.update(decodePostings(block.postings))
+
+        TweetPosting.compact(blocks, sorted(tweetIds))
+
+        return True
+
+    def compact(blocks, tweetIds):
+        """
+        This static method is used to merge the blocks of a posting list.  The merged blocks are written before
+        the old blocks are deleted, so a search that runs at the same time will at worst see the same ids twice
+        (and blocks added while we are merging are left alone, they can't share a key with the blocks we read).
+
+        @blocks the blocks that were read
+        @tweetIds the ordered ids held by the blocks
+        """
+
+        (term, date) = (blocks[0].term, blocks[0].date)
+
+        # write the ids into as few blocks as possible
+        merged = [TweetPosting.create(term, date, tweetIds[offset:offset + MAX_BLOCK_POSTINGS])
+                  for offset in range(0, len(tweetIds), MAX_BLOCK_POSTINGS)]
+        db.put(merged)
+
+        # delete the old blocks (unless one of the merged blocks has replaced it)
+        mergedKeys = set([block.key() for block in merged])
+        db.delete([block.key() for block in blocks if block.key() not in mergedKeys])
+
+        logging.info("merged %s posting blocks for %s on %s into %s", len(blocks), term, date, len(merged))
+
+    keyPrefixFor = staticmethod(keyPrefixFor)
+    keyNameFor = staticmethod(keyNameFor)
+    create = staticmethod(create)
+    addTweets = staticmethod(addTweets)
+    findBlocks = staticmethod(findBlocks)
+    readPostings = staticmethod(readPostings)
+    compactTerm = staticmethod(compactTerm)
+    compact = staticmethod(compact)
+
+class IndexCompactTask(slicer.SlicedTask):
+    """
+    The IndexCompactTask is used to merge the posting lists that have built up too many blocks.  The keys of the
+    blocks for each of the most recent days are walked in key order (so the blocks for each term come together) 
+    a batch at a time, and the terms that have more than MAX_BLOCKS_BEFORE_COMPACT blocks are compacted.  The 
+    day and term the task is up to are checkpointed after each batch, so the task carries on where it left off in
+    the next slice.  Once all of the days have been walked the next run starts again from the first day.  Walking
+    the blocks for a day needs an index on the date property and the key of the TweetPosting model.
+    """
+
+    def __init__(self, days = DEFAULT_COMPACT_DAYS, batchSize = DEFAULT_COMPACT_BATCH_SIZE, maxInterval = slicer.DEFAULT_MAX_INTERVAL, checkpointName = "compact_index"):
+        """
+        Initialise the new IndexCompactTask object
+
+        @days the number of days (up to and including today) that are compacted
+        @batchSize the number of block keys read at a time
+        @checkpointName the name of the checkpoint the position of the task is saved in
+        """
+
+        # call the inherited constructor
+        slicer.SlicedTask.__init__(self, maxInterval)
+
+        # initialise members
+        self.days = days
+        self.batchSize = batchSize
+        self.checkpointName = checkpointName
+        self.checkpoint = None
+        self.compactedCount = 0
+
+    def setup(self, request):
+        """
+        This method is used to load the checkpoint of the task, starting again if the last run was completed
+        """
+
+        # call the inherited setup
+        slicer.SlicedTask.setup(self, request)
+
+        self.checkpoint = slicer.TaskCheckpoint.findOrCreate(self.checkpointName)
+        if self.checkpoint.complete:
+            self.checkpoint.position = None
+            self.checkpoint.processedCount = 0
+            self.checkpoint.complete = False
+
+    def getPosition(self):
+        """
+        This method is used to read the day and term the task is up to from the checkpoint, days that have
+        dropped out of the window since the checkpoint was saved are skipped
+        """
+
+        # initialise variables
+        firstDate = datetime.datetime.utcnow().date() - datetime.timedelta(days = self.days - 1)
+        (date, term) = (firstDate, None)
+
+        if self.checkpoint.position:
+            (positionDate, term) = self.checkpoint.position.split('|', 1)
+            date = datetime.datetime.strptime(positionDate, "%Y%m%d").date()
+
+        if date < firstDate:
+            return (firstDate, None)
+
+        return (date, term or None)
+
+    def runTask(self, sliceAction):
+        """
+        This method is used to compact the terms found in the next batch of block keys, returning True once all 
+        of the days have been walked or we don't have time for another batch
+        """
+
+        # call inherited functionality
+        slicer.SlicedTask.runTask(self, sliceAction)
+
+        # make sure we have enough time left to compact a batch
+        if self.getTimeRemaining() < MIN_COMPACT_INTERVAL:
+            logging.debug("not enough time remaining to compact another batch")
+            return True
+
+        # if we have been through all of the days, then we are done
+        (date, term) = self.getPosition()
+        if date > datetime.datetime.utcnow().date():
+            self.checkpoint.complete = True
+            self.checkpoint.put()
+            return True
+
+        # read the next batch of keys for the day, starting from the blocks of the term we are up to
+        query = TweetPosting.all(keys_only = True)
+        query.filter('date =', date)
+        if term is not None:
+            query.filter('__key__ >=', db.Key.from_path('TweetPosting', TweetPosting.keyPrefixFor(term, date)))
+        query.order('__key__')
+        keys = query.fetch(self.batchSize)
+
+        # count the blocks for each term (in key order)
+        terms = []
+        counts = {}
+        for key in keys:
+            blockTerm = key.name().split('|', 1)[0]
+            if blockTerm not in counts:
+                terms.append(blockTerm)
+                counts[blockTerm] = 0
+
+            counts[blockTerm] += 1
+
+        # if the batch was full, then the blocks of the last term may carry on into the next batch so the next batch
+        # starts with that term (unless it filled the batch on its own, in which case it is compacted now and the
+        # next batch starts with it again), otherwise we move on to the next day
+        if len(keys) < self.batchSize:
+            self.checkpoint.position = "%s|" % _formatDate(date + datetime.timedelta(days = 1))
+        elif len(terms) > 1:
+            self.checkpoint.position = "%s|%s" % (_formatDate(date), terms.pop())
+        else:
+            self.checkpoint.position = "%s|%s" % (_formatDate(date), terms[0])
+
+        # compact the terms with too many blocks
+        for blockTerm in terms:
+            if (counts[blockTerm] > MAX_BLOCKS_BEFORE_COMPACT) and TweetPosting.compactTerm(blockTerm, date):
+                self.compactedCount += 1
+
+        self.checkpoint.processedCount += len(keys)
+        self.checkpoint.put()
+
+        return False
+
+    def tearDown(self):
+        """
+        This method is used to log how many posting lists were compacted
+        """
+
+        logging.info("compacted %s posting lists", self.compactedCount)
+
+        # call the inherited tear down
+        slicer.SlicedTask.tearDown(self)
+
+class TweetSearch:
+    """
+    The TweetSearch class is used to find the saved tweets that contain all of the terms of a query.  The days of
+    the search window are worked through from the most recent, and the tweets are returned newest first.  Each
+    page returns a cursor which is passed back in to get the next page.
+    """
+
+    def __init__(self, query, startDate = None, endDate = None):
+        """
+        Initialise the search
+
+        @query the text to search for, tweets containing every term of the query are found
+        @startDate the earliest day to search, defaults to DEFAULT_SEARCH_DAYS before the end date
+        @endDate the latest day to search, defaults to today
+        """
+
+        # initialise members
+        self.terms = sorted(tokenize(query, expand = False))
+        self.endDate = endDate or datetime.datetime.utcnow().date()
+        self.startDate = startDate or (self.endDate - datetime.timedelta(days = DEFAULT_SEARCH_DAYS - 1))
+
+    def searchDate(self, date):
+        """
+        This method is used to find the ids of the tweets created on the specified day that contain all of the
+        terms.  As soon as a term has no matches the remaining terms aren't read.
+        """
+
+        fnresult = None
+
+        for term in self.terms:
+            tweetIds = TweetPosting.readPostings(term, date)
+
+            if fnresult is None:
+                fnresult = set(tweetIds)
+            else:
+                fnresult.intersection_update(tweetIds)
+
+            if not fnresult:
+                return []
+
+        return sorted(fnresult or [], reverse = True)
+
+    def fetch(self, limit = DEFAULT_PAGE_SIZE, cursor = None):
+        """
+        This method is used to fetch a page of matching tweet ids, newest first.  A tuple of the ids and the
+        cursor for the next page is returned, the cursor is None if there are no more matches.
+
+        @limit the number of ids to return
+        @cursor the cursor returned with the previous page
+        """
+
+        (postings, nextCursor) = self.fetchPostings(limit, cursor)
+
+        return ([tweetId for (date, tweetId) in postings], nextCursor)
+
+    def fetchPostings(self, limit = DEFAULT_PAGE_SIZE, cursor = None):
+        """
+        This method is used to fetch a page of matches in the same way as fetch, except that each match is 
+        returned as a tuple of the day the tweet was created and the tweet id
+        """
+
+        # initialise variables
+        fnresult = []
+        date = self.endDate
+        beforeId = None
+
+        # if there are no terms to look for, then there is nothing to find
+        if not self.terms:
+            return (fnresult, None)
+
+        # pick up from where the last page finished
+        if cursor:
+            (cursorDate, cursorId) = cursor.split(':')
+            date = datetime.datetime.strptime(cursorDate, "%Y%m%d").date()
+            beforeId = long(cursorId)
+
+        # work back through the days until we have a full page
+        while date >= self.startDate:
+            tweetIds = self.searchDate(date)
+            if beforeId is not None:
+                tweetIds = [tweetId for tweetId in tweetIds if tweetId < beforeId]
+
+            fnresult.extend([(date, tweetId) for tweetId in tweetIds[:limit - len(fnresult)]])
+
+            # if the page is full, then the next page starts after the last id we returned
+            if len(fnresult) >= limit:
+                return (fnresult, "%s:%s" % (_formatDate(date), fnresult[-1][1]))
+
+            date -= datetime.timedelta(days = 1)
+            beforeId = None
+
+        return (fnresult, None)
+
+    def fetchTweets(self, limit = DEFAULT_PAGE_SIZE, cursor = None):
+        """
+        This method is used to fetch a page of matching tweets, a tuple of the tweets and the cursor for the next
+        page is returned.  The tweets that have been moved into the archive are read from the archive parts for
+        the day they were created, so the page can contain archive.ArchivedTweet objects as well as Tweet models.
+        """
+
+        # initialise variables
+        (postings, nextCursor) = self.fetchPostings(limit, cursor)
+        tweetIds = [tweetId for (date, tweetId) in postings]
+        missing = {}
+
+        # read the tweets that are still live
+        tweets = twawlermodel.Tweet.get_by_key_name([twawlermodel.Tweet.keyNameFor(tweetId) for tweetId in tweetIds])
+        found = dict([(tweet.tweet_id, tweet) for tweet in tweets if tweet is not None])
+
+        # look for the rest in the archive (we don't know which rules they were archived for, only the day)
+        for (date, tweetId) in postings:
+            if tweetId not in found:
+                missing.setdefault(date, []).append(tweetId)
+
+        for (date, missingIds) in missing.items():
+            found.update(archive.TweetArchive.findTweets(date, missingIds))
+
+        return ([found[tweetId] for tweetId in tweetIds if tweetId in found], nextCursor)
@@ -8,6 +8,14 @@
 # 16/05/2009 (DJO) - Created File
 # 15/01/2010 (DJO) - Modifications to the library to allow looser coupling
 
+import os
+import cgi
+import hmac
+import time
+import random
+import hashlib
+import binascii
+import urlparse
 import datetime
 import yaml
 import logging
@@ -15,7 +23,7 @@ import exceptions
 
 # import app engine libs
 from google.appengine.api import memcache
-from google.appengine.api import urlfetch
+from google.appengine.ext import db
 
 # import the django simplejson lib
 from django.utils import simplejson
@@ -23,6 +31,11 @@ from django.utils import simplejson
 # import other libs
 import oauth
 import cachehelper
+import datehelper
+import transport
+import resilience
+import bloomfilter
+import tweetindex
 
 # TODO: remove the dependency on the TwawlUser library - twitter library needs to be stand-alone
 import twawlermodel
@@ -41,12 +54,27 @@ ACTION_ACCOUNT_VERIFY = 'account/verify_credentials.json'
 ACTION_GETMENTIONS = 'statuses/mentions.json'
 PARAM_NEXTPAGE = 'next_page'
 
-# TODO: investigate date time format differences
-DATETIME_FORMAT_TWITTERSEARCH = "%a, %d %b %Y %H:%M:%S +0000"
-DATETIME_FORMAT_TWITTER = "%a %b %d %H:%M:%S +0000 %Y" # this used to work for the search method
+# TODO: investigate date time format differences (the formats are defined in datehelper, the twitter format used
+# to work for the search method)
+from datehelper import DATETIME_FORMAT_TWITTERSEARCH, DATETIME_FORMAT_TWITTER
 
 # initialise some default values
 DEFAULT_CONFIG = "twitter"
+CONFIG_DIRECTORY = "../../conf/"
+CONFIG_CHECK_INTERVAL = 60
+OAUTH_VERSION = "1.0"
+SIGNER_CACHE_SIZE = 100
+RESPONSE_CACHE_TIME = 3600
+MAX_REQUEST_DEADLINE = 10
+
+# the maximum number of entities the datastore will accept in a single put
+MAX_BATCH_PUT = 500
+
+# define the whitespace characters that can appear between json values
+JSON_WHITESPACE = ' \t\n\r'
+
+# define the fields of a tweet (in the order a tweet batch expects them)
+TWEET_FIELDS = ('id', 'created_at', 'from_user', 'from_user_id', 'to_user_id', 'text', 'profile_image_url', 'source', 'iso_language_code')
 
 class TwitterConfig:
     """
@@ -73,26 +101,30 @@ class TwitterConfig:
         if config: 
             self.load(config)
     
-    def load(self, config = DEFAULT_CONFIG):
+    def load(self, config = DEFAULT_CONFIG, version = None):
         """
         Load the required config from the cache or configuration file if not available
+        
+        @config the name of the configuration file
+        @version the version of the file (its modification time), cached configurations from other versions are ignored
         """
         
         # check to see if the config is currently cached
-        dataMap = memcache.get(cachehelper.createCacheKey("twitter-config", config))
+        cacheKey = cachehelper.createCacheKey("twitter-config", config, None if (version is None) else str(version))
+        dataMap = memcache.get(cacheKey)
 
         # if the dataMap is not cached, then load it from the yaml in the filesystem
         if dataMap is None:           
             # open the required configuration file (using the conf directory)
             # TODO: fix this rather silly path
-            fHandle = open('../../conf/' + config + '.yaml')
+            fHandle = open(TwitterConfig.pathFor(config))
             
             # now read the configuration information, and then close the file
             try:
                 dataMap = yaml.load(fHandle)
 
                 # save the datamap to the cache
-                memcache.set(cachehelper.createCacheKey("twitter-config", config), dataMap)
+                memcache.set(cacheKey, dataMap)
             finally:
                 fHandle.close()
             
@@ -102,6 +134,186 @@ class TwitterConfig:
         
         # add some logging
         logging.debug("consumerKey = %s", self.consumerKey)
+        
+    @staticmethod
+    def pathFor(config):
+        """
+        This static method is used to return the path of the file for the specified configuration
+        """
+        
+        return CONFIG_DIRECTORY + config + '.yaml'
+    
+    @staticmethod
+    def get(config = DEFAULT_CONFIG):
+        """
+        This static method is used to return the shared instance of the specified configuration.  The configuration
+        is held for the life of the instance, and is only loaded again once the file has changed.  The file is only
+        checked every CONFIG_CHECK_INTERVAL seconds, so most of the time this costs nothing at all.
+        
+        @config the name of the configuration file
+        """
+        
+        now = time.time()
+        
+        # if we have checked the configuration recently, then just return it
+        entry = _configRegistry.get(config)
+        if (entry is not None) and (now - entry[2] < CONFIG_CHECK_INTERVAL):
+            return entry[0]
+        
+        # find out which version of the file we have
+        try:
+            version = int(os.stat(TwitterConfig.pathFor(config)).st_mtime)
+        except OSError:
+            version = None
+            
+        # if the file hasn't changed, then hold on to what we have
+        if (entry is not None) and (entry[1] == version):
+            _configRegistry[config] = (entry[0], version, now)
+            return entry[0]
+        
+        # load the configuration (memcache is checked before we parse the file)
+        logging.debug("loading twitter config %s (version %s)", config, version)
+        fnresult = TwitterConfig(None)
+        fnresult.load(config, version)
+        
+        _configRegistry[config] = (fnresult, version, now)
+        
+        return fnresult
+    
+    @staticmethod
+    def invalidate(config = None):
+        """
+        This static method is used to discard the shared instance of the specified configuration (or all of the
+        configurations) so it is loaded again the next time it is requested
+        """
+        
+        if config is None:
+            _configRegistry.clear()
+        else:
+            _configRegistry.pop(config, None)
+            
+# initialise the registry of the configurations that have been loaded (each entry is a tuple of the configuration, 
+# the version of the file it was loaded from, and the time the file was last checked)
+_configRegistry = {}
+
+# initialise the instance cache of oauth signers
+_signerCache = cachehelper.LRUCache(SIGNER_CACHE_SIZE)
+
+# initialise the filter of the tweets that have been saved recently
+_seenTweets = bloomfilter.SeenTweetFilter()
+
+class OAuthSigner:
+    """
+    The OAuthSigner class is used to sign requests to twitter for a particular consumer and access token.  The
+    oauth library does a fair bit of work each time a request is signed (creating the consumer, parsing the token,
+    building the signing key) that is exactly the same for every request made for an account.  The signer does 
+    that work once and is then cached (see forToken), so signing a request is little more than a hmac of the 
+    request details.
+    """
+    
+    def __init__(self, consumerKey, consumerSecret, accessToken):
+        """
+        Initialise the signer for the specified consumer and access token
+        
+        @consumerKey the oauth consumer key for the application
+        @consumerSecret the oauth consumer secret for the application
+        @accessToken the encoded access token for the account
+        """
+        
+        # initialise members
+        self.consumer = oauth.OAuthConsumer(consumerKey, consumerSecret)
+        self.token = oauth.OAuthToken.from_string(accessToken)
+        self._normalizedUrls = {}
+        
+        # prepare the hmac with the signing key, each signature starts from a copy of this
+        self._hmac = hmac.new("%s&%s" % (oauth.escape(consumerSecret), oauth.escape(self.token.secret)), digestmod = hashlib.sha1)
+        
+        # prepare the (already escaped) oauth parameters that are the same for every request
+        self._oauthParams = [
+            ('oauth_consumer_key', oauth.escape(consumerKey)),
+            ('oauth_token', oauth.escape(self.token.key)),
+            ('oauth_signature_method', 'HMAC-SHA1'),
+            ('oauth_version', OAUTH_VERSION),
+        ]
+        
+    def _normalizeUrl(self, url):
+        """
+        This method is used to return the normalized (and escaped) form of the url used in the signature base 
+        string.  Requests are made to a small number of urls so the results are kept.
+        """
+        
+        fnresult = self._normalizedUrls.get(url)
+        if fnresult is None:
+            (scheme, netloc, path) = urlparse.urlparse(url)[:3]
+            (scheme, netloc) = (scheme.lower(), netloc.lower())
+            
+            # remove the default ports
+            if ((scheme == 'http') and netloc.endswith(':80')) or ((scheme == 'https') and netloc.endswith(':443')):
+                netloc = netloc[:netloc.rindex(':')]
+                
+            fnresult = oauth.escape('%s://%s%s' % (scheme, netloc, path))
+            self._normalizedUrls[url] = fnresult
+            
+        return fnresult
+    
+    def sign(self, url, method = 'GET'):
+        """
+        This method is used to sign a request for the specified url, returning the headers that should be sent
+        with the request
+        
+        @url the full url of the request (including the query string)
+        @method the http method of the request
+        """
+        
+        # split the query string from the url
+        url = str(url)
+        if '?' in url:
+            (request_url, request_querystr) = url.split('?', 1)
+        else:
+            (request_url, request_querystr) = (url, '')
+            
+        # build the oauth parameters that change with each request
+        oauthParams = self._oauthParams + [
+            ('oauth_timestamp', str(int(time.time()))),
+            ('oauth_nonce', str(random.randint(0, 99999999))),
+        ]
+        
+        # add the parameters from the query string, and normalize them as the signature base string requires
+        params = oauthParams[:]
+        if request_querystr:
+            for (key, values) in cgi.parse_qs(request_querystr, keep_blank_values = True).iteritems():
+                for value in values:
+                    params.append((oauth.escape(key), oauth.escape(value)))
+                    
+        params.sort()
+        
+        # sign the base string
+        signature = self._hmac.copy()
+        signature.update("%s&%s&%s" % (method.upper(), self._normalizeUrl(request_url), oauth.escape('&'.join(['%s=%s' % param for param in params]))))
+        oauthParams.append(('oauth_signature', oauth.escape(binascii.b2a_base64(signature.digest())[:-1])))
+        
+        # build the authorization header
+        return { 'Authorization': 'OAuth realm="", ' + ', '.join(['%s="%s"' % param for param in oauthParams]) }
+    
+    @staticmethod
+    def forToken(twitter_config, accessToken):
+        """
+        This static method is used to return the signer for the specified configuration and access token, the
+        signer is created the first time it is requested and then held in an instance cache
+        """
+        
+        # look for the signer in the cache
+        cacheKey = (twitter_config.consumerKey, twitter_config.consumerSecret, accessToken)
+        fnresult = _signerCache.get(cacheKey)
+        
+        # if we don't have one, then create it
+        if fnresult is None:
+            logging.debug("creating oauth signer for access token: %s", accessToken)
+            
+            fnresult = OAuthSigner(twitter_config.consumerKey, twitter_config.consumerSecret, accessToken)
+            _signerCache.set(cacheKey, fnresult)
+            
+        return fnresult
             
 class TwitterAuthRequiredException(Exception):
     """
@@ -178,7 +390,7 @@ class TwitterAuth:
         logging.debug("created auth request: %s", oauth_request)
         
         # send the request
-        request_result = urlfetch.fetch(url = requestTokenUrl, headers = oauth_request.to_header())
+        request_result = transport.getTransport().fetch(requestTokenUrl, headers = oauth_request.to_header())
         
         # if the response was successful, then process the response
         fnresult = None
@@ -217,7 +429,7 @@ class TwitterAuth:
         oauth_request.sign_request(oauth.OAuthSignatureMethod_HMAC_SHA1(), self.consumer, self.accessToken)
         
         # send the request
-        request_result = urlfetch.fetch(url = accessTokenUrl, headers = oauth_request.to_header())
+        request_result = transport.getTransport().fetch(accessTokenUrl, headers = oauth_request.to_header())
         
         # if the response was successful, then process the response
         fnresult = None
@@ -230,6 +442,9 @@ class TwitterAuth:
             # update the user accesskey 
             request.accessKeyEncoded = fnresult.to_string()
             request.put()
+            
+            # make sure the old access token isn't returned from the cache
+            OAuthAccessKey.invalidateAccessToken(request.requestKey, request.userName)
         else:
             logging.warning("Unable to obtain access token: %s", request_result.content)
             
@@ -261,9 +476,9 @@ class TwitterAuth:
             
             return fnresult
         
-        # if the access key is still not known, then see if we can obtain it from the database
+        # if the access key is still not known, then see if we can obtain it from the cache or database
         if fnresult is None:
-            fnresult = OAuthAccessKey.findByRequestKey(urlToken)
+            fnresult = OAuthAccessKey.findAccessTokenByRequestKey(urlToken)
             
         # if we have a value, then return that value
         if fnresult is not None:
@@ -280,6 +495,106 @@ class TwitterAuth:
         # return the access token
         return fnresult
     
+class JsonStreamDecoder:
+    """
+    The JsonStreamDecoder is used to decode the results in a json response one at a time.  Rather than decoding
+    the whole response in one go (and holding all of the decoded results in memory at once), each of the values
+    in the results array is decoded as it is requested.
+    """
+    
+    def __init__(self, content):
+        """
+        Initialise the decoder for the specified content
+        """
+        
+        # initialise members
+        self.content = content
+        self.index = 0
+        self.decoder = simplejson.JSONDecoder()
+        
+    def _peek(self):
+        """
+        This method is used to skip any whitespace and return the next character of the content
+        """
+        
+        while (self.index < len(self.content)) and (self.content[self.index] in JSON_WHITESPACE):
+            self.index += 1
+            
+        return self.content[self.index:self.index + 1]
+    
+    def _expect(self, chars):
+        """
+        This method is used to read the next character of the content, which should be one of the specified 
+        characters
+        """
+        
+        fnresult = self._peek()
+        if (fnresult == '') or (fnresult not in chars):
+            raise ValueError("Expected one of '%s' at position %s of the response" % (chars, self.index))
+        
+        self.index += 1
+        return fnresult
+    
+    def _readValue(self):
+        """
+        This method is used to decode the next value in the content
+        """
+        
+        self._peek()
+        (fnresult, self.index) = self.decoder.raw_decode(self.content, idx = self.index)
+        
+        return fnresult
+    
+    def iterArray(self):
+        """
+        This method is used to yield each of the values in the array at the current position
+        """
+        
+        # check for the start (and the end in the case of an empty array)
+        self._expect('[')
+        if self._peek() == ']':
+            self.index += 1
+            return
+        
+        # read the values until we reach the end of the array
+        while True:
+            yield self._readValue()
+            
+            if self._expect(',]') == ']':
+                return
+            
+    def iterObjectArray(self, arrayKey, memberCallback = None):
+        """
+        This method is used to yield each of the values in an array that is a member of the object at the
+        current position.  The other members of the object are decoded and passed to the member callback.
+        
+        @arrayKey the name of the member that holds the array
+        @memberCallback a function that is called with the key and value of each of the other members
+        """
+        
+        # check for the start (and the end in the case of an empty object)
+        self._expect('{')
+        if self._peek() == '}':
+            self.index += 1
+            return
+        
+        # read the members until we reach the end of the object
+        while True:
+            key = self._readValue()
+            self._expect(':')
+            
+            # if this is the array, then yield the values, otherwise pass the member to the callback
+            if key == arrayKey:
+                for value in self.iterArray():
+                    yield value
+            else:
+                value = self._readValue()
+                if memberCallback is not None:
+                    memberCallback(key, value)
+                    
+            if self._expect(',}') == '}':
+                return
+
 class Tweet():
     """
     This class is used to represent a tweet from twitter.
@@ -325,7 +640,8 @@ class Tweet():
         
         # TODO: implement a more elegant way of doing this - I hate typing repetitive stuff...
         self.id = srcDict.get('id', 0)
-        self.created_at = datetime.datetime.strptime(srcDict.get('created_at', self.created_at.strftime(self.dateTimeFormat)), self.dateTimeFormat)
+        if 'created_at' in srcDict:
+            self.created_at = datehelper.parseTwitterDate(srcDict['created_at'], self.dateTimeFormat)
         self.from_user = srcDict.get('from_user', self.from_user)
         self.from_user_id = srcDict.get('from_user_id', self.from_user_id)
         self.to_user_id = srcDict.get('to_user_id', self.to_user_id)
@@ -334,25 +650,341 @@ class Tweet():
         self.source = srcDict.get('source', self.source)
         self.iso_language_code = srcDict.get('iso_language_code', self.iso_language_code)
         
+    def loadFromValues(self, values):
+        """
+        This method is used to initialise the elements of the tweet from a sequence of values ordered in the same
+        way as TWEET_FIELDS
+        
+        @values the values for the tweet
+        """
+        
+        for (field, value) in zip(TWEET_FIELDS, values):
+            setattr(self, field, value)
+        
     def save(self, history):
         """
         The save method is used to save the specified tweet details to the database.  I considered using the model
-        class to pass around, but opted for a lightweight POPO instead.  Thus we need to save the object.
+        class to pass around, but opted for a lightweight POPO instead.  Thus we need to save the object.  The
+        tweet is written through a page writer, so a tweet that has already been saved won't be saved again.
         """
         
-        # create the tweet model object
-        dbTweet = twawlermodel.Tweet(tweet_id = self.id,
-                                     created_at = self.created_at,
-                                     from_user = twawlermodel.TwitterUser.findOrCreate(self.from_user_id, self.from_user, self.profile_image_url),
-                                     from_user_name = self.from_user,
-                                     profile_image_url = self.profile_image_url,
-                                     to_user = twawlermodel.TwitterUser.findOrCreate(self.to_user_id),
-                                     text = self.text,
-                                     iso_language_code = self.iso_language_code)
-        
         # save the tweet to the database
-        dbTweet.put()
+        writer = TweetPageWriter()
+        writer.add(self)
+        writer.flush()
+
+def _batchColumn(field):
+    """
+    This function is used to create a property on the TweetView class that reads and writes the value
+    for a particular field from the underlying batch
+    """
+    
+    def getValue(self):
+        return self.batch.columns[field][self.index]
+    
+    def setValue(self, value):
+        self.batch.columns[field][self.index] = value
+        
+    return property(getValue, setValue)
+
+class TweetView(object):
+    """
+    The TweetView class is a lightweight view of a single row in a TweetBatch.  It behaves in the same way as a
+    Tweet (so it can be passed to callbacks, inspectors and the page writer) but all of the values are read from 
+    and written back to the columns of the batch.
+    """
+    
+    __slots__ = ('batch', 'index')
+    
+    # define the tweet properties
+    id = _batchColumn('id')
+    created_at = _batchColumn('created_at')
+    from_user = _batchColumn('from_user')
+    from_user_id = _batchColumn('from_user_id')
+    to_user_id = _batchColumn('to_user_id')
+    text = _batchColumn('text')
+    profile_image_url = _batchColumn('profile_image_url')
+    source = _batchColumn('source')
+    iso_language_code = _batchColumn('iso_language_code')
+    worthSaving = _batchColumn('worthSaving')
+    
+    def __init__(self, batch, index):
+        """
+        Initialise the view of the specified row of the batch
+        """
+        
+        self.batch = batch
+        self.index = index
+        
+    def __str__(self):
+        """
+        Return a string representation of the tweet
+        """
+        
+        return "[" + str(self.id) +"] " + self.from_user + ": " + self.text
+    
+    def save(self, history):
+        """
+        The save method is used to save the tweet to the database on its own.  Where possible a page of tweets
+        should be saved together using the TweetPageWriter.
+        """
+        
+        writer = TweetPageWriter()
+        writer.add(self)
+        writer.flush()
+
+class TweetBatch(object):
+    """
+    The TweetBatch class is used to hold a page of tweets in a compact, columnar form.  Each of the tweet fields 
+    is stored in its own list, and the rows are only turned into (lightweight) TweetView objects as they are 
+    accessed.  This means that a whole page can be inspected without creating a full object for every tweet.
+    """
+    
+    __slots__ = ('columns',)
+    
+    def __init__(self):
+        """
+        Initialise an empty batch
+        """
+        
+        # initialise the columns
+        self.columns = {}
+        for field in TWEET_FIELDS + ('worthSaving',):
+            self.columns[field] = []
+            
+    def __len__(self):
+        return len(self.columns['id'])
+    
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield TweetView(self, index)
+            
+    def __getitem__(self, index):
+        # support negative indexes in the same way a list does
+        if index < 0:
+            index += len(self)
+            
+        if (index < 0) or (index >= len(self)):
+            raise IndexError("tweet batch index out of range")
+        
+        return TweetView(self, index)
+    
+    def column(self, field):
+        """
+        This method is used to return the list of values for the specified field, the list should be treated
+        as read only
+        """
+        
+        return self.columns[field]
+    
+    def appendValues(self, values):
+        """
+        This method is used to add a tweet to the batch from a sequence of values that are ordered in the
+        same way as TWEET_FIELDS
+        """
         
+        for (field, value) in zip(TWEET_FIELDS, values):
+            self.columns[field].append(value)
+            
+        # new tweets are worth saving until an inspector decides otherwise
+        self.columns['worthSaving'].append(True)
+        
+    def append(self, tweet):
+        """
+        This method is used to add a Tweet (or TweetView) to the batch
+        """
+        
+        self.appendValues([getattr(tweet, field) for field in TWEET_FIELDS])
+        self.columns['worthSaving'][-1] = tweet.worthSaving
+        
+    def extend(self, batch):
+        """
+        This method is used to add all of the tweets from another batch to the end of this batch
+        """
+        
+        for (field, values) in batch.columns.items():
+            self.columns[field].extend(values)
+            
+    def highTweetId(self):
+        """
+        This method is used to return the highest tweet id in the batch
+        """
+        
+        if len(self) == 0:
+            return 0
+        
+        return max(self.columns['id'])
+
+class TweetPageWriter:
+    """
+    The TweetPageWriter is used to collect the tweets that are worth saving from a single page of results and
+    then write them to the database in one go.  Rather than each tweet looking up its users and saving itself,
+    the writer resolves all of the users referenced on the page with a single multi-get and then saves the
+    tweets (along with any new users) using a single batched put.
+
+    Tweets are stored against their twitter id, and tweets that have already been saved (by another rule for
+    instance) are skipped.  The tweets on the page are checked against the datastore with a single multi-get (the
+    seen tweet filter is kept up to date, but a filter that has forgotten a tweet mustn't cause a saved tweet to
+    be overwritten).  The tweets that are written are also added to the full text index.
+
+    Each tweet records the names of the rules that found it.  If a rule finds a tweet that was saved by another
+    rule, the rule is added to the saved tweet.
+
+    The values of the queued tweets are copied into a TweetBatch, so the writer doesn't hold on to the page the
+    tweets came from, and the tweet models are only created for the tweets that are written.
+    """
+
+    def __init__(self, seen_filter = None, index_tweets = True):
+        """
+        Initialise the page writer
+
+        @seen_filter the filter of recently saved tweets, the shared filter is used if this is not specified
+        @index_tweets if True then the tweets that are written are added to the full text index
+        """
+
+        # initialise members
+        self.tweets = TweetBatch()
+        self.tweetRules = {}
+        self.updatedTweets = []
+        self.seenFilter = _seenTweets if (seen_filter is None) else seen_filter
+        self.indexTweets = index_tweets
+        self.skippedCount = 0
+
+    def add(self, tweet, rule_name = None):
+        """
+        This method is used to queue a tweet to be written when the page is flushed
+
+        @tweet the tweet to write
+        @rule_name the name of the rule that found the tweet
+        """
+
+        # a tweet found by more than one rule only needs to be queued once
+        if tweet.id not in self.tweetRules:
+            self.tweets.append(tweet)
+            self.tweetRules[tweet.id] = set()
+
+        # rule names are stored in lower case, the same as the rules themselves
+        if rule_name:
+            self.tweetRules[tweet.id].add(rule_name.lower())
+
+    def flush(self):
+        """
+        This method is used to write the queued tweets to the database.  The method returns the number
+        of tweets that were written.
+        """
+
+        # if we have nothing to write, then don't bother going any further
+        if not self.tweets:
+            return 0
+
+        # leave out the tweets that have already been saved (but save the rules that have found them)
+        self.tweets = self.removeSaved(self.tweets)
+        if self.updatedTweets:
+            db.put(self.updatedTweets)
+            self.updatedTweets = []
+
+        if not self.tweets:
+            self.tweets = TweetBatch()
+            self.tweetRules = {}
+            return 0
+
+        # gather the details of all of the users referenced by the tweets
+        userDetails = {}
+        for tweet in self.tweets:
+            userDetails[tweet.from_user_id] = (tweet.from_user, tweet.profile_image_url)
+
+            # the recipient of the tweet is only known by id, so don't overwrite any details we have
+            if tweet.to_user_id not in userDetails:
+                userDetails[tweet.to_user_id] = (None, None)
+
+        # find the users in one hit, new users will be written in the same batch as the tweets
+        (users, entities) = twawlermodel.TwitterUser.findOrCreateMany(userDetails)
+
+        # create the tweet model objects
+        for tweet in self.tweets:
+            entities.append(twawlermodel.Tweet(key_name = twawlermodel.Tweet.keyNameFor(tweet.id),
+                                               tweet_id = tweet.id,
+                                               created_at = tweet.created_at,
+                                               from_user = users.get(tweet.from_user_id),
+                                               from_user_name = tweet.from_user,
+                                               profile_image_url = tweet.profile_image_url,
+                                               to_user = users.get(tweet.to_user_id),
+                                               text = tweet.text,
+                                               iso_language_code = tweet.iso_language_code,
+                                               rules = sorted(self.tweetRules.get(tweet.id, []))))
+
+        # save everything to the database (the datastore limits how many entities we can put in one call)
+        for offset in range(0, len(entities), MAX_BATCH_PUT):
+            db.put(entities[offset:offset + MAX_BATCH_PUT])
+
+        # now the new users have been saved we can cache them
+        newUsers = entities[:len(entities) - len(self.tweets)]
+        if newUsers:
+            twawlermodel.TwitterUser.cacheMany(newUsers)
+
+        # add the tweets to the full text index
+        if self.indexTweets:
+            tweetindex.TweetPosting.addTweets(self.tweets)
+
+        # and remember that the tweets have been saved
+        self.seenFilter.addMany([tweet.id for tweet in self.tweets])
+        self.seenFilter.save()
+
+        logging.debug("wrote %s tweets and %s users in a single batch", len(self.tweets), len(entities) - len(self.tweets))
+
+        # reset the tweets ready for the next page
+        fnresult = len(self.tweets)
+        self.tweets = TweetBatch()
+        self.tweetRules = {}
+
+        return fnresult
+
+    def removeSaved(self, tweets):
+        """
+        This method is used to remove the tweets that have already been saved from the specified list of tweets.
+        All of the tweets on the page are checked against the datastore with a single multi-get, the seen filter
+        can forget tweets (its windows expire, memcache can evict it, and another task may be saving the same 
+        tweet) so a tweet it doesn't know about isn't assumed to be new.  Saved tweets that haven't recorded all of
+        the rules that found them are queued in updatedTweets, so the rules are merged rather than overwritten.
+        """
+
+        # initialise variables
+        fnresult = []
+        pageTweets = []
+        tweetIds = set()
+        forgottenCount = 0
+
+        # make sure the same tweet doesn't appear twice on the page
+        for tweet in tweets:
+            if tweet.id not in tweetIds:
+                tweetIds.add(tweet.id)
+                pageTweets.append(tweet)
+
+        # check all of the tweets against the datastore
+        self.seenFilter.load()
+        savedTweets = twawlermodel.Tweet.get_by_key_name([twawlermodel.Tweet.keyNameFor(tweet.id) for tweet in pageTweets])
+
+        for (tweet, savedTweet) in zip(pageTweets, savedTweets):
+            if savedTweet is None:
+                fnresult.append(tweet)
+                continue
+
+            # keep track of the saved tweets the filter had forgotten about (so the filter can be tuned)
+            if not self.seenFilter.mightContain(tweet.id):
+                forgottenCount += 1
+
+            # add any rules that the saved tweet doesn't know about yet
+            newRules = self.tweetRules.get(tweet.id, set()).difference(savedTweet.rules)
+            if newRules:
+                savedTweet.rules = sorted(newRules.union(savedTweet.rules))
+                self.updatedTweets.append(savedTweet)
+
+        # keep a count of the tweets we didn't need to write
+        self.skippedCount += len(tweets) - len(fnresult)
+        logging.debug("skipping %s tweets that have already been saved (%s of them not in the seen filter)", len(tweets) - len(fnresult), forgottenCount)
+
+        return fnresult
+
 class TwitterRequest():
     """
     This class is used to define a base class for all other twitter requests.  The request handles
@@ -371,9 +1003,27 @@ class TwitterRequest():
         self.urlAuthToken = url_auth_token
         self.accessToken = None
         self.successful = False
+        self.transport = transport.getTransport()
+        self.pendingFetch = None
+        self.conditionalGet = False
+        self.notModified = False
+        self.scheduler = None
+        self.rateLimited = False
+        self.retryPolicy = resilience.RetryPolicy()
+        self.useCircuitBreaker = True
+        self.circuitOpen = False
+        self.deadline = None
+        self.retryAt = None
+        self.retryAttempt = 0
+        self._attempt = 0
+        self._pendingAction = None
+        self._rateLimitBucket = None
+        self._responseCacheKey = None
+        self._cachedResponse = None
+        self._responseToCache = None
         
         # load the configuration information
-        self.config = TwitterConfig() if (twitter_config is None) else twitter_config
+        self.config = TwitterConfig.get() if (twitter_config is None) else twitter_config
         
     def execute(self, responseCallback = None):
         """
@@ -384,63 +1034,334 @@ class TwitterRequest():
         @reponseCallback - a function that will be executed if we successfully return a response
         """
         
+        # make the request
+        content = self.fetchContent()
+        
+        # if the request was successful, then process the response
+        if content is not None:
+            self.processResponse(content, responseCallback)
+            self.cacheResponse()
+            
+    def fetchContent(self, attempt = 0):
+        """
+        The fetchContent method is used to prepare and sign the request, send it to twitter and return the
+        content of the response.  If the request could not be made, or was not successful, None is returned.
+        Requests that fail with a server error (or get no response at all) are retried according to the retry 
+        policy.
+        
+        @attempt - the number of attempts that have already been made
+        """
+        
+        while True:
+            # prepare the request (this is done for each attempt so each attempt is signed with a fresh nonce)
+            prepared = self.prepareFetch()
+            if prepared is None:
+                return None
+            
+            # alright make the request
+            (nextAction, headers) = prepared
+            try:
+                request_result = self.transport.fetch(nextAction, headers = headers, deadline = self.getFetchDeadline())
+            except transport.TransportError:
+                logging.exception("Twitter api call failed: %s", nextAction)
+                request_result = None
+                
+            # check whether we should try again
+            retryDelay = self.checkAttempt(nextAction, request_result, attempt)
+            if retryDelay is None:
+                break
+            
+            logging.info("Twitter api call failed, retrying in %.2f seconds: %s", retryDelay, nextAction)
+            time.sleep(retryDelay)
+            attempt += 1
+            
+        # if we didn't get a response, then there is nothing to read
+        if request_result is None:
+            return None
+        
+        return self.readResult(request_result)
+    
+    def getFetchDeadline(self, deadline = None):
+        """
+        The getFetchDeadline method is used to work out how many seconds a fetch should wait for the response.  We
+        never wait longer than MAX_REQUEST_DEADLINE, or past the deadline of the request.
+        
+        @deadline - the maximum number of seconds the caller wants to wait (if any)
+        """
+        
+        fnresult = MAX_REQUEST_DEADLINE
+        if deadline is not None:
+            fnresult = min(fnresult, deadline)
+            
+        # if the request has a deadline, then don't wait beyond it
+        if self.deadline is not None:
+            timeRemaining = self.deadline - datetime.datetime.utcnow()
+            fnresult = min(fnresult, timeRemaining.days * 86400 + timeRemaining.seconds)
+            
+        # always allow at least a second, otherwise the request can't succeed
+        return max(fnresult, 1)
+    
+    def startFetch(self, deadline = None, attempt = 0):
+        """
+        The startFetch method is used to prepare and sign the request and then send it to twitter without 
+        waiting for the response.  The transport handle for the request is returned (or None if the request could
+        not be made) and the response can be processed once it has arrived using completeFetch.
+        
+        @deadline - the maximum number of seconds to wait for the response
+        @attempt - the number of attempts that have already been made (when retrying, see completeFetch)
+        """
+        
+        # initialise variables
+        self.pendingFetch = None
+        self.retryAt = None
+        self._attempt = attempt
+        
+        # prepare the request
+        prepared = self.prepareFetch()
+        if prepared is None:
+            return None
+        
+        # start the request
+        (nextAction, headers) = prepared
+        try:
+            self.pendingFetch = self.transport.startFetch(nextAction, headers = headers, deadline = self.getFetchDeadline(deadline))
+            self._pendingAction = nextAction
+        except transport.TransportError:
+            logging.exception("Unable to start twitter api call: %s", nextAction)
+            self.checkAttempt(nextAction, None, attempt)
+            
+        return self.pendingFetch
+    
+    def completeFetch(self, responseCallback = None):
+        """
+        The completeFetch method is used to wait for the response to a request started with startFetch (if it
+        hasn't already arrived) and then process the response in the same way as execute.  If the request failed 
+        and the retry policy allows it to be retried, then nothing is processed and retryAt is set to the time the
+        retry should be made.  The caller then either starts the request again when it is due (using startFetch 
+        with retryAttempt) or, if it has nothing else to wait on, calls executeRetry.
+        
+        @reponseCallback - a function that will be executed if we successfully return a response
+        """
+        
+        # if the request was never started, then there is nothing to do
+        if self.pendingFetch is None:
+            return
+        
+        # get the result of the request
+        try:
+            request_result = self.pendingFetch.getResult()
+        except transport.TransportError:
+            logging.exception("Twitter api call failed: %s", self._pendingAction)
+            request_result = None
+            
+        self.pendingFetch = None
+        
+        # if the request failed and can be retried, then let the caller know when the retry is due
+        retryDelay = self.checkAttempt(self._pendingAction, request_result, self._attempt)
+        if retryDelay is not None:
+            logging.info("Twitter api call failed, retry due in %.2f seconds: %s", retryDelay, self._pendingAction)
+            self.retryAt = datetime.datetime.utcnow() + datetime.timedelta(seconds = retryDelay)
+            self.retryAttempt = self._attempt + 1
+            return
+        
+        # if the request was successful, then process the response
+        if request_result is not None:
+            content = self.readResult(request_result)
+            if content is not None:
+                self.processResponse(content, responseCallback)
+                self.cacheResponse()
+            
+    def executeRetry(self, responseCallback = None):
+        """
+        The executeRetry method is used to wait until the retry set up by completeFetch is due, and then run the
+        request again in the same way as execute.  This blocks, so it should only be used when there is nothing
+        else to wait on.
+        
+        @reponseCallback - a function that will be executed if we successfully return a response
+        """
+        
+        # wait until the retry is due
+        if self.retryAt is not None:
+            retryDelay = self.retryAt - datetime.datetime.utcnow()
+            if retryDelay > datetime.timedelta(0):
+                time.sleep(retryDelay.seconds + retryDelay.microseconds / 1000000.0)
+                
+        self.retryAt = None
+        
+        # make the request (any further retries are made by fetchContent)
+        content = self.fetchContent(self.retryAttempt)
+        if content is not None:
+            self.processResponse(content, responseCallback)
+            self.cacheResponse()
+            
+    def prepareFetch(self):
+        """
+        The prepareFetch method is used to prepare the url for the request and sign it.  A tuple of the url and
+        the headers to send is returned, or None if we are unable to make the request.
+        """
+        
         # initialise variables
         payload = {}
-        token = None
-        oauth_request = None
+        headers = None
         
         # prepare the url
         nextAction = self.prepareRequest(payload)
         
         # if authentication is required, then prepare the request
         if self.authRequired:
-            # create an oauth consumer
-            consumer = oauth.OAuthConsumer(self.config.consumerKey, self.config.consumerSecret)
-            
             # find the access key for the specified user (if we haven't got it already)
             if self.accessToken is None:
                 self.accessToken = TwitterAuth.getAccessToken(self.config, self.allowInit, self.urlAuthToken)
 
-            # if we have an accessToken, the extract the token
+            # if we have an accessToken, then sign the request
             if self.accessToken is not None:
-                logging.debug("attempting to parse access token: %s", self.accessToken)
-                token = oauth.OAuthToken.from_string(self.accessToken)
-            
-            # create the oauth request
-            if token is not None:
-                # TODO: find a better python way to do this
-                try:
-                    (request_url, request_querystr) = nextAction.split('?')
-                except:
-                    request_url = nextAction
-                    request_querystr = ''
-                
-                
-                logging.debug("creating token for url: %s query_string: %s", request_url, request_querystr)
-                oauth_request = oauth.OAuthRequest.from_consumer_and_token(consumer, token = token, http_url = request_url, parameters = oauth.OAuthRequest._split_url_string(request_querystr))
-                oauth_request.sign_request(oauth.OAuthSignatureMethod_HMAC_SHA1(), consumer, token)
+                headers = OAuthSigner.forToken(self.config, self.accessToken).sign(nextAction)
             else:
                 logging.error("Request required authentication, however, no suitable access token available.")
         
         # if we have an oauth access key, then we can access twitter, otherwise, bail out.
-        if (oauth_request is not None):
-            # make the request
-            logging.debug("Attempting to perform twitter api call: %s", nextAction)
+        if (headers is None):
+            logging.warning("TWITTER SEARCH NOT DONE, NO OAUTH INITIALIZATION PERMITTED")
+            return None
+        
+        logging.debug("Attempting to perform twitter api call: %s", nextAction)
+        
+        # if the endpoint has been failing, then don't bother making the request until it has had time to recover
+        if self.useCircuitBreaker and (not resilience.CircuitBreaker.forUrl(nextAction).allowRequest()):
+            logging.warning("TWITTER REQUEST NOT DONE, CIRCUIT IS OPEN")
+            self.circuitOpen = True
+            return None
+        
+        # if we have seen a response for this request before, then only ask for the content if it has changed
+        if self.conditionalGet:
+            self._addConditionalHeaders(nextAction, headers)
             
-            # alright make the request
-            request_result = urlfetch.fetch(url = nextAction, headers = oauth_request.to_header())
-
-            # if we received a request result, then process
-            if (request_result.status_code == 200):
-                self.successful = True
-                logging.debug("Got successful response from api call, going to parse results: %s", request_result.content)
-                
-                # use simple json to decode the response
-                self.processResponse(request_result.content, responseCallback)
+        # if we are sharing a rate limit, then make sure we are allowed to make the request
+        self._rateLimitBucket = self.getRateLimitBucket(nextAction)
+        if (self.scheduler is not None) and (not self.scheduler.acquire(self._rateLimitBucket)):
+            logging.warning("TWITTER REQUEST NOT DONE, RATE LIMIT IS RUNNING LOW")
+            self.rateLimited = True
+            return None
+        
+        return (nextAction, headers)
+    
+    def getRateLimitBucket(self, nextAction):
+        """
+        The getRateLimitBucket method is used to return the name of the rate limit bucket the request counts 
+        against.  Twitter limits each account separately for each endpoint, so the bucket is made up of the access
+        token and the url of the endpoint (without the query string).
+        
+        @nextAction - the url that will be requested
+        """
+        
+        (scheme, netloc, path, query, fragment) = urlparse.urlsplit(nextAction)
+        
+        return "%s %s://%s%s" % (self.accessToken, scheme, netloc, path)
+    
+    def checkAttempt(self, nextAction, request_result, attempt):
+        """
+        The checkAttempt method is used to record the outcome of an attempt with the circuit breaker for the endpoint,
+        and decide whether the request should be retried.  The number of seconds to wait before retrying is returned,
+        or None if the request should not be retried.
+        
+        @nextAction - the url that was requested
+        @request_result - the result returned by the transport (or None if no response was received)
+        @attempt - the number of the attempt (starting at zero)
+        """
+        
+        # if we have no retry policy, then use one that never retries
+        retryPolicy = self.retryPolicy or resilience.RetryPolicy(maxAttempts = 1)
+        failed = retryPolicy.isFailure(request_result)
+        
+        # let the circuit breaker know how we got on, if that opened the circuit then there is no point retrying
+        if self.useCircuitBreaker:
+            breaker = resilience.CircuitBreaker.forUrl(nextAction)
+            if not failed:
+                breaker.recordSuccess()
             else:
-                logging.warning("TWITTER SEARCH FAILED (%s): %s", request_result.status_code, request_result.content)
-        else:   
-            logging.warning("TWITTER SEARCH NOT DONE, NO OAUTH INITIALIZATION PERMITTED")
+                breaker.recordFailure()
+                if breaker.isOpen():
+                    return None
+                
+        # if the attempt failed, then check whether we should try again
+        if not failed:
+            return None
+        
+        return retryPolicy.getDelay(attempt, self.deadline)
+    
+    def _addConditionalHeaders(self, nextAction, headers):
+        """
+        This method is used to look for the details of the last response to the request in the cache, and add the
+        headers that tell twitter to only return the content if it has changed.  Responses are cached against the
+        url and the access token, as different accounts will see different content for the same url.
+        """
+        
+        # look for the last response
+        self._responseCacheKey = cachehelper.createCacheKey("twitter-response", hashlib.md5("%s %s" % (nextAction, self.accessToken)).hexdigest())
+        self._cachedResponse = memcache.get(self._responseCacheKey)
+        
+        # add the conditional headers
+        if self._cachedResponse is not None:
+            if self._cachedResponse.get('etag'):
+                headers['If-None-Match'] = self._cachedResponse['etag']
+                
+            if self._cachedResponse.get('lastModified'):
+                headers['If-Modified-Since'] = self._cachedResponse['lastModified']
+                
+    def cacheResponse(self):
+        """
+        The cacheResponse method is used to save the details of the response for a conditional request to the cache,
+        once the response has been processed successfully.
+        """
+        
+        if self._responseToCache is not None:
+            memcache.set(self._responseCacheKey, self._responseToCache, time = RESPONSE_CACHE_TIME)
+            self._responseToCache = None
+    
+    def readResult(self, request_result):
+        """
+        The readResult method is used to check the result of a request, returning the content of the response
+        if the request was successful or None otherwise.
+        
+        @request_result - the result returned by the transport
+        """
+        
+        # let the scheduler know where we are with the rate limit
+        if self.scheduler is not None:
+            self.scheduler.update(request_result, self._rateLimitBucket)
+            
+        # if this is a conditional request and twitter tells us nothing has changed, then we have nothing to process
+        if self.conditionalGet and (request_result.status_code == 304):
+            logging.debug("Response has not been modified since the last request")
+            self.successful = True
+            self.notModified = True
+            return None
+        
+        # if we received a request result, then process
+        if (request_result.status_code == 200):
+            self.successful = True
+            logging.debug("Got successful response from api call, going to parse results: %s", request_result.content)
+            
+            # if this is a conditional request, then check the content has actually changed
+            if self.conditionalGet:
+                digest = hashlib.md5(request_result.content).hexdigest()
+                
+                if (self._cachedResponse is not None) and (self._cachedResponse.get('digest') == digest):
+                    logging.debug("Response is the same as the last response, no need to process it")
+                    self.notModified = True
+                    return None
+                
+                # hold on to the details of the response, they will be cached once the response has been processed
+                self._responseToCache = {
+                    'etag': request_result.getHeader('etag'),
+                    'lastModified': request_result.getHeader('last-modified'),
+                    'digest': digest,
+                }
+            
+            return request_result.content
+        
+        logging.warning("TWITTER SEARCH FAILED (%s): %s", request_result.status_code, request_result.content)
+        return None
             
             
 class TwitterGetStatusesRequest(TwitterRequest):
@@ -463,11 +1384,144 @@ class TwitterGetStatusesRequest(TwitterRequest):
         
         # initialise members
         self.highTweetId = 0
-        self.tweets = []
+        self.tweets = TweetBatch()
+        self.conditionalGet = True
+        self.retainTweets = True
+        self.pageCallback = None
+        self.nextPageCallback = None
         
     def getActionAndParams(self):
 
         return (URL_STATUSES_HOME_TIMELINE, {})
+    
+    def mapResult(self, singleResult):
+        """
+        This method is used to map a single decoded result from twitter to a sequence of values ordered in the 
+        same way as TWEET_FIELDS.  The statuses api returns the details of the user in a nested dict.
+        
+        @singleResult - the decoded json dict for a single status
+        """
+        
+        # read the created date (if we don't have one, then assume the tweet was created now)
+        created_at = singleResult.get('created_at')
+        if created_at is None:
+            created_at = datetime.datetime.utcnow()
+        else:
+            created_at = datehelper.parseTwitterDate(created_at, DATETIME_FORMAT_TWITTER)
+        
+        return (singleResult.get('id', 0),
+                created_at,
+                singleResult['user']['name'],
+                singleResult['user']['id'],
+                singleResult.get('in_reply_to_user_id', 0),
+                singleResult.get('text', ''),
+                singleResult['user']['profile_image_url'],
+                singleResult.get('source', ''),
+                singleResult.get('iso_language_code', 'en'))
+    
+    def processResponse(self, content, responseCallback):
+        """
+        This method is used to process the response from twitter in the case that our request has been successful
+
+        @content - the content of the response returned from the request
+        @responseCallback - a method callback that can be used to push details back to the calling method
+        """
+        
+        # build the page of tweets from the results as they are decoded
+        page = TweetBatch()
+        for singleResult in self.iterResults(content):
+            page.appendValues(self.mapResult(singleResult))
+            
+        # if there is another page, then let the next page callback know before we start processing this page
+        if (self.nextPage is not None) and (self.nextPageCallback is not None):
+            self.nextPageCallback(self)
+            
+        # process the page
+        self.processPage(page, responseCallback)
+        
+    def iterResults(self, content):
+        """
+        This method is used to decode the results from the content of a response one at a time.  The statuses
+        api returns an array of statuses.
+        
+        @content - the content of the response returned from the request
+        """
+        
+        return JsonStreamDecoder(content).iterArray()
+    
+    def iterTweets(self, responseCallback = None):
+        """
+        The iterTweets method is used to make the request and then yield each of the tweets in the response as
+        it is decoded, rather than decoding the whole response and building a page of tweets first.  Each tweet 
+        is added to a batch as it is decoded and a TweetView of the row is yielded.  If retainTweets is False, the 
+        tweets are added to a batch for the response rather than to the tweets of the request.
+        
+        @reponseCallback - a function that will be called with each tweet before it is yielded
+        """
+        
+        # make the request
+        content = self.fetchContent()
+        if content is None:
+            return
+        
+        # work out which batch the tweets are added to
+        if self.retainTweets:
+            page = self.tweets
+        else:
+            page = TweetBatch()
+        
+        # decode the results one at a time
+        for singleResult in self.iterResults(content):
+            page.appendValues(self.mapResult(singleResult))
+            tweetResult = page[-1]
+            
+            # if the response callback is defined, then give it some information
+            if responseCallback is not None:
+                responseCallback(tweetResult)
+                
+            yield tweetResult
+            
+        # now all of the tweets have been processed, we can cache the response
+        self.cacheResponse()
+        
+    def executeStreaming(self, responseCallback = None):
+        """
+        The executeStreaming method is used to run the request in the same way as execute, except that each tweet
+        is passed to the response callback as soon as it is decoded rather than once the whole page has been 
+        built.  The page callback and next page callback are not called, so execute should be used when they
+        are needed.
+        
+        @reponseCallback - a function that will be executed for each tweet in the response
+        """
+        
+        for tweetResult in self.iterTweets(responseCallback):
+            pass
+        
+    def processPage(self, page, responseCallback):
+        """
+        This method is used to pass a page of tweets to the page callback (if set) and then each of the tweets
+        in turn to the response callback.  The page is then added to the tweets for the request.
+        
+        @page - the TweetBatch containing the tweets that were returned in the response
+        @responseCallback - a method callback that can be used to push details back to the calling method
+        """
+        
+        # if the page callback is defined, then give it the whole page to work on
+        if self.pageCallback is not None:
+            self.pageCallback(page)
+            
+        # if the response callback is defined, then give it each of the tweets
+        if responseCallback is not None:
+            for tweetResult in page:
+                responseCallback(tweetResult)
+                
+        # add the page to the tweets (in the usual case of a single page we can just keep the page)
+        if not self.retainTweets:
+            pass
+        elif len(self.tweets) == 0:
+            self.tweets = page
+        else:
+            self.tweets.extend(page)
         
     def prepareRequest(self, postParams):
         """
@@ -506,37 +1560,6 @@ class TwitterMentionsRequest(TwitterGetStatusesRequest):
     
     def getActionAndParams(self):
         return (URL_STATUSES_MENTIONS, {})
-        
-    def processResponse(self, content, responseCallback):
-        """
-        This method is used to process the response from twitter in the case that our request has been successful
-
-        @content - the content of the response returned from the request
-        @responseCallback - a method callback that can be used to push details back to the calling method
-        """
-        # decode the json response
-        searchResults = simplejson.loads(content)
-        for singleResult in searchResults:
-            # create the new tweet instance
-            tweetResult = Tweet()
-            
-            # TODO: investigate implementing a generic mapping behaviour
-            tweetResult.id = singleResult.get('id', 0)
-            tweetResult.created_at = datetime.datetime.strptime(singleResult.get('created_at', tweetResult.created_at.strftime(DATETIME_FORMAT_TWITTER)), DATETIME_FORMAT_TWITTER)
-            tweetResult.from_user = singleResult['user']['name']
-            tweetResult.from_user_id = singleResult['user']['id']
-            tweetResult.to_user_id = singleResult.get('in_reply_to_user_id', tweetResult.to_user_id)
-            tweetResult.text = singleResult.get('text', tweetResult.text)
-            tweetResult.profile_image_url = singleResult['user']['profile_image_url']
-            tweetResult.source = singleResult.get('source', tweetResult.source)
-            tweetResult.iso_language_code = singleResult.get('iso_language_code', tweetResult.iso_language_code)            
-
-            # if the response callback is defined, then give it some information
-            if responseCallback is not None:
-                responseCallback(tweetResult)
-
-            # add the tweet to the array
-            self.tweets.append(tweetResult)
             
 class TwitterSearchRequest(TwitterGetStatusesRequest):
     """
@@ -555,39 +1578,61 @@ class TwitterSearchRequest(TwitterGetStatusesRequest):
         # initialise members
         self.searchQuery = ""
         
+        # search requests change with every since id, so there is little point making them conditional
+        self.conditionalGet = False
+        
     def getActionAndParams(self):
 
         return (URL_SEARCH, { 'q': self.searchQuery })
         
-    def processResponse(self, content, responseCallback):
+    def iterResults(self, content):
         """
-        This method is used to process the response from twitter in the case that our request has been successful
-
+        This method is used to decode the results from the content of a response one at a time.  The search
+        api returns an object with the results in an array (and the details of the next page alongside it).
+        
         @content - the content of the response returned from the request
-        @responseCallback - a method callback that can be used to push details back to the calling method
         """
-        # decode the json response
-        searchResults = simplejson.loads(content)
-        logging.debug("TwitterSearchRequest processing the response")
-
-        # check to see if we have a next page to process
+        
+        # reset the next page, it will be set while decoding if there is another page to process (this is done 
+        # here so that both processResponse and iterTweets start each response without a next page)
         self.nextPage = None
-        if (PARAM_NEXTPAGE in searchResults):
+        
+        return JsonStreamDecoder(content).iterObjectArray('results', self._readSearchMember)
+    
+    def _readSearchMember(self, key, value):
+        """
+        This method is used to read the members of the search response (other than the results)
+        """
+        
+        # check to see if we have a next page to process
+        if key == PARAM_NEXTPAGE:
             logging.info("Another page of results found, will continue search")
-            self.nextPage = searchResults[PARAM_NEXTPAGE]
-
-        # iterate through the results
-        if 'results' in searchResults:
-            for singleResult in searchResults['results']:
-                # create the new tweet instance
-                tweetResult = Tweet(singleResult)
-
-                # if the response callback is defined, then give it some information
-                if responseCallback is not None:
-                    responseCallback(tweetResult)
-
-                # add the tweet to the array
-                self.tweets.append(tweetResult)
+            self.nextPage = value
+            
+    def mapResult(self, singleResult):
+        """
+        This method is used to map a single decoded search result to a sequence of values ordered in the same
+        way as TWEET_FIELDS.  Search results hold the details of the user directly in the result.
+        
+        @singleResult - the decoded json dict for a single search result
+        """
+        
+        # read the created date (if we don't have one, then assume the tweet was created now)
+        created_at = singleResult.get('created_at')
+        if created_at is None:
+            created_at = datetime.datetime.utcnow()
+        else:
+            created_at = datehelper.parseTwitterDate(created_at, DATETIME_FORMAT_TWITTER)
+        
+        return (singleResult.get('id', 0),
+                created_at,
+                singleResult.get('from_user', 0),
+                singleResult.get('from_user_id', 0),
+                singleResult.get('to_user_id', 0),
+                singleResult.get('text', ''),
+                singleResult.get('profile_image_url', ''),
+                singleResult.get('source', ''),
+                singleResult.get('iso_language_code', 'en'))
 
                 
 class TwitterLoginRequest(TwitterRequest):
@@ -636,10 +1681,17 @@ class TwitterLoginRequest(TwitterRequest):
         # if we have have a url auth token, then update the oauth details
         if self.urlAuthToken:
             auth_data = OAuthAccessKey.findByRequestKey(self.urlAuthToken)
+            previousUserName = auth_data.userName
             auth_data.userId = searchResults.get('id')
             auth_data.userName = searchResults.get('screen_name')
             auth_data.put()
             
+            # make sure the cached copies of the key aren't returned without the user details (or under the old
+            # screen name, if it has changed)
+            OAuthAccessKey.invalidateAccessToken(auth_data.requestKey, auth_data.userName)
+            if previousUserName and (previousUserName != auth_data.userName):
+                OAuthAccessKey.invalidateAccessToken(auth_data.requestKey, previousUserName)
+            
         # read the unique numeric id of the user from twitter
         self.twitterId = searchResults.get('id', self.twitterId)
         